@@ -1,121 +1,512 @@
+import csv
+import gzip
+import hashlib
+import json
 import sqlite3
 from pathlib import Path
 
 import pandas as pd
 
-DB_PATH = Path("sportpulse.db")
+from db_connection import DB_PATH, get_manager
+from perf import timed
+from schema import ensure_schema, invalidate_rollups, read_watermark, to_epoch_seconds
 
+ROLLUP_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        name TEXT PRIMARY KEY,
+        last_rowid INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rollup_facility (
+        facility_id INTEGER PRIMARY KEY,
+        sum_y REAL NOT NULL,
+        sum_price REAL NOT NULL,
+        sum_event_distance REAL NOT NULL,
+        obs_count INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rollup_week (
+        week_of_year INTEGER PRIMARY KEY,
+        sum_y REAL NOT NULL,
+        sum_price REAL NOT NULL,
+        obs_count INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rollup_facility_week (
+        facility_id INTEGER NOT NULL,
+        week_of_year INTEGER NOT NULL,
+        sum_y REAL NOT NULL,
+        sum_price REAL NOT NULL,
+        obs_count INTEGER NOT NULL,
+        weekend_sum_y REAL NOT NULL,
+        weekend_count INTEGER NOT NULL,
+        PRIMARY KEY (facility_id, week_of_year)
+    );
+"""
 
-def load_sql_summary(db_path=DB_PATH):
-    db_path = Path(db_path)
-    if not db_path.exists():
-        raise FileNotFoundError(f"Database not found: {db_path}")
-    with sqlite3.connect(db_path) as conn:
-        query = """
-            SELECT
-                facility_id,
-                ROUND(AVG(y), 2) AS avg_demand,
-                ROUND(AVG(price), 2) AS avg_price,
-                ROUND(AVG(distance_to_event), 2) AS avg_event_distance,
-                COUNT(*) AS obs_count
-            FROM sport_data
-            GROUP BY facility_id
-            ORDER BY avg_demand DESC
+# Yeni satırların kısmi toplamları mevcut toplamlara eklenir (UPSERT)
+ROLLUP_UPDATES = (
+    """
+    INSERT INTO rollup_facility (facility_id, sum_y, sum_price, sum_event_distance, obs_count)
+    SELECT facility_id, TOTAL(y), TOTAL(price), TOTAL(distance_to_event), COUNT(*)
+    FROM sport_data
+    WHERE rowid > :last_rowid AND rowid <= :max_rowid
+    GROUP BY facility_id
+    ON CONFLICT(facility_id) DO UPDATE SET
+        sum_y = sum_y + excluded.sum_y,
+        sum_price = sum_price + excluded.sum_price,
+        sum_event_distance = sum_event_distance + excluded.sum_event_distance,
+        obs_count = obs_count + excluded.obs_count
+    """,
+    """
+    INSERT INTO rollup_week (week_of_year, sum_y, sum_price, obs_count)
+    SELECT week_of_year, TOTAL(y), TOTAL(price), COUNT(*)
+    FROM sport_data
+    WHERE rowid > :last_rowid AND rowid <= :max_rowid
+    GROUP BY week_of_year
+    ON CONFLICT(week_of_year) DO UPDATE SET
+        sum_y = sum_y + excluded.sum_y,
+        sum_price = sum_price + excluded.sum_price,
+        obs_count = obs_count + excluded.obs_count
+    """,
+    """
+    INSERT INTO rollup_facility_week (
+        facility_id, week_of_year, sum_y, sum_price, obs_count, weekend_sum_y, weekend_count
+    )
+    SELECT
+        facility_id,
+        week_of_year,
+        TOTAL(y),
+        TOTAL(price),
+        COUNT(*),
+        TOTAL(CASE WHEN is_weekend = 1 THEN y END),
+        SUM(CASE WHEN is_weekend = 1 THEN 1 ELSE 0 END)
+    FROM sport_data
+    WHERE rowid > :last_rowid AND rowid <= :max_rowid
+    GROUP BY facility_id, week_of_year
+    ON CONFLICT(facility_id, week_of_year) DO UPDATE SET
+        sum_y = sum_y + excluded.sum_y,
+        sum_price = sum_price + excluded.sum_price,
+        obs_count = obs_count + excluded.obs_count,
+        weekend_sum_y = weekend_sum_y + excluded.weekend_sum_y,
+        weekend_count = weekend_count + excluded.weekend_count
+    """,
+)
+
+
+SQL_SUMMARY_QUERY = """
+    SELECT
+        facility_id,
+        ROUND(sum_y / obs_count, 2) AS avg_demand,
+        ROUND(sum_price / obs_count, 2) AS avg_price,
+        ROUND(sum_event_distance / obs_count, 2) AS avg_event_distance,
+        obs_count
+    FROM rollup_facility
+    ORDER BY avg_demand DESC
+"""
+
+WEEKLY_TREND_QUERY = """
+    SELECT
+        week_of_year,
+        ROUND(sum_y / obs_count, 2) AS avg_demand,
+        ROUND(sum_price / obs_count, 2) AS avg_price
+    FROM rollup_week
+    ORDER BY week_of_year
+"""
+
+# Pencere fonksiyonları ham satırlar yerine tesis x hafta rollup'ı üzerinde çalışır
+PRICING_INSIGHTS_QUERY = """
+    WITH facility_stats AS (
+        SELECT
+            facility_id,
+            obs_count AS facility_obs,
+            ROUND(sum_price / obs_count, 2) AS facility_avg_price,
+            ROUND(sum_y / obs_count, 2) AS facility_avg_demand
+        FROM rollup_facility
+    ),
+    weekly AS (
+        SELECT
+            facility_id,
+            week_of_year,
+            ROUND(sum_price / obs_count, 2) AS avg_price,
+            ROUND(sum_y / obs_count, 2) AS avg_demand,
+            ROUND(weekend_sum_y / NULLIF(weekend_count, 0), 2) AS weekend_avg_demand
+        FROM rollup_facility_week
+    ),
+    ranked AS (
+        SELECT
+            facility_id,
+            week_of_year,
+            avg_price,
+            avg_demand,
+            weekend_avg_demand,
+            RANK() OVER (PARTITION BY week_of_year ORDER BY avg_demand DESC) AS demand_rank,
+            AVG(avg_price) OVER (
+                PARTITION BY facility_id
+                ORDER BY week_of_year
+                ROWS BETWEEN 3 PRECEDING AND CURRENT ROW
+            ) AS price_ma_4w,
+            LAG(avg_price) OVER (
+                PARTITION BY facility_id
+                ORDER BY week_of_year
+            ) AS prev_week_price
+        FROM weekly
+    )
+    SELECT
+        ranked.facility_id,
+        ranked.week_of_year,
+        ranked.avg_price,
+        ranked.avg_demand,
+        ranked.weekend_avg_demand,
+        ranked.demand_rank,
+        ROUND(ranked.price_ma_4w, 2) AS price_ma_4w,
+        ROUND(ranked.prev_week_price, 2) AS prev_week_price,
+        facility_stats.facility_obs,
+        facility_stats.facility_avg_price,
+        facility_stats.facility_avg_demand
+    FROM ranked
+    JOIN facility_stats ON facility_stats.facility_id = ranked.facility_id
+    ORDER BY ranked.week_of_year, ranked.demand_rank
+"""
+
+
+# Rollup tabloları üzerinden çalışan hazır sorgular (önce refresh_rollups gerekir)
+ROLLUP_QUERIES = {
+    "sql_summary": SQL_SUMMARY_QUERY,
+    "weekly_trend": WEEKLY_TREND_QUERY,
+    "pricing_insights": PRICING_INSIGHTS_QUERY,
+}
+
+# Shard başına kısmi toplamlar: rollup tablolarıyla aynı sütunlar, aynı anahtarlarla toplanır
+PARTIAL_AGGREGATES = {
+    "rollup_facility": (
+        ["facility_id"],
+        """
+        SELECT
+            facility_id,
+            TOTAL(y) AS sum_y,
+            TOTAL(price) AS sum_price,
+            TOTAL(distance_to_event) AS sum_event_distance,
+            COUNT(*) AS obs_count
+        FROM sport_data {where}
+        GROUP BY facility_id
+        """,
+    ),
+    "rollup_week": (
+        ["week_of_year"],
+        """
+        SELECT week_of_year, TOTAL(y) AS sum_y, TOTAL(price) AS sum_price, COUNT(*) AS obs_count
+        FROM sport_data {where}
+        GROUP BY week_of_year
+        """,
+    ),
+    "rollup_facility_week": (
+        ["facility_id", "week_of_year"],
         """
-        return pd.read_sql_query(query, conn)
+        SELECT
+            facility_id,
+            week_of_year,
+            TOTAL(y) AS sum_y,
+            TOTAL(price) AS sum_price,
+            COUNT(*) AS obs_count,
+            TOTAL(CASE WHEN is_weekend = 1 THEN y END) AS weekend_sum_y,
+            SUM(CASE WHEN is_weekend = 1 THEN 1 ELSE 0 END) AS weekend_count
+        FROM sport_data {where}
+        GROUP BY facility_id, week_of_year
+        """,
+    ),
+}
+
+
+@timed("analytics.refresh_rollups")
+def refresh_rollups(db_path=DB_PATH):
+    """
+    Rollup tablolarını yalnızca son güncellemeden sonra eklenen satırlarla (rowid > watermark)
+    günceller. Yeni satır yoksa tek bir MAX(rowid) sorgusuyla döner.
+    Dönüş: işlenen yeni satır aralığının üst rowid'i.
+    """
+    ensure_schema(db_path)
+    manager = get_manager(db_path)
+    with manager.writer() as conn, manager.timed("refresh_rollups"):
+        conn.executescript(ROLLUP_SCHEMA)
+        row = conn.execute(
+            "SELECT last_rowid FROM rollup_state WHERE name = 'sport_data'"
+        ).fetchone()
+        last_rowid = row[0] if row else 0
+        max_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM sport_data").fetchone()[0]
+
+        if max_rowid < last_rowid:
+            # Tablo dışarıdan küçültülmüş; toplamlar artık geçersiz
+            invalidate_rollups(conn)
+            conn.executescript(ROLLUP_SCHEMA)
+            last_rowid = 0
+        if max_rowid == last_rowid:
+            return max_rowid
 
+        params = {"last_rowid": last_rowid, "max_rowid": max_rowid}
+        for statement in ROLLUP_UPDATES:
+            conn.execute(statement, params)
+        conn.execute(
+            """
+            INSERT INTO rollup_state (name, last_rowid) VALUES ('sport_data', ?)
+            ON CONFLICT(name) DO UPDATE SET last_rowid = excluded.last_rowid
+            """,
+            (max_rowid,),
+        )
+        return max_rowid
 
+
+@timed("analytics.load_sql_summary")
+def load_sql_summary(db_path=DB_PATH):
+    refresh_rollups(db_path)
+    return get_manager(db_path).read_sql(SQL_SUMMARY_QUERY, name="load_sql_summary")
+
+
+@timed("analytics.load_weekly_demand_trend")
 def load_weekly_demand_trend(db_path=DB_PATH):
-    db_path = Path(db_path)
-    if not db_path.exists():
-        raise FileNotFoundError(f"Database not found: {db_path}")
-    with sqlite3.connect(db_path) as conn:
-        query = """
-            SELECT
-                STRFTIME('%W', ds) AS week_of_year,
-                ROUND(AVG(y), 2) AS avg_demand,
-                ROUND(AVG(price), 2) AS avg_price
-            FROM sport_data
-            GROUP BY week_of_year
-            ORDER BY CAST(week_of_year AS INTEGER)
-        """
-        return pd.read_sql_query(query, conn)
+    refresh_rollups(db_path)
+    return get_manager(db_path).read_sql(WEEKLY_TREND_QUERY, name="load_weekly_demand_trend")
 
 
+@timed("analytics.load_pricing_insights")
 def load_pricing_insights(db_path=DB_PATH):
-    db_path = Path(db_path)
-    if not db_path.exists():
-        raise FileNotFoundError(f"Database not found: {db_path}")
-    with sqlite3.connect(db_path) as conn:
-        query = """
-            WITH base AS (
-                SELECT
-                    facility_id,
-                    DATE(ds) AS day,
-                    STRFTIME('%W', ds) AS week_of_year,
-                    price,
-                    y,
-                    is_weekend
-                FROM sport_data
-            ),
-            facility_stats AS (
-                SELECT
-                    facility_id,
-                    COUNT(*) AS facility_obs,
-                    ROUND(AVG(price), 2) AS facility_avg_price,
-                    ROUND(AVG(y), 2) AS facility_avg_demand
-                FROM base
-                GROUP BY facility_id
-            ),
-            weekly AS (
-                SELECT
-                    facility_id,
-                    week_of_year,
-                    ROUND(AVG(price), 2) AS avg_price,
-                    ROUND(AVG(y), 2) AS avg_demand,
-                    ROUND(AVG(CASE WHEN is_weekend = 1 THEN y END), 2) AS weekend_avg_demand
-                FROM base
-                GROUP BY facility_id, week_of_year
-            ),
-            ranked AS (
-                SELECT
-                    facility_id,
-                    week_of_year,
-                    avg_price,
-                    avg_demand,
-                    weekend_avg_demand,
-                    RANK() OVER (PARTITION BY week_of_year ORDER BY avg_demand DESC) AS demand_rank,
-                    AVG(avg_price) OVER (
-                        PARTITION BY facility_id
-                        ORDER BY CAST(week_of_year AS INTEGER)
-                        ROWS BETWEEN 3 PRECEDING AND CURRENT ROW
-                    ) AS price_ma_4w,
-                    LAG(avg_price) OVER (
-                        PARTITION BY facility_id
-                        ORDER BY CAST(week_of_year AS INTEGER)
-                    ) AS prev_week_price
-                FROM weekly
-            )
-            SELECT
-                ranked.facility_id,
-                ranked.week_of_year,
-                ranked.avg_price,
-                ranked.avg_demand,
-                ranked.weekend_avg_demand,
-                ranked.demand_rank,
-                ROUND(ranked.price_ma_4w, 2) AS price_ma_4w,
-                ROUND(ranked.prev_week_price, 2) AS prev_week_price,
-                facility_stats.facility_obs,
-                facility_stats.facility_avg_price,
-                facility_stats.facility_avg_demand
-            FROM ranked
-            JOIN facility_stats ON facility_stats.facility_id = ranked.facility_id
-            ORDER BY CAST(ranked.week_of_year AS INTEGER), ranked.demand_rank
-        """
-        return pd.read_sql_query(query, conn)
+    refresh_rollups(db_path)
+    return get_manager(db_path).read_sql(PRICING_INSIGHTS_QUERY, name="load_pricing_insights")
+
+
+def _shard_partials(shard_path, start, end):
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("ds >= ?")
+        params.append(int(to_epoch_seconds([start])[0]))
+    if end is not None:
+        conditions.append("ds < ?")
+        params.append(int(to_epoch_seconds([end])[0]))
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    manager = get_manager(shard_path)
+    return {
+        table: manager.read_sql(query.format(where=where), params=params, name=f"partials.{table}")
+        for table, (_, query) in PARTIAL_AGGREGATES.items()
+    }
+
+
+@timed("analytics.load_partitioned_rollup")
+def load_partitioned_rollup(name, start=None, end=None, store=None, max_workers=None):
+    """
+    sql_summary, weekly_trend veya pricing_insights çıktısını aylık shard'lar üzerinden üretir.
+    Yalnızca [start, end) ile kesişen shard'lar thread havuzunda taranır; kısmi toplam ve
+    sayılar birleştirilip bellek içi rollup tablolarına yazılır ve aynı sorgu çalıştırılır.
+    """
+    from partitions import PartitionedStore
+
+    if name not in ROLLUP_QUERIES:
+        raise ValueError(f"Unknown rollup: {name}. Choose from {list(ROLLUP_QUERIES)}")
+    store = store or PartitionedStore()
+    partials = store.map(lambda path: _shard_partials(path, start, end), start, end, max_workers)
 
+    with sqlite3.connect(":memory:") as conn:
+        conn.executescript(ROLLUP_SCHEMA)
+        for table, (keys, _) in PARTIAL_AGGREGATES.items():
+            frames = [shard[table] for shard in partials if not shard[table].empty]
+            if not frames:
+                continue
+            merged = pd.concat(frames, ignore_index=True).groupby(keys, as_index=False).sum()
+            merged.to_sql(table, conn, if_exists="append", index=False)
+        return pd.read_sql_query(ROLLUP_QUERIES[name], conn)
 
+
+@timed("analytics.export_bi_extract")
 def export_bi_extract(df, output_path="sportpulse_bi_extract.csv"):
+    """Bellekteki DataFrame'i CSV'ye yazar; büyük tablolar için export_extract tercih edilir."""
     output_path = Path(output_path)
     df.to_csv(output_path, index=False)
     return output_path
+
+
+EXPORT_FORMAT_VERSION = 1
+EXPORT_FORMATS = ("csv", "csv.gz", "parquet")
+EXPORT_BATCH_SIZE = 50_000
+# Parquet sütun tipleri (pyarrow tip adları); ilk batch'te tamamen NULL gelen sütun da doğru
+# tiple yazılır. Listede olmayan sütunun tipi ilk batch'ten çıkarılır ya da schema ile verilir.
+EXPORT_COLUMN_TYPES = {
+    "ds": "string",
+    "facility_id": "int64",
+    "lat": "float64",
+    "lon": "float64",
+    "hour": "int64",
+    "is_weekend": "int64",
+    "temp": "float64",
+    "is_rainy": "int64",
+    "nearby_event": "int64",
+    "distance_to_event": "float64",
+    "price": "float64",
+    "y": "float64",
+    "day": "int64",
+    "week_of_year": "int64",
+    "avg_demand": "float64",
+    "avg_price": "float64",
+    "avg_event_distance": "float64",
+    "obs_count": "int64",
+    "weekend_avg_demand": "float64",
+    "demand_rank": "int64",
+    "price_ma_4w": "float64",
+    "prev_week_price": "float64",
+    "facility_obs": "int64",
+    "facility_avg_price": "float64",
+    "facility_avg_demand": "float64",
+}
+
+
+def _export_format(output_path, fmt):
+    if fmt is None:
+        # "csv.gz" "csv"den önce denenir
+        name = output_path.name.lower()
+        fmt = next(
+            (candidate for candidate in reversed(EXPORT_FORMATS) if name.endswith("." + candidate)),
+            None,
+        )
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}. Choose from {EXPORT_FORMATS}")
+    return fmt
+
+
+def _write_csv(cursor, columns, staging, batch_size, compress):
+    opener = gzip.open if compress else open
+    rows = 0
+    with opener(staging, "wt", encoding="utf-8", newline="") as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(columns)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return rows
+            writer.writerows(batch)
+            rows += len(batch)
+
+
+def _parquet_schema(columns, first_batch, column_types):
+    import pyarrow as pa
+
+    fields = []
+    for position, name in enumerate(columns):
+        type_name = column_types.get(name)
+        if type_name is not None:
+            fields.append((name, pa.type_for_alias(type_name)))
+            continue
+        inferred = pa.array([row[position] for row in first_batch]).type
+        if pa.types.is_null(inferred):
+            raise ValueError(f"Parquet tipi çıkarılamadı, schema ile verin: {name}")
+        fields.append((name, inferred))
+    return pa.schema(fields)
+
+
+def _write_parquet(cursor, columns, staging, batch_size, column_types):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    rows = 0
+    try:
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            if writer is None:
+                writer = pq.ParquetWriter(staging, _parquet_schema(columns, batch, column_types))
+            arrays = [
+                pa.array(values, type=field.type) for values, field in zip(zip(*batch), writer.schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=writer.schema))
+            rows += len(batch)
+        if writer is None:
+            # Boş sonuç: bilinen tipler korunur, bilinmeyenler null tipli yazılır
+            schema = pa.schema(
+                [
+                    (name, pa.type_for_alias(column_types[name]) if name in column_types else pa.null())
+                    for name in columns
+                ]
+            )
+            writer = pq.ParquetWriter(staging, schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+@timed("analytics.export_query")
+def export_query(
+    query,
+    output_path,
+    params=None,
+    fmt=None,
+    db_path=DB_PATH,
+    batch_size=EXPORT_BATCH_SIZE,
+    skip_unchanged=True,
+    schema=None,
+):
+    """
+    Herhangi bir analitik sorguyu pandas'a almadan SQLite cursor'ından batch batch
+    CSV, gzip-CSV veya Parquet'e (pyarrow gerekir) yazar. Format verilmezse uzantıdan seçilir.
+    schema: Parquet için {sütun: pyarrow tip adı}; EXPORT_COLUMN_TYPES'ın üzerine yazılır.
+    Kaynak veri filigranı, sorgu ve format önceki yazımla aynıysa ve dosya duruyorsa
+    yazma atlanır. Dönüş: çıktı yolu.
+    """
+    output_path = Path(output_path)
+    fmt = _export_format(output_path, fmt)
+    state_path = output_path.with_name(output_path.name + ".watermark")
+
+    manager = get_manager(db_path)
+    with manager.reader() as conn, manager.timed("export_query"):
+        # Filigran ve veri aynı okuma bağlantısında okunur
+        state = {
+            "version": EXPORT_FORMAT_VERSION,
+            "format": fmt,
+            "query": hashlib.sha256(query.encode("utf-8")).hexdigest(),
+            "params": [str(value) for value in (params or [])],
+            "watermark": list(read_watermark(conn)),
+        }
+        if (
+            skip_unchanged
+            and output_path.exists()
+            and state_path.exists()
+            and json.loads(state_path.read_text(encoding="utf-8")).get("source") == state
+        ):
+            return output_path
+
+        cursor = conn.execute(query, params or [])
+        columns = [description[0] for description in cursor.description]
+        staging = output_path.with_name(output_path.name + ".tmp")
+        try:
+            if fmt == "parquet":
+                column_types = {**EXPORT_COLUMN_TYPES, **(schema or {})}
+                rows = _write_parquet(cursor, columns, staging, batch_size, column_types)
+            else:
+                rows = _write_csv(cursor, columns, staging, batch_size, compress=fmt == "csv.gz")
+        except BaseException:
+            # Yarım kalan staging dosyası bir sonraki yazımı yanıltmasın
+            staging.unlink(missing_ok=True)
+            raise
+
+    staging.replace(output_path)
+    state_path.write_text(json.dumps({"source": state, "rows": rows}), encoding="utf-8")
+    return output_path
+
+
+def export_extract(name, output_path=None, fmt=None, db_path=DB_PATH, **slice_filters):
+    """
+    Hazır çıktıları akış halinde dışa aktarır: sql_summary, weekly_trend, pricing_insights
+    veya ham sport_data dilimi (columns, start, end, facility_ids filtreleriyle).
+    fmt verilmezse output_path uzantısından seçilir; ikisi de yoksa CSV yazılır.
+    """
+    from data_gen import sport_data_query
+
+    if name in ROLLUP_QUERIES:
+        if slice_filters:
+            raise ValueError(f"{name} için dilim filtresi kullanılamaz: {sorted(slice_filters)}")
+        refresh_rollups(db_path)
+        query, params = ROLLUP_QUERIES[name], None
+    elif name == "sport_data":
+        ensure_schema(db_path)
+        query, params = sport_data_query(iso_ds=True, **slice_filters)
+    else:
+        raise ValueError(f"Unknown extract: {name}. Choose from {[*ROLLUP_QUERIES, 'sport_data']}")
+
+    output_path = output_path or f"sportpulse_{name}.{fmt or 'csv'}"
+    return export_query(query, output_path, params=params, fmt=fmt, db_path=db_path)
@@ -1,21 +1,38 @@
 import streamlit as st
 import pandas as pd
 import importlib.util
+import time
 import plotly.express as px
-from model_engine import DemandEngine
-from data_gen import generate_sport_data, load_sport_data, save_sport_data
+from model_engine import DemandEngine, sport_data_fingerprint
+from data_gen import data_watermark, generate_sport_data, load_sport_data, save_sport_data
 from analytics import (
     load_sql_summary,
     load_weekly_demand_trend,
     load_pricing_insights,
-    export_bi_extract,
+    export_extract,
 )
 from geo_analytics import export_facility_geojson
-from forecast_engine import build_weekly_forecast
+from forecast_engine import load_last_forecast
+from jobs import (
+    JobRunner,
+    refresh_facility_forecasts,
+    refresh_weekly_forecast,
+    train_demand_engine,
+)
+from supply_demand import build_supply_demand_summary
+import perf
+
+INFERENCE_BACKEND = "compiled"
 
 # Sayfa Ayarları
 st.set_page_config(page_title="SportPulse AI", layout="wide")
 
+# Rerun bazlı performans kaydı (ve istenirse tek rerun için cProfile)
+perf.begin_rerun()
+perf.increment("app.reruns")
+profile_rerun = st.sidebar.checkbox("⏱️ Bu rerun'ı cProfile ile profille", value=False)
+profiler = perf.start_profile() if profile_rerun else None
+
 st.title("⚡ SportPulse: Akıllı Talep ve Fiyatlama Radarı")
 if importlib.util.find_spec("xgboost") is None or importlib.util.find_spec("shap") is None:
     st.warning(
@@ -24,33 +41,140 @@ if importlib.util.find_spec("xgboost") is None or importlib.util.find_spec("shap
     )
 
 # 1. Veri ve Model Yükleme
+@st.cache_resource
+def get_job_runner():
+    # Süreç başına tek runner: eğitim ve forecast sayfa render'ını bloklamadan arka planda çalışır
+    return JobRunner()
+
+
 @st.cache_resource
 def load_system():
     try:
-        df = load_sport_data()
+        data_watermark()
     except FileNotFoundError:
-        df = generate_sport_data()
-        save_sport_data(df)
-    engine = DemandEngine()
-    if importlib.util.find_spec("xgboost") is not None and importlib.util.find_spec("shap") is not None:
-        engine.train(df)
-    return df, engine
+        save_sport_data(generate_sport_data())
+    # Tek satırlık dashboard çağrıları için düz NumPy ağaç değerlendiricisi
+    engine = DemandEngine(backend=INFERENCE_BACKEND)
+    if model_available:
+        # Güncel artifact yoksa son iyi model ile açılır, güncel model arka planda hazırlanır
+        fingerprint = sport_data_fingerprint()
+        if not engine.load_artifact(fingerprint):
+            engine.load_latest_artifact()
+            get_job_runner().submit(
+                "train", train_demand_engine, backend=INFERENCE_BACKEND, key=fingerprint
+            )
+    return engine
+
+
+@st.cache_resource(max_entries=1)
+def load_frame(watermark):
+    # Çerçeve veri filigranına bağlıdır: ingest sonrası yeniden okunur, forecast işleri ve
+    # filigran anahtarlı cache'ler aynı sürümün verisiyle çalışır. Kompakt dtype'lar
+    # (int8 bayraklar, float32 ölçümler) worker başına RAM'i düşürür
+    return load_sport_data(compact=True)
 
 
 @st.cache_data
-def load_forecast(df):
-    return build_weekly_forecast(df)
+def load_last_forecast_cached(watermark, _df):
+    # Cache anahtarı tüm DataFrame'in hash'i yerine ucuz veri filigranıdır
+    last = load_last_forecast(_df)
+    if last is None:
+        return None
+    history, outlook, _, info = last
+    return {"watermark": watermark, "history": history, "forecast": outlook, "info": info}
+
+
+def current_forecast(watermark, df):
+    """Bu filigran için forecast hazırsa onu, değilse son kaydedilmiş forecast'ı döndürür."""
+    fresh = job_runner.result("forecast")
+    if fresh is not None and fresh["watermark"] == watermark:
+        return fresh
+    job_runner.submit("forecast", refresh_weekly_forecast, df, watermark, key=watermark)
+    return fresh or load_last_forecast_cached(watermark, df)
+
+
+@st.cache_data
+def load_facility_snapshot(watermark, _df):
+    # Tesis başına ortalama talep, doluluk ve son gözlenen koşullar (GeoJSON özellikleri için)
+    facilities = (
+        _df.groupby(['facility_id', 'lat', 'lon'])['y']
+        .mean()
+        .reset_index()
+        .rename(columns={'y': 'avg_demand'})
+    )
+    utilization = build_supply_demand_summary(_df)[0][['facility_id', 'avg_utilization']]
+    facilities = facilities.merge(
+        utilization.rename(columns={'avg_utilization': 'utilization'}), on='facility_id', how='left'
+    )
+    latest = _df.loc[_df.groupby('facility_id')['ds'].idxmax()].set_index('facility_id')
+    return facilities, latest
+
+
+def current_facility_forecasts(watermark, df):
+    """Tesis bazlı gelecek hafta forecast'ı; iş henüz bitmediyse boş seri döner."""
+    fresh = job_runner.result("facility_forecast")
+    if fresh is None or fresh["watermark"] != watermark:
+        job_runner.submit(
+            "facility_forecast", refresh_facility_forecasts, df, watermark, key=watermark
+        )
+        return pd.Series(dtype=float)
+    forecast = fresh["forecast"]
+    next_week = forecast[forecast["ds"] == forecast.groupby("facility_id")["ds"].transform("min")]
+    return next_week.set_index("facility_id")["forecast"]
 
 
-df, engine = load_system()
-sql_summary = load_sql_summary()
-weekly_trend = load_weekly_demand_trend()
-pricing_insights = load_pricing_insights()
+model_available = (
+    importlib.util.find_spec("xgboost") is not None and importlib.util.find_spec("shap") is not None
+)
+job_runner = get_job_runner()
+with perf.timed("app.data_and_model"):
+    engine = load_system()
+    watermark = data_watermark()
+    df = load_frame(watermark)
+    if model_available and st.sidebar.button("🔁 Modeli Yeniden Eğit"):
+        job_runner.submit(
+            "train",
+            train_demand_engine,
+            force_retrain=True,
+            backend=INFERENCE_BACKEND,
+            key=time.time(),
+        )
+    # Arka plan eğitimi bittiyse yeni model devreye girer
+    engine = job_runner.result("train", default=engine)
+    if model_available and engine.model is not None and engine.lookup is None:
+        # Talep/fiyat lookup tablosu model başına bir kez arka planda hesaplanır;
+        # hazır olunca sidebar yanıtları model çağırmadan tablodan gelir. Anahtar model
+        # kimliğidir: aynı fingerprint ile zorla yeniden eğitilen model de tablosunu alır
+        job_runner.submit("lookup", engine.build_lookup, key=engine.model_id)
+with perf.timed("app.sql_loaders"):
+    sql_summary = load_sql_summary()
+    weekly_trend = load_weekly_demand_trend()
+    pricing_insights = load_pricing_insights()
 statsmodels_available = importlib.util.find_spec("statsmodels") is not None
 forecast_history = None
 forecast_outlook = None
 if statsmodels_available:
-    forecast_history, forecast_outlook, _ = load_forecast(df)
+    with perf.timed("app.forecast"):
+        forecast = current_forecast(watermark, df)
+    if forecast is not None:
+        forecast_history, forecast_outlook = forecast["history"], forecast["forecast"]
+
+
+@st.fragment(run_every=2)
+def job_status_panel():
+    # İşler sürerken durum gösterilir; yeni sonuç gelince sayfa bir kez yeniden çizilir
+    runs = job_runner.runs()
+    seen = st.session_state.setdefault("job_runs_seen", runs)
+    if runs != seen:
+        st.session_state["job_runs_seen"] = runs
+        st.rerun(scope="app")
+    if job_runner.is_busy():
+        st.info("⏳ Model/forecast arka planda güncelleniyor; son iyi sonuçlar gösteriliyor.")
+        st.dataframe(job_runner.status(), use_container_width=True, hide_index=True)
+
+
+with st.sidebar:
+    job_status_panel()
 model_metrics = engine.get_metrics() if hasattr(engine, "get_metrics") else {}
 
 # 2. Sidebar - Senaryo Oluşturucu
@@ -81,7 +205,8 @@ input_data = pd.DataFrame(
 col1, col2, col3 = st.columns(3)
 
 # A. Demand Nowcast
-predicted_demand = engine.predict_demand(input_data)
+with perf.timed("app.nowcast"):
+    predicted_demand = engine.predict_demand(input_data)
 occupancy = min(100, (predicted_demand / 100) * 100)  # Kapasite 100 varsayıldı
 
 with col1:
@@ -92,7 +217,8 @@ with col1:
 # B. Demand Shock Detector (TWIST)
 with col2:
     st.subheader("🚨 Shock Detector")
-    explanation = engine.get_shock_reason(input_data)
+    with perf.timed("app.shap"):
+        explanation = engine.get_shock_reason(input_data)
 
     if "ARTIRAN" in explanation:
         st.success(explanation)
@@ -102,12 +228,13 @@ with col2:
 # C. Dynamic Pricing
 with col3:
     st.subheader("💰 Fiyat Önerisi")
-    opt_price, opt_demand, opt_rev = engine.optimize_price(input_data)
+    with perf.timed("app.pricing"):
+        opt_price, opt_demand, opt_rev = engine.optimize_price(input_data)
 
     current_rev = current_price * predicted_demand
     uplift = ((opt_rev - current_rev) / current_rev) * 100 if current_rev > 0 else 0
 
-    st.metric(label="Önerilen Fiyat", value=f"{opt_price} TL", delta=f"%{uplift:.1f} Gelir Artışı")
+    st.metric(label="Önerilen Fiyat", value=f"{opt_price:.0f} TL", delta=f"%{uplift:.1f} Gelir Artışı")
     st.write(f"Tahmini Gelir: **{opt_rev:.0f} TL** (Mevcut: {current_rev:.0f} TL)")
 
 # --- MODEL PERFORMANSI ---
@@ -129,12 +256,8 @@ c1, c2 = st.columns([2, 1])
 with c1:
     st.subheader("🌡️ Sensitivity Lab (Hava ve Fiyat Etkisi)")
     # Fiyat esnekliği grafiği oluştur
-    prices = range(50, 300, 10)
-    demands = []
-    for p in prices:
-        temp_in = input_data.copy()
-        temp_in['price'] = p
-        demands.append(engine.predict_demand(temp_in))
+    prices = list(range(50, 300, 10))
+    demands = engine.response_surface(input_data, {'price': prices})["demand"]
 
     chart_data = pd.DataFrame({'Fiyat': prices, 'Tahmini Talep': demands})
     fig = px.line(chart_data, x='Fiyat', y='Tahmini Talep', title="Fiyat Esneklik Eğrisi (Mevcut Koşullarda)")
@@ -148,21 +271,52 @@ with c1:
     )
     st.plotly_chart(fig, use_container_width=True)
 
+    # İki boyutlu what-if: fiyat x seçilen faktör (tek vektörel skorlama)
+    surface_axes = {
+        "Sıcaklık (°C)": ("temp", list(range(-5, 41))),
+        "Saat": ("hour", list(range(24))),
+        "Etkinliğe Uzaklık (km)": ("distance_to_event", [x / 2 for x in range(0, 101)]),
+    }
+    surface_label = st.selectbox("Fiyat ile birlikte incelenecek faktör", list(surface_axes))
+    surface_feature, surface_values = surface_axes[surface_label]
+    surface = engine.response_surface(
+        input_data, {surface_feature: surface_values, 'price': prices}
+    )
+    heatmap = px.imshow(
+        surface["demand"],
+        x=prices,
+        y=surface_values,
+        aspect="auto",
+        origin="lower",
+        labels={"x": "Fiyat", "y": surface_label, "color": "Tahmini Talep"},
+        title=f"Talep Yüzeyi: Fiyat x {surface_label}",
+    )
+    st.plotly_chart(heatmap, use_container_width=True)
+
 with c2:
     st.subheader("🗺️ Geo Heatmap (Tesis Bazlı)")
     st.info("Tesislerin konumları ve tahmini talep yoğunluğu haritası.")
-    facilities = (
-        df.groupby(['facility_id', 'lat', 'lon'])['y']
-        .mean()
-        .reset_index()
-        .rename(columns={'y': 'avg_demand'})
-    )
+    facilities, latest_conditions = load_facility_snapshot(watermark, df)
+    facilities = facilities.copy()
+    if model_available and engine.model is not None:
+        # Her tesisin son gözlenen koşullarında geliri maksimize eden fiyat
+        optimal = engine.optimize_prices(latest_conditions)['optimal_price']
+        facilities['optimal_price'] = facilities['facility_id'].map(optimal)
+    else:
+        facilities['optimal_price'] = float('nan')
+    if statsmodels_available:
+        facilities['forecast'] = facilities['facility_id'].map(current_facility_forecasts(watermark, df))
+    else:
+        facilities['forecast'] = float('nan')
     st.map(facilities[['lat', 'lon']])
     st.dataframe(
         facilities.sort_values('avg_demand', ascending=False).head(10),
         use_container_width=True,
     )
-    geojson_path = export_facility_geojson(facilities)
+    with perf.timed("app.geojson_export"):
+        geojson_path = export_facility_geojson(
+            facilities, properties=['utilization', 'optimal_price', 'forecast']
+        )
     with open(geojson_path, "rb") as geojson_file:
         st.download_button(
             label="🗺️ ArcGIS / GeoJSON indir",
@@ -205,6 +359,8 @@ with forecast_cols[0]:
             line=dict(color="rgba(255,165,0,0.3)", dash="dot"),
         )
         st.plotly_chart(forecast_chart, use_container_width=True)
+    elif statsmodels_available:
+        st.info("⏳ Forecast arka planda hazırlanıyor; tamamlanınca grafik güncellenecek.")
     else:
         st.warning("Forecast modülü için statsmodels kurulu değil. `pip install statsmodels` ile kurabilirsiniz.")
 
@@ -222,6 +378,8 @@ with forecast_cols[1]:
             ),
             use_container_width=True,
         )
+    elif statsmodels_available:
+        st.info("Forecast özeti arka plan işi bitince gösterilecek.")
     else:
         st.info("Forecast özeti için statsmodels gereklidir.")
 
@@ -240,11 +398,33 @@ trend_fig = px.line(
 )
 st.plotly_chart(trend_fig, use_container_width=True)
 
-bi_extract_path = export_bi_extract(sql_summary)
+with perf.timed("app.csv_export"):
+    # Veri filigranı değişmediyse dosyalar yeniden yazılmaz; sorgu sonucu pandas'a alınmaz
+    bi_extract_path = export_extract("sql_summary", "sportpulse_bi_extract.csv")
+    insights_extract_path = export_extract("pricing_insights", "sportpulse_pricing_insights.csv.gz")
+export_cols = st.columns(2)
 with open(bi_extract_path, "rb") as data_file:
-    st.download_button(
+    export_cols[0].download_button(
         label="📥 BI Extract (CSV) indir",
         data=data_file,
         file_name=bi_extract_path.name,
         mime="text/csv",
     )
+with open(insights_extract_path, "rb") as data_file:
+    export_cols[1].download_button(
+        label="📥 Fiyat İçgörüleri (CSV.gz) indir",
+        data=data_file,
+        file_name=insights_extract_path.name,
+        mime="application/gzip",
+    )
+
+# --- PERFORMANS PANELİ ---
+
+with st.expander("⏱️ Performans (bu rerun)"):
+    st.caption("İç içe ölçümler ayrıca listelenir; app.* satırları üst seviye aşamalardır.")
+    st.dataframe(perf.rerun_breakdown(), use_container_width=True)
+    st.caption("Süreç geneli birikimli istatistikler")
+    st.dataframe(perf.get_stats(), use_container_width=True)
+    perf.export_prometheus()
+    if profiler is not None:
+        st.text(perf.stop_profile(profiler))
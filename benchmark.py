@@ -0,0 +1,331 @@
+"""
+SportPulse performans benchmark'ı.
+
+Her pipeline aşamasını artan boyutlu sentetik veri setlerinde çalıştırır; duvar saati süresi,
+tepe bellek (ayrı, tracemalloc'lu ikinci çalıştırma) ve throughput değerlerini JSON'a yazar. --baseline ile önceki bir
+çıktıya göre regresyonları işaretler (regresyon varsa çıkış kodu 1).
+
+Örnek:
+    python benchmark.py --scales small,medium --save-baseline benchmark_baseline.json
+    python benchmark.py --scales small,medium --baseline benchmark_baseline.json
+"""
+import argparse
+import json
+import math
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from analytics import (
+    load_partitioned_rollup,
+    load_pricing_insights,
+    load_sql_summary,
+    load_weekly_demand_trend,
+)
+from data_gen import generate_sport_data, load_sport_data, save_sport_data
+from db_connection import get_manager
+from forecast_engine import build_weekly_forecast
+from geo_analytics import export_facility_geojson
+from ingest import ingest_sport_data
+from model_engine import FEATURE_COLUMNS, DemandEngine
+from partitions import PartitionedStore
+from schema import invalidate_rollups
+from supply_demand import build_supply_demand_summary
+
+# (satır sayısı, tesis sayısı)
+SCALES = {
+    "small": (10_000, 8),
+    "medium": (1_000_000, 100),
+    "large": (10_000_000, 1_000),
+}
+DEFAULT_OUTPUT = Path("benchmark_results.json")
+# Göreli yavaşlama toleransı ve gürültü tabanı (saniye)
+DEFAULT_TOLERANCE = 0.25
+NOISE_FLOOR_S = 0.05
+SINGLE_ROW_CALLS = 200
+# float32 toplama sırası farkı için derlenmiş backend toleransı
+COMPILED_TOLERANCE = 1e-3
+# Tepe bellek için ikinci (tracemalloc'lu) çalıştırma; --no-memory ile kapatılır
+TRACE_MEMORY = True
+
+
+def measure(results, scale, stage, fn, items=1, reset=None):
+    """
+    fn'i izlemesiz çalıştırıp süreyi ölçer; ardından tepe bellek için tracemalloc açıkken
+    ayrı bir çalıştırma yapar (izleme süreyi şişirdiği için ikisi ayrıdır). reset verilirse
+    her çalıştırmadan önce çağrılır (ör. cold ölçüm için önbellekleri sıfırlamak).
+    Süre, tepe bellek ve items/saniye throughput'u kaydeder.
+    """
+    if reset is not None:
+        reset()
+    start = time.perf_counter()
+    value = fn()
+    wall_s = time.perf_counter() - start
+
+    peak = None
+    if TRACE_MEMORY:
+        if reset is not None:
+            reset()
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    rows, facilities = SCALES[scale]
+    results.append(
+        {
+            "scale": scale,
+            "rows": rows,
+            "facilities": facilities,
+            "stage": stage,
+            "wall_s": wall_s,
+            "peak_mb": None if peak is None else peak / 1024 / 1024,
+            "items": items,
+            "throughput_per_s": items / wall_s if wall_s > 0 else math.inf,
+        }
+    )
+    peak_text = "-" if peak is None else f"{peak / 1024 / 1024:.1f}"
+    print(f"  {stage:<32} {wall_s:9.3f} s {peak_text:>9} MB {items / max(wall_s, 1e-9):14.0f} /s")
+    return value
+
+
+def _drop_rollups(db_path):
+    manager = get_manager(db_path)
+    with manager.writer() as conn:
+        invalidate_rollups(conn)
+
+
+def _scenario_rows(df, count):
+    return [df[FEATURE_COLUMNS].iloc[[idx % len(df)]] for idx in range(count)]
+
+
+def run_scale(scale, workdir, results, train_rows=None):
+    rows, facilities = SCALES[scale]
+    days = max(1, math.ceil(rows / (24 * facilities)))
+    db_path = Path(workdir) / f"bench_{scale}.db"
+    print(f"[{scale}] {rows:,} satır, {facilities} tesis")
+
+    df = measure(
+        results,
+        scale,
+        "generate_sport_data",
+        lambda: generate_sport_data(days=days, facilities=facilities, seed=42, panel=True).iloc[:rows],
+        items=rows,
+    )
+    measure(results, scale, "save_sport_data", lambda: save_sport_data(df, db_path), items=rows)
+    # Aynı satırların tekrar yüklenmesi: upsert anahtar kontrolü, tablo değişmez
+    measure(results, scale, "ingest_sport_data[unchanged]", lambda: ingest_sport_data(df, db_path), items=rows)
+    df = measure(results, scale, "load_sport_data", lambda: load_sport_data(db_path), items=rows)
+
+    # cold: rollup'lar her çalıştırmadan önce silinip baştan kurulur; warm: yalnızca rollup okunur
+    for label in ("cold", "warm"):
+        reset = (lambda: _drop_rollups(db_path)) if label == "cold" else None
+        measure(results, scale, f"load_sql_summary[{label}]", lambda: load_sql_summary(db_path), reset=reset)
+        measure(
+            results,
+            scale,
+            f"load_weekly_demand_trend[{label}]",
+            lambda: load_weekly_demand_trend(db_path),
+            reset=reset,
+        )
+        measure(
+            results,
+            scale,
+            f"load_pricing_insights[{label}]",
+            lambda: load_pricing_insights(db_path),
+            reset=reset,
+        )
+
+    # Aylık shard'lar: tüm geçmiş ve yalnızca son ay için fan-out (sorgu maliyeti aralıkla ölçeklenir)
+    store = PartitionedStore(Path(workdir) / f"bench_{scale}_partitions")
+    measure(results, scale, "partitions.import_database", lambda: store.import_database(db_path), items=rows)
+    last_month = store.partitions()["name"].iloc[-1]
+    for label, start in (("all", None), ("last_month", last_month)):
+        measure(
+            results,
+            scale,
+            f"load_partitioned_rollup[{label}]",
+            lambda: load_partitioned_rollup("pricing_insights", start=start, store=store),
+        )
+
+    train_df = df if train_rows is None else df.iloc[:train_rows]
+    engine = DemandEngine()
+    measure(results, scale, "DemandEngine.train", lambda: engine.train(train_df), items=len(train_df))
+    # Out-of-core mod: SQLite parçalarından QuantileDMatrix + hist + early stopping
+    measure(
+        results,
+        scale,
+        "DemandEngine.train_from_db",
+        lambda: DemandEngine().train_from_db(db_path),
+        items=rows,
+    )
+
+    scenarios = _scenario_rows(df, SINGLE_ROW_CALLS)
+    measure(
+        results,
+        scale,
+        "predict_demand",
+        lambda: [engine.predict_demand(row) for row in scenarios],
+        items=len(scenarios),
+    )
+    measure(
+        results,
+        scale,
+        "predict_demand_batch",
+        lambda: engine.predict_demand_batch(df),
+        items=len(df),
+    )
+
+    # Derlenmiş ağaç backend'i: önce booster ile aynı sonucu verdiği doğrulanır
+    reference = engine.predict_demand_batch(df)
+    engine.set_backend("compiled")
+    compiled = engine.predict_demand_batch(df)
+    max_diff = float(np.abs(compiled - reference).max()) if len(df) else 0.0
+    if max_diff > COMPILED_TOLERANCE:
+        raise AssertionError(f"Compiled backend booster ile uyuşmuyor: max fark {max_diff}")
+    print(f"  compiled backend max |fark|: {max_diff:.2e}")
+    measure(
+        results,
+        scale,
+        "predict_demand[compiled]",
+        lambda: [engine.predict_demand(row) for row in scenarios],
+        items=len(scenarios),
+    )
+    measure(
+        results,
+        scale,
+        "predict_demand_batch[compiled]",
+        lambda: engine.predict_demand_batch(df),
+        items=len(df),
+    )
+    engine.set_backend("xgboost")
+
+    measure(
+        results,
+        scale,
+        "optimize_price",
+        lambda: [engine.optimize_price(row) for row in scenarios[:20]],
+        items=20,
+    )
+    measure(
+        results,
+        scale,
+        "get_shock_reason",
+        lambda: [engine.get_shock_reason(row) for row in scenarios[:20]],
+        items=20,
+    )
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        measure(results, scale, "build_weekly_forecast", lambda: build_weekly_forecast(df))
+
+    measure(
+        results,
+        scale,
+        "build_supply_demand_summary",
+        lambda: build_supply_demand_summary(df),
+        items=len(df),
+    )
+
+    facility_frame = (
+        df.groupby(["facility_id", "lat", "lon"])["y"]
+        .mean()
+        .reset_index()
+        .rename(columns={"y": "avg_demand"})
+    )
+    measure(
+        results,
+        scale,
+        "export_facility_geojson",
+        lambda: export_facility_geojson(facility_frame, Path(workdir) / f"bench_{scale}.geojson"),
+        items=len(facility_frame),
+    )
+
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Aynı (scale, stage) için süresi baseline'ın (1 + tolerance) katını aşan aşamaları döndürür."""
+    reference = {(row["scale"], row["stage"]): row for row in baseline["results"]}
+    regressions = []
+    for row in results:
+        base = reference.get((row["scale"], row["stage"]))
+        if base is None:
+            continue
+        slower = row["wall_s"] - base["wall_s"]
+        if row["wall_s"] > base["wall_s"] * (1 + tolerance) and slower > NOISE_FLOOR_S:
+            regressions.append(
+                {
+                    "scale": row["scale"],
+                    "stage": row["stage"],
+                    "baseline_s": base["wall_s"],
+                    "current_s": row["wall_s"],
+                    "ratio": row["wall_s"] / base["wall_s"] if base["wall_s"] else math.inf,
+                }
+            )
+    return pd.DataFrame(
+        regressions, columns=["scale", "stage", "baseline_s", "current_s", "ratio"]
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SportPulse pipeline benchmark")
+    parser.add_argument("--scales", default="small", help=f"Virgülle ayrılmış: {','.join(SCALES)}")
+    parser.add_argument("--output", default=str(DEFAULT_OUTPUT))
+    parser.add_argument("--baseline", help="Karşılaştırılacak önceki benchmark JSON'u")
+    parser.add_argument("--save-baseline", help="Sonuçları ayrıca bu baseline dosyasına yaz")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--train-rows", type=int, help="Eğitimi ilk N satırla sınırla")
+    parser.add_argument(
+        "--no-memory", action="store_true", help="Tepe bellek için ikinci çalıştırmayı atla"
+    )
+    args = parser.parse_args(argv)
+
+    global TRACE_MEMORY
+    TRACE_MEMORY = not args.no_memory
+
+    scales = [scale.strip() for scale in args.scales.split(",") if scale.strip()]
+    unknown = [scale for scale in scales if scale not in SCALES]
+    if unknown:
+        parser.error(f"Bilinmeyen ölçek: {unknown}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in scales:
+            run_scale(scale, workdir, results, train_rows=args.train_rows)
+
+    report = {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "scales": scales,
+        },
+        "results": results,
+    }
+    payload = json.dumps(report, indent=2)
+    Path(args.output).write_text(payload, encoding="utf-8")
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(payload, encoding="utf-8")
+    print(f"Sonuçlar yazıldı: {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        if not regressions.empty:
+            print("Regresyonlar:")
+            print(regressions.to_string(index=False))
+            return 1
+        print("Baseline'a göre regresyon yok.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,38 @@
 import pandas as pd
 import numpy as np
-import sqlite3
 from datetime import datetime, timedelta
-from pathlib import Path
 
-DB_PATH = Path("sportpulse.db")
+from db_connection import DB_PATH, get_manager
+from ingest import ingest_sport_data, iter_batches, write_sport_data_rows
+from perf import timed
+from schema import (
+    SPORT_DATA_COLUMNS,
+    SPORT_DATA_DDL,
+    bump_generation,
+    create_sport_data_table,
+    deduplicate_sport_data,
+    ensure_schema,
+    from_epoch_seconds,
+    invalidate_rollups,
+    read_watermark,
+    to_epoch_seconds,
+)
+
+DATA_COLUMNS = SPORT_DATA_COLUMNS
+# lat/lon float64 kalır: float32 koordinat hassasiyetini düşürür ve JSON'a (st.map, GeoJSON) yazılamaz
+COMPACT_DTYPES = {
+    'facility_id': 'int16',
+    'hour': 'int16',
+    'week_of_year': 'int16',
+    'day': 'int32',
+    'is_weekend': 'int8',
+    'is_rainy': 'int8',
+    'nearby_event': 'int8',
+    'temp': 'float32',
+    'distance_to_event': 'float32',
+    'price': 'float32',
+    'y': 'float32',
+}
 
 def haversine_km(lat1, lon1, lat2, lon2):
     """Calculate distance between two lat/lon pairs in kilometers."""
@@ -15,7 +43,17 @@ def haversine_km(lat1, lon1, lat2, lon2):
     c = 2 * np.arcsin(np.sqrt(a))
     return 6371 * c
 
-def generate_sport_data(days=365, facilities=8):
+@timed("data_gen.generate_sport_data")
+def generate_sport_data(days=365, facilities=8, seed=None, panel=False):
+    if panel:
+        # Vektörel mod: tüm tesis x saat panelini tek DataFrame olarak döndürür
+        return pd.concat(
+            iter_sport_data_chunks(days=days, facilities=facilities, seed=seed),
+            ignore_index=True,
+        )
+    if seed is not None:
+        np.random.seed(seed)
+
     dates = pd.date_range(start="2024-01-01", periods=days*24, freq="H")
     data = []
 
@@ -92,39 +130,266 @@ def generate_sport_data(days=365, facilities=8):
             demand,
         ])
 
-    df = pd.DataFrame(
-        data,
-        columns=[
-            'ds',
-            'facility_id',
-            'lat',
-            'lon',
-            'hour',
-            'is_weekend',
-            'temp',
-            'is_rainy',
-            'nearby_event',
-            'distance_to_event',
-            'price',
-            'y',
-        ],
+    df = pd.DataFrame(data, columns=DATA_COLUMNS)
+    return df
+
+
+def iter_sport_data_chunks(
+    days=365,
+    facilities=8,
+    seed=None,
+    chunk_size=100_000,
+    start="2024-01-01",
+):
+    """
+    Tesis x saat panelini sabit boyutlu parçalar halinde üretir.
+    Tüm rastgele değişkenler seed'li tek bir np.random.Generator'dan dizi olarak çekilir;
+    aynı seed ve chunk_size ile çıktı birebir tekrar üretilebilir.
+    """
+    rng = np.random.default_rng(seed)
+    base_lat, base_lon = 39.93, 32.85
+    facility_ids = np.arange(1, facilities + 1)
+    facility_lat = base_lat + rng.standard_normal(facilities) / 200
+    facility_lon = base_lon + rng.standard_normal(facilities) / 200
+
+    start = pd.Timestamp(start)
+    total_hours = days * 24
+    hours_per_chunk = max(1, chunk_size // facilities)
+
+    for offset in range(0, total_hours, hours_per_chunk):
+        n_hours = min(hours_per_chunk, total_hours - offset)
+        stamps = start + pd.to_timedelta(np.arange(offset, offset + n_hours), unit="h")
+        n = n_hours * facilities
+
+        # Saat-major sıralama: her zaman damgası için tüm tesisler art arda
+        ds = np.repeat(stamps.values, facilities)
+        facility_id = np.tile(facility_ids, n_hours)
+        lat = np.tile(facility_lat, n_hours)
+        lon = np.tile(facility_lon, n_hours)
+        hour = np.repeat(stamps.hour.values, facilities)
+        month = np.repeat(stamps.month.values, facilities)
+        is_weekend = (np.repeat(stamps.weekday.values, facilities) >= 5).astype(np.int64)
+
+        # Dış faktörler
+        rain_prob = np.where(np.isin(month, [12, 1, 2]), 0.8, 0.2)
+        is_rainy = ((rng.random(n) < rain_prob) & (rng.random(n) < 0.3)).astype(np.int64)
+        nearby_event = (rng.random(n) < 0.05).astype(np.int64)
+        event_lat = base_lat + rng.standard_normal(n) / 100
+        event_lon = base_lon + rng.standard_normal(n) / 100
+        distance_to_event = np.where(
+            nearby_event == 1,
+            haversine_km(lat, lon, event_lat, event_lon),
+            50.0,
+        )
+
+        base_temp = 25 - np.abs(month - 7) * 3
+        temp = base_temp + rng.normal(0, 3, n) - (is_rainy * 5)
+
+        # Fiyatlandırma
+        is_prime_time = ((hour >= 18) & (hour <= 22)).astype(np.int64)
+        price = 100 + (is_prime_time * 50) + (is_weekend * 20)
+
+        # Talep (generate_sport_data ile aynı ground truth)
+        demand = (
+            20.0
+            + is_prime_time * 30
+            + is_weekend * 15
+            + nearby_event * 25
+            + np.maximum(0, 30 - distance_to_event) * 0.8
+            - is_rainy * 40
+            - (price - 100) * 0.5
+            + rng.normal(0, 5, n)
+        )
+        demand = np.clip(demand, 0, 100)
+
+        yield pd.DataFrame(
+            {
+                'ds': ds,
+                'facility_id': facility_id,
+                'lat': lat,
+                'lon': lon,
+                'hour': hour.astype(np.int64),
+                'is_weekend': is_weekend,
+                'temp': temp,
+                'is_rainy': is_rainy,
+                'nearby_event': nearby_event,
+                'distance_to_event': distance_to_event,
+                'price': price,
+                'y': demand,
+            },
+            columns=DATA_COLUMNS,
+        )
+
+
+@timed("data_gen.generate_sport_data_to_db")
+def generate_sport_data_to_db(
+    days=365,
+    facilities=8,
+    seed=None,
+    chunk_size=100_000,
+    db_path=DB_PATH,
+):
+    """Panel verisini parça parça doğrudan SQLite'a yazar; bellek kullanımı chunk_size ile sınırlı kalır."""
+    total_rows = 0
+    chunks = iter_sport_data_chunks(
+        days=days, facilities=facilities, seed=seed, chunk_size=chunk_size
     )
+    for idx, chunk in enumerate(chunks):
+        save_sport_data(chunk, db_path, if_exists="replace" if idx == 0 else "append")
+        total_rows += len(chunk)
+    return total_rows
+
+
+@timed("data_gen.save_sport_data")
+def save_sport_data(df, db_path=DB_PATH, if_exists="replace"):
+    """
+    if_exists="replace" tabloyu baştan yazar; diğer değerlerde satırlar ingest_sport_data ile
+    (facility_id, ds) anahtarında upsert edilir.
+    """
+    if if_exists != "replace":
+        return ingest_sport_data(df, db_path)
+    manager = get_manager(db_path)
+    with manager.writer() as conn, manager.timed("save_sport_data"):
+        # Tablo baştan yazılıyor; eski rollup toplamları geçersiz
+        invalidate_rollups(conn)
+        conn.execute("DROP TABLE IF EXISTS sport_data")
+        bump_generation(conn)
+        # Toplu yükleme: indeksler satırlar yazıldıktan sonra tek geçişte kurulur
+        conn.execute(SPORT_DATA_DDL)
+        for batch in iter_batches(df):
+            write_sport_data_rows(conn, batch, upsert=False)
+        deduplicate_sport_data(conn)
+        create_sport_data_table(conn)
+
+
+def _compact_dtypes(df):
+    for column, dtype in COMPACT_DTYPES.items():
+        if column in df.columns:
+            # NULL içeren tamsayı sütunları pandas'ın nullable tipine (Int8, Int16, ...) geçer
+            if dtype.startswith('int') and df[column].isna().any():
+                dtype = dtype.capitalize()
+            df[column] = df[column].astype(dtype)
     return df
 
-def save_sport_data(df, db_path=DB_PATH):
-    db_path = Path(db_path)
-    with sqlite3.connect(db_path) as conn:
-        df.to_sql("sport_data", conn, if_exists="replace", index=False)
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_sport_data_facility ON sport_data(facility_id)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_sport_data_date ON sport_data(ds)")
+
+def sport_data_query(
+    columns=None,
+    start=None,
+    end=None,
+    facility_ids=None,
+    iso_ds=False,
+    keyset=False,
+    after_rowid=None,
+    until_rowid=None,
+):
+    """
+    sport_data için (sorgu, parametreler) üretir. Filtreler SQL'e itilir; (facility_id, ds)
+    ve ds indeksleri kullanılır. iso_ds=True ise ds epoch yerine ISO metin olarak seçilir.
+    after_rowid/until_rowid yalnızca (after_rowid, until_rowid] aralığındaki satırları seçer.
+    keyset=True ise rowid ile sayfalanan sorgu döner: ilk sütun _rowid, sorgu sonunda
+    parametrelere eklenecek iki yer tutucu (son rowid, sayfa boyutu) bulunur.
+    """
+    columns = list(columns) if columns is not None else DATA_COLUMNS
+    unknown = sorted(set(columns) - set(DATA_COLUMNS) - {'day', 'week_of_year'})
+    if unknown:
+        raise ValueError(f"Unknown sport_data columns: {unknown}")
+
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append("ds >= ?")
+        params.append(int(to_epoch_seconds([start])[0]))
+    if end is not None:
+        conditions.append("ds < ?")
+        params.append(int(to_epoch_seconds([end])[0]))
+    if facility_ids is not None:
+        facility_ids = [int(facility_id) for facility_id in facility_ids]
+        conditions.append(f"facility_id IN ({', '.join('?' * len(facility_ids))})")
+        params.extend(facility_ids)
+    if after_rowid is not None:
+        conditions.append("rowid > ?")
+        params.append(int(after_rowid))
+    if until_rowid is not None:
+        conditions.append("rowid <= ?")
+        params.append(int(until_rowid))
+
+    selected = [
+        "STRFTIME('%Y-%m-%d %H:%M:%S', ds, 'unixepoch') AS ds" if column == 'ds' and iso_ds else column
+        for column in columns
+    ]
+    if keyset:
+        selected.insert(0, "rowid AS _rowid")
+        conditions.append("rowid > ?")
+    query = f"SELECT {', '.join(selected)} FROM sport_data"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if keyset:
+        query += " ORDER BY rowid LIMIT ?"
+    return query, params
+
+
+def _iter_sport_data(manager, query, params, chunksize, compact):
+    # Her parça için havuzdan kısa süreli bir okuyucu alınır; çağıran iterasyonu ne kadar
+    # uzatırsa uzatsın bağlantı parçalar arasında havuza döner. Sayfalama rowid iledir.
+    last_rowid = 0
+    while True:
+        with manager.reader() as conn, manager.timed("load_sport_data"):
+            chunk = pd.read_sql_query(query, conn, params=[*params, last_rowid, chunksize])
+        if chunk.empty:
+            return
+        last_rowid = int(chunk['_rowid'].iloc[-1])
+        chunk = chunk.drop(columns='_rowid')
+        if 'ds' in chunk.columns:
+            chunk['ds'] = from_epoch_seconds(chunk['ds'])
+        yield _compact_dtypes(chunk) if compact else chunk
+        if len(chunk) < chunksize:
+            return
+
+
+@timed("data_gen.load_sport_data")
+def load_sport_data(
+    db_path=DB_PATH,
+    columns=None,
+    start=None,
+    end=None,
+    facility_ids=None,
+    chunksize=None,
+    compact=False,
+    after_rowid=None,
+    until_rowid=None,
+):
+    """
+    sport_data tablosunu okur. columns ile sütun alt kümesi, start/end (end hariç) ve
+    facility_ids ile SQL tarafında filtre uygulanır. compact=True ise bayraklar int8,
+    tesis/saat int16, ölçümler float32 olarak döner. chunksize verilirse DataFrame
+    parçaları üreten bir iteratör döner. after_rowid/until_rowid artımlı okuma içindir.
+    """
+    ensure_schema(db_path)
+    manager = get_manager(db_path)
+    if chunksize is not None:
+        query, params = sport_data_query(
+            columns, start, end, facility_ids, keyset=True, after_rowid=after_rowid, until_rowid=until_rowid
+        )
+        return _iter_sport_data(manager, query, params, chunksize, compact)
+    query, params = sport_data_query(
+        columns, start, end, facility_ids, after_rowid=after_rowid, until_rowid=until_rowid
+    )
+
+    df = manager.read_sql(query, params=params, name="load_sport_data")
+    if 'ds' in df.columns:
+        df['ds'] = from_epoch_seconds(df['ds'])
+    return _compact_dtypes(df) if compact else df
 
 
-def load_sport_data(db_path=DB_PATH):
-    db_path = Path(db_path)
-    if not db_path.exists():
-        raise FileNotFoundError(f"Database not found: {db_path}")
-    with sqlite3.connect(db_path) as conn:
-        return pd.read_sql_query("SELECT * FROM sport_data", conn)
+@timed("data_gen.data_watermark")
+def data_watermark(db_path=DB_PATH):
+    """
+    Cache anahtarı olarak kullanılabilecek ucuz veri filigranı: (generation, max_rowid, max_ds).
+    Tablonun tamamı okunmaz; yeni satır eklenmesi veya tablonun yeniden yazılması değeri değiştirir.
+    """
+    ensure_schema(db_path)
+    with get_manager(db_path).reader() as conn:
+        return read_watermark(conn)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+import perf
+
+DB_PATH = Path("sportpulse.db")
+
+# Okuma bağlantıları için: 256 MB mmap, ~64 MB sayfa önbelleği, geçici tablolar bellekte
+READ_PRAGMAS = {
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+# Tek yazıcı bağlantısı: WAL sayesinde okuyucular yazma sırasında bloklanmaz
+WRITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    **READ_PRAGMAS,
+}
+
+
+def _apply_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+class ConnectionManager:
+    """
+    Tek bir SQLite dosyası için thread-safe okuma havuzu + tek yazıcı bağlantısı.
+    Okuyucular read-only (mode=ro) açılır ve havuzda tekrar kullanılır; yazma işlemleri
+    kilitli tek bağlantı üzerinden yapılır. Sorgu süreleri perf modülüne "db.<isim>" olarak yazılır.
+    """
+
+    def __init__(self, db_path=DB_PATH, pool_size=4):
+        self.db_path = Path(db_path)
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue()
+        self._writer = None
+        self._writer_lock = threading.RLock()
+        self._identity_lock = threading.Lock()
+        self._identity = None
+
+    def _file_identity(self):
+        try:
+            stat = os.stat(self.db_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def _check_identity(self):
+        # Dosya silinip yeniden oluşturulduysa eski bağlantılar atılır
+        identity = self._file_identity()
+        with self._identity_lock:
+            if identity == self._identity:
+                return
+            self._identity = identity
+        self._drain_pool()
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def _drain_pool(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def require_db(self):
+        if not self.db_path.exists():
+            raise FileNotFoundError(f"Database not found: {self.db_path}")
+
+    def _connect_reader(self):
+        uri = f"{self.db_path.resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        _apply_pragmas(conn, READ_PRAGMAS)
+        return conn
+
+    def _ensure_wal(self):
+        # Read-only bağlantılar journal modunu değiştiremez; WAL'a geçişi yazıcı yapar
+        with self.writer():
+            pass
+
+    @contextmanager
+    def reader(self):
+        self.require_db()
+        self._check_identity()
+        if self._writer is None:
+            self._ensure_wal()
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect_reader()
+        try:
+            yield conn
+        finally:
+            if self._pool.qsize() < self.pool_size:
+                self._pool.put(conn)
+            else:
+                conn.close()
+
+    @contextmanager
+    def writer(self):
+        self._check_identity()
+        with self._writer_lock:
+            if self._writer is None:
+                self.db_path.parent.mkdir(parents=True, exist_ok=True)
+                self._writer = sqlite3.connect(self.db_path, check_same_thread=False)
+                _apply_pragmas(self._writer, WRITE_PRAGMAS)
+                with self._identity_lock:
+                    self._identity = self._file_identity()
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def timed(self, name):
+        """Sorgu süresini süreç geneli perf istatistiklerine "db.<name>" olarak kaydeder."""
+        return perf.timed(f"db.{name}")
+
+    def read_sql(self, query, params=None, name="query"):
+        """Havuzdan bir okuyucu alıp sorguyu DataFrame olarak döndürür ve süresini kaydeder."""
+        with self.reader() as conn, self.timed(name):
+            return pd.read_sql_query(query, conn, params=params)
+
+    def close(self):
+        self._drain_pool()
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+_MANAGERS = {}
+_MANAGERS_LOCK = threading.Lock()
+
+
+def get_manager(db_path=DB_PATH):
+    """Aynı dosya için süreç genelinde tek bir ConnectionManager döndürür."""
+    key = str(Path(db_path).resolve())
+    with _MANAGERS_LOCK:
+        manager = _MANAGERS.get(key)
+        if manager is None:
+            manager = ConnectionManager(db_path)
+            _MANAGERS[key] = manager
+        return manager
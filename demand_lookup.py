@@ -0,0 +1,243 @@
+import itertools
+import json
+import math
+import shutil
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+LOOKUP_VERSION = 1
+# Tablo eksen sırası; fiyat en sonda (optimum tablosunda fiyat ekseni yoktur)
+LOOKUP_AXES = ("hour", "is_weekend", "is_rainy", "temp", "distance_to_event", "price")
+# Bu eksenlerde yalnızca tam ızgara değerleri kabul edilir, diğerleri doğrusal interpole edilir
+DISCRETE_AXES = ("hour", "is_weekend", "is_rainy")
+# Etkinlik yoksa uzaklık her zaman 50 km yazılır (data_gen); bu dilimde uzaklık ekseni tek noktadır
+NO_EVENT_DISTANCE_KM = 50.0
+# Izgara noktasıyla eşleşme toleransı
+GRID_TOLERANCE = 1e-6
+# Talep tensörü float16 saklanır (~0.05 kişi hassasiyet); optimum tablosu float32
+DEMAND_DTYPE = np.float16
+OPTIMAL_COLUMNS = ("optimal_price", "optimal_demand", "max_revenue")
+
+
+def default_grid(nearby_event):
+    """Dashboard girdilerinin ızgarası: saat, bayraklar, tam °C, 0.5 km uzaklık, 10 TL fiyat."""
+    return {
+        "hour": np.arange(24, dtype=float),
+        "is_weekend": np.array([0.0, 1.0]),
+        "is_rainy": np.array([0.0, 1.0]),
+        "temp": np.arange(-5, 41, dtype=float),
+        "distance_to_event": (
+            np.arange(0, 50.5, 0.5) if nearby_event else np.array([NO_EVENT_DISTANCE_KM])
+        ),
+        "price": np.arange(50, 301, 10, dtype=float),
+    }
+
+
+def _axis_position(values, value, discrete):
+    """(alt indeks, üst indeks, üst ağırlık) veya ızgara dışındaysa None."""
+    if not values[0] - GRID_TOLERANCE <= value <= values[-1] + GRID_TOLERANCE:
+        return None
+    upper = min(int(np.searchsorted(values, value - GRID_TOLERANCE)), len(values) - 1)
+    if abs(values[upper] - value) <= GRID_TOLERANCE:
+        return upper, upper, 0.0
+    if discrete or upper == 0:
+        return None
+    lower = upper - 1
+    weight = (value - values[lower]) / (values[upper] - values[lower])
+    return lower, upper, float(weight)
+
+
+def _interpolate(table, positions):
+    """Çok doğrusal interpolasyon: yalnızca ağırlığı sıfır olmayan köşeler okunur."""
+    corners = [
+        [(lower, 1.0)] if weight == 0 else [(lower, 1.0 - weight), (upper, weight)]
+        for lower, upper, weight in positions
+    ]
+    total = 0.0
+    for corner in itertools.product(*corners):
+        index = tuple(idx for idx, _ in corner)
+        total = total + math.prod(weight for _, weight in corner) * np.asarray(table[index], dtype=float)
+    return total
+
+
+class DemandLookup:
+    """
+    Eğitim sonrası önceden hesaplanan talep tensörü ve optimum fiyat tablosu.
+    nearby_event'in her değeri için ayrı dilim tutulur; dosyalar .npy olarak yazılıp
+    memory-map ile açılır. Izgara dışındaki girdilerde None döner (model ile hesaplanır).
+    """
+
+    def __init__(self, slices):
+        # slices: nearby_event -> {"axes": {...}, "demand": ndarray, "optimal": ndarray}
+        self.slices = slices
+
+    @classmethod
+    def build(cls, engine, path, nearby_events=(0, 1)):
+        """engine ile tüm ızgarayı skorlayıp path klasörüne yazar ve memory-map ile açar."""
+        from model_engine import FEATURE_COLUMNS
+
+        path = Path(path)
+        staging = path.with_name(path.name + ".tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+
+        meta = {"version": LOOKUP_VERSION, "axes": list(LOOKUP_AXES), "slices": {}}
+        for nearby_event in nearby_events:
+            grid = default_grid(nearby_event)
+            prices = grid["price"]
+            scenario_axes = LOOKUP_AXES[:-1]
+            shape = tuple(len(grid[axis]) for axis in scenario_axes)
+            demand = np.lib.format.open_memmap(
+                staging / f"demand_event{nearby_event}.npy",
+                mode="w+",
+                dtype=DEMAND_DTYPE,
+                shape=shape + (len(prices),),
+            )
+            optimal = np.lib.format.open_memmap(
+                staging / f"optimal_event{nearby_event}.npy",
+                mode="w+",
+                dtype=np.float32,
+                shape=shape + (len(OPTIMAL_COLUMNS),),
+            )
+
+            mesh = np.meshgrid(*(grid[axis] for axis in scenario_axes[1:]), indexing="ij")
+            hour_scenarios = pd.DataFrame(
+                {axis: values.ravel() for axis, values in zip(scenario_axes[1:], mesh)}
+            )
+            # Saat başına bir dilim: bellekte en fazla bir saatlik senaryo ızgarası tutulur
+            for hour_idx, hour in enumerate(grid["hour"]):
+                scenarios = hour_scenarios.assign(hour=hour)
+                scenarios["nearby_event"] = float(nearby_event)
+                scenarios["price"] = prices[0]
+                scenarios = scenarios[FEATURE_COLUMNS]
+
+                demand[hour_idx] = engine.price_response(scenarios, prices).reshape(
+                    shape[1:] + (len(prices),)
+                )
+                best = engine.optimize_prices(scenarios)
+                # Gelir üretilemeyen senaryoda optimum mevcut fiyata bağlıdır; tabloya yazılmaz
+                best.loc[best["max_revenue"] <= 0, "optimal_price"] = np.nan
+                optimal[hour_idx] = best[list(OPTIMAL_COLUMNS)].to_numpy(dtype=np.float32).reshape(
+                    shape[1:] + (len(OPTIMAL_COLUMNS),)
+                )
+            demand.flush()
+            optimal.flush()
+            del demand, optimal
+
+            meta["slices"][str(nearby_event)] = {
+                axis: grid[axis].tolist() for axis in LOOKUP_AXES
+            }
+
+        (staging / "lookup.json").write_text(json.dumps(meta), encoding="utf-8")
+        shutil.rmtree(path, ignore_errors=True)
+        staging.rename(path)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        """Tabloları memory-map ile açar; uyumsuz veya eksikse None döner."""
+        path = Path(path)
+        meta_path = path / "lookup.json"
+        if not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if meta.get("version") != LOOKUP_VERSION or tuple(meta.get("axes", ())) != LOOKUP_AXES:
+            return None
+        slices = {}
+        for key, axes in meta["slices"].items():
+            slices[int(key)] = {
+                "axes": {axis: np.asarray(values, dtype=float) for axis, values in axes.items()},
+                "demand": np.load(path / f"demand_event{key}.npy", mmap_mode="r"),
+                "optimal": np.load(path / f"optimal_event{key}.npy", mmap_mode="r"),
+            }
+        return cls(slices)
+
+    def _positions(self, features, axes):
+        from model_engine import FEATURE_COLUMNS
+
+        # Tek satırın değerleri; sütunlar model sırasındaysa pandas seçimi atlanır
+        if features.columns.tolist() != FEATURE_COLUMNS:
+            features = features[FEATURE_COLUMNS]
+        row = dict(zip(FEATURE_COLUMNS, features.to_numpy(dtype=float)[0].tolist()))
+        nearby_event = row["nearby_event"]
+        if nearby_event not in (0, 1) or int(nearby_event) not in self.slices:
+            return None, None
+        table = self.slices[int(nearby_event)]
+        positions = []
+        for axis in axes:
+            position = _axis_position(table["axes"][axis], row[axis], axis in DISCRETE_AXES)
+            if position is None:
+                return None, None
+            positions.append(position)
+        return table, positions
+
+    def demand(self, features):
+        """Tek senaryo için talep; ızgara dışındaysa None."""
+        table, positions = self._positions(features, LOOKUP_AXES)
+        if table is None:
+            return None
+        return max(0.0, float(_interpolate(table["demand"], positions)))
+
+    def optimal_price(self, features, score=None):
+        """
+        Tek senaryo için (optimal_price, optimal_demand, max_revenue); ızgara dışındaysa None.
+        Izgara noktasında tablodaki üçlü aynen döner. Noktalar arasında score(fiyatlar) verilirse
+        aday fiyatlar modelle bir kez skorlanır, verilmezse saklanan sütunlar interpole edilir.
+        """
+        table, positions = self._positions(features, LOOKUP_AXES[:-1])
+        if table is None:
+            return None
+        if all(weight == 0 for _, _, weight in positions):
+            values = np.asarray(table["optimal"][tuple(lower for lower, _, _ in positions)], dtype=float)
+        else:
+            values = _interpolate(table["optimal"], positions)
+        if np.isnan(values[0]):
+            return None
+        if score is None or all(weight == 0 for _, _, weight in positions):
+            return tuple(float(value) for value in values)
+        # Talep fiyatla basamaklı değişir: interpolasyonlu fiyat ve komşu köşelerin optimum
+        # fiyatları tek model çağrısında skorlanır, en yüksek gelirli aday seçilir
+        corners = itertools.product(
+            *[[lower] if weight == 0 else [lower, upper] for lower, upper, weight in positions]
+        )
+        prices = np.array(
+            [values[0]] + [table["optimal"][corner][0] for corner in corners], dtype=float
+        )
+        prices = np.unique(prices[~np.isnan(prices)])
+        demand = np.asarray(score(prices), dtype=float)
+        best = int(np.argmax(prices * demand))
+        return float(prices[best]), float(demand[best]), float(prices[best] * demand[best])
+
+    def check(self, engine, samples=64, seed=0, rtol=1e-3):
+        """
+        Rastgele ızgara noktalarında tablo yanıtının engine.optimize_prices ile aynı olduğunu
+        doğrular; uyuşmazsa ValueError. Dönüş: karşılaştırılan senaryo sayısı.
+        """
+        from model_engine import FEATURE_COLUMNS
+
+        rng = np.random.default_rng(seed)
+        rows = []
+        for nearby_event, table in self.slices.items():
+            for _ in range(samples):
+                row = {
+                    axis: float(rng.choice(table["axes"][axis])) for axis in LOOKUP_AXES[:-1]
+                }
+                rows.append({**row, "nearby_event": float(nearby_event), "price": 0.0})
+        scenarios = pd.DataFrame(rows)[FEATURE_COLUMNS]
+        expected = engine.optimize_prices(scenarios)
+        compared = 0
+        for position, reference in enumerate(expected.itertuples(index=False)):
+            answer = self.optimal_price(scenarios.iloc[[position]])
+            if answer is None:
+                # Gelir üretilemeyen senaryolar tabloya yazılmaz
+                if reference.max_revenue > 0:
+                    raise ValueError(f"Lookup ızgara noktasını yanıtlamadı: {rows[position]}")
+                continue
+            if not np.allclose(answer, tuple(reference), rtol=rtol, atol=1e-3):
+                raise ValueError(
+                    f"Lookup optimize_prices ile uyuşmuyor: {rows[position]} {answer} != {tuple(reference)}"
+                )
+            compared += 1
+        return compared
@@ -1,5 +1,20 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 
+from perf import timed
+
+FORECAST_STATE_DIR = Path("artifacts") / "forecast"
+# Takvime bağlı tam yeniden fit: bu kadar yeni hafta birikince parametreler yeniden tahmin edilir
+REFIT_EVERY_WEEKS = 13
+# Yeni haftaların eski modele göre standartlaştırılmış hatası bu eşiği aşarsa drift kabul edilir
+DRIFT_Z_THRESHOLD = 3.0
+
 
 def prepare_weekly_series(df):
     weekly = df.copy()
@@ -13,11 +28,20 @@ def prepare_weekly_series(df):
     return weekly
 
 
-def build_weekly_forecast(df, periods=8):
-    from statsmodels.tsa.statespace.sarimax import SARIMAX
+def prepare_facility_weekly_series(df):
+    """Tesis bazında haftalık (W-MON) ortalama talep serilerini uzun formatta döndürür."""
+    weekly = df[["ds", "facility_id", "y"]].copy()
+    weekly["ds"] = pd.to_datetime(weekly["ds"])
+    return (
+        weekly.groupby(["facility_id", pd.Grouper(key="ds", freq="W-MON")])["y"]
+        .mean()
+        .reset_index()
+        .sort_values(["facility_id", "ds"])
+    )
 
-    weekly = prepare_weekly_series(df)
-    series = weekly.set_index("ds")["y"]
+
+def _fit_sarimax(series, periods):
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
 
     model = SARIMAX(
         series,
@@ -27,7 +51,10 @@ def build_weekly_forecast(df, periods=8):
         enforce_invertibility=False,
     )
     results = model.fit(disp=False)
+    return _forecast_frame(results, periods), results
+
 
+def _forecast_frame(results, periods):
     forecast = results.get_forecast(steps=periods)
     predicted = forecast.predicted_mean
     conf_int = forecast.conf_int()
@@ -40,5 +67,193 @@ def build_weekly_forecast(df, periods=8):
             "upper_ci": conf_int.iloc[:, 1].values,
         }
     )
+    return forecast_df
+
+
+@timed("forecast_engine.build_weekly_forecast")
+def build_weekly_forecast(df, periods=8):
+    weekly = prepare_weekly_series(df)
+    series = weekly.set_index("ds")["y"]
+
+    forecast_df, results = _fit_sarimax(series, periods)
     history = weekly.rename(columns={"y": "actual"})
     return history, forecast_df, results
+
+
+def _load_forecast_state(state_dir):
+    from statsmodels.iolib.smpickle import load_pickle
+
+    state_dir = Path(state_dir)
+    results_path = state_dir / "results.pkl"
+    meta_path = state_dir / "state.json"
+    if not results_path.exists() or not meta_path.exists():
+        return None, {}
+    try:
+        results = load_pickle(results_path)
+    except Exception:  # noqa: BLE001 - bozuk/uyumsuz state tam fit ile yeniden üretilir
+        return None, {}
+    return results, json.loads(meta_path.read_text(encoding="utf-8"))
+
+
+def _save_forecast_state(state_dir, results, meta):
+    state_dir = Path(state_dir)
+    state_dir.mkdir(parents=True, exist_ok=True)
+    staging = state_dir / "results.pkl.tmp"
+    results.save(staging)
+    staging.replace(state_dir / "results.pkl")
+    (state_dir / "state.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+
+def load_last_forecast(df, periods=8, state_dir=FORECAST_STATE_DIR):
+    """
+    Kaydedilmiş son SARIMAX durumundan fit yapmadan forecast üretir (veri daha yeni olabilir).
+    Durum yoksa None; aksi halde (history, forecast_df, results, info) döner, info["mode"] "stale" olur.
+    """
+    results, meta = _load_forecast_state(state_dir)
+    if results is None:
+        return None
+    history = prepare_weekly_series(df).rename(columns={"y": "actual"})
+    info = {**meta, "mode": "stale"}
+    return history, _forecast_frame(results, periods), results, info
+
+
+def _drift_detected(results, new_obs, threshold):
+    # Eski model ile yeni haftaların tahmini; hata/standart hata oranı eşiği aşıyor mu?
+    forecast = results.get_forecast(steps=len(new_obs))
+    mean = np.asarray(forecast.predicted_mean)
+    se = np.asarray(forecast.se_mean)
+    actual = new_obs.to_numpy()
+    valid = ~np.isnan(actual) & (se > 0)
+    if not valid.any():
+        return False
+    z_scores = np.abs(actual[valid] - mean[valid]) / se[valid]
+    return bool(z_scores.max() > threshold)
+
+
+@timed("forecast_engine.update_weekly_forecast")
+def update_weekly_forecast(
+    df,
+    periods=8,
+    state_dir=FORECAST_STATE_DIR,
+    refit_every=REFIT_EVERY_WEEKS,
+    drift_threshold=DRIFT_Z_THRESHOLD,
+    force_refit=False,
+):
+    """
+    build_weekly_forecast'ın artımlı sürümü. Kaydedilmiş SARIMAX sonuçları varsa:
+    - yalnızca yeni haftalar geldiyse sabit parametrelerle append edilir,
+    - geçmiş değiştiyse (ör. son kısmi hafta doldu) aynı parametrelerle yeniden filtrelenir,
+    - refit_every hafta birikince veya drift görülünce tam yeniden fit yapılır.
+    Dönüş: (history, forecast_df, results, info); info["mode"] refit/append/apply/cached olur.
+    """
+    weekly = prepare_weekly_series(df)
+    series = weekly.set_index("ds")["y"].asfreq("W-MON")
+    history = weekly.rename(columns={"y": "actual"})
+
+    results, meta = (None, {}) if force_refit else _load_forecast_state(state_dir)
+    weeks_since_refit = 0
+    mode = "refit"
+    if results is not None:
+        old_index = results.fittedvalues.index
+        n_old = len(old_index)
+        if len(series) >= n_old and series.index[:n_old].equals(old_index):
+            old_values = np.asarray(results.model.endog).ravel()
+            history_changed = not np.allclose(
+                series.iloc[:n_old].to_numpy(), old_values, equal_nan=True
+            )
+            new_obs = series.iloc[n_old:]
+            weeks_since_refit = meta.get("weeks_since_refit", 0) + len(new_obs)
+
+            if weeks_since_refit >= refit_every:
+                mode = "refit"
+            elif len(new_obs) and _drift_detected(results, new_obs, drift_threshold):
+                mode = "refit"
+            elif history_changed:
+                results = results.apply(series, refit=False)
+                mode = "apply"
+            elif len(new_obs):
+                results = results.append(new_obs, refit=False)
+                mode = "append"
+            else:
+                mode = "cached"
+
+    if mode == "refit":
+        forecast_df, results = _fit_sarimax(series, periods)
+        weeks_since_refit = 0
+    else:
+        forecast_df = _forecast_frame(results, periods)
+
+    info = {
+        "mode": mode,
+        "weeks_since_refit": weeks_since_refit,
+        "last_week": series.index[-1].isoformat(),
+    }
+    if mode != "cached":
+        _save_forecast_state(state_dir, results, info)
+    return history, forecast_df, results, info
+
+
+def _fit_facility_forecast(task):
+    # Process pool'a gönderildiği için modül seviyesinde ve yalnızca picklable girdilerle
+    facility_id, index, values, periods = task
+    start = time.perf_counter()
+    try:
+        series = pd.Series(values, index=pd.DatetimeIndex(index)).asfreq("W-MON")
+        forecast_df, _ = _fit_sarimax(series, periods)
+        forecast_df.insert(0, "facility_id", facility_id)
+        error = None
+    except Exception as exc:  # noqa: BLE001 - tek tesisin hatası tüm işi durdurmamalı
+        forecast_df = None
+        error = f"{type(exc).__name__}: {exc}"
+    return facility_id, forecast_df, error, time.perf_counter() - start, len(values)
+
+
+@timed("forecast_engine.build_facility_forecasts")
+def build_facility_forecasts(df, periods=8, max_workers=None, facility_ids=None):
+    """
+    Her tesis için ayrı SARIMAX modelini bir process pool üzerinde paralel olarak eğitir.
+    max_workers=1 ise işler aynı süreçte sırayla çalışır.
+    Dönüş: (facility_id, ds, forecast, lower_ci, upper_ci) içeren birleşik forecast tablosu
+    ve tesis bazlı fit raporu (status, error, fit_seconds, n_weeks).
+    """
+    weekly = prepare_facility_weekly_series(df)
+    if facility_ids is not None:
+        weekly = weekly[weekly["facility_id"].isin(facility_ids)]
+
+    tasks = [
+        (int(facility_id), group["ds"].to_numpy(), group["y"].to_numpy(), periods)
+        for facility_id, group in weekly.groupby("facility_id")
+    ]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(tasks) <= 1:
+        outcomes = [_fit_facility_forecast(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(tasks))) as pool:
+            outcomes = list(pool.map(_fit_facility_forecast, tasks))
+
+    forecasts = []
+    report = []
+    for facility_id, forecast_df, error, fit_seconds, n_weeks in outcomes:
+        if forecast_df is not None:
+            forecasts.append(forecast_df)
+        report.append(
+            {
+                "facility_id": facility_id,
+                "status": "ok" if error is None else "failed",
+                "error": error,
+                "fit_seconds": fit_seconds,
+                "n_weeks": n_weeks,
+            }
+        )
+
+    forecast_columns = ["facility_id", "ds", "forecast", "lower_ci", "upper_ci"]
+    forecast_df = (
+        pd.concat(forecasts, ignore_index=True)
+        if forecasts
+        else pd.DataFrame(columns=forecast_columns)
+    )
+    fit_report = pd.DataFrame(
+        report, columns=["facility_id", "status", "error", "fit_seconds", "n_weeks"]
+    )
+    return forecast_df, fit_report
@@ -1,28 +1,120 @@
+import gzip
+import hashlib
 import json
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 
-def build_facility_geojson(df):
-    features = []
-    for _, row in df.iterrows():
-        features.append(
-            {
-                "type": "Feature",
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [row["lon"], row["lat"]],
-                },
-                "properties": {
-                    "facility_id": int(row["facility_id"]),
-                    "avg_demand": float(row["avg_demand"]),
-                },
-            }
+from perf import timed
+
+# Çıktı formatı değişirse eski hash'lerin geçersiz sayılması için
+GEOJSON_FORMAT_VERSION = 1
+BASE_PROPERTIES = ["facility_id", "avg_demand"]
+
+
+def _property_columns(df, properties):
+    columns = list(BASE_PROPERTIES)
+    for column in properties or []:
+        if column not in columns:
+            columns.append(column)
+    missing = [column for column in columns + ["lat", "lon"] if column not in df.columns]
+    if missing:
+        raise ValueError(f"Missing GeoJSON columns: {missing}")
+    return columns
+
+
+def _encode_column(series):
+    # Sütunu bir kez JSON metnine çevir; float/int için repr/str json.dumps'tan çok daha ucuz
+    values = series.to_numpy()
+    if values.dtype.kind == "f":
+        return ["null" if not np.isfinite(value) else repr(value) for value in values.tolist()]
+    if values.dtype.kind == "b":
+        return ["true" if value else "false" for value in values.tolist()]
+    if values.dtype.kind in "iu":
+        return [str(value) for value in values.tolist()]
+    return [json.dumps(value, ensure_ascii=False, default=str) for value in values.tolist()]
+
+
+def iter_facility_feature_json(df, properties=None):
+    """Her tesis için kompakt GeoJSON Feature metni üretir (sütun bazlı kodlama)."""
+    columns = _property_columns(df, properties)
+    lons = _encode_column(df["lon"].astype(float))
+    lats = _encode_column(df["lat"].astype(float))
+    encoded = [
+        _encode_column(df[column].astype(np.int64) if column == "facility_id" else df[column])
+        for column in columns
+    ]
+    keys = [json.dumps(column, ensure_ascii=False) for column in columns]
+
+    for idx in range(len(df)):
+        props = ",".join(f"{key}:{values[idx]}" for key, values in zip(keys, encoded))
+        yield (
+            '{"type":"Feature","geometry":{"type":"Point","coordinates":['
+            f'{lons[idx]},{lats[idx]}]}},"properties":{{{props}}}}}'
         )
-    return {"type": "FeatureCollection", "features": features}
 
 
-def export_facility_geojson(df, output_path="sportpulse_facilities.geojson"):
+def iter_facility_features(df, properties=None):
+    """Her tesis için GeoJSON Feature sözlüğü üretir; kodlama iter_facility_feature_json ile ortaktır."""
+    for feature in iter_facility_feature_json(df, properties):
+        yield json.loads(feature)
+
+
+@timed("geo_analytics.build_facility_geojson")
+def build_facility_geojson(df, properties=None):
+    return {"type": "FeatureCollection", "features": list(iter_facility_features(df, properties))}
+
+
+def geojson_content_hash(df, properties=None, compress=False):
+    """Çıktıyı üretmeden, yalnızca girdi sütunlarından içerik hash'i hesaplar."""
+    columns = _property_columns(df, properties) + ["lat", "lon"]
+    digest = hashlib.sha256(
+        json.dumps(
+            {"version": GEOJSON_FORMAT_VERSION, "columns": columns, "compress": compress}
+        ).encode("utf-8")
+    )
+    digest.update(pd.util.hash_pandas_object(df[columns], index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+@timed("geo_analytics.export_facility_geojson")
+def export_facility_geojson(
+    df,
+    output_path="sportpulse_facilities.geojson",
+    properties=None,
+    compress=False,
+    skip_unchanged=True,
+):
+    """
+    Tesis GeoJSON'unu kompakt biçimde, feature feature doğrudan dosyaya yazar.
+    properties: utilization, optimal_price, forecast gibi ek tesis sütunları.
+    compress=True ise gzip ile yazılır (.gz uzantısı eklenir). Girdi hash'i önceki
+    yazımla aynıysa ve dosya duruyorsa disk yazması atlanır.
+    """
     output_path = Path(output_path)
-    geojson = build_facility_geojson(df)
-    output_path.write_text(json.dumps(geojson, ensure_ascii=False, indent=2), encoding="utf-8")
+    if compress and output_path.suffix != ".gz":
+        output_path = output_path.with_name(output_path.name + ".gz")
+    hash_path = output_path.with_name(output_path.name + ".sha256")
+
+    content_hash = geojson_content_hash(df, properties, compress)
+    if (
+        skip_unchanged
+        and output_path.exists()
+        and hash_path.exists()
+        and hash_path.read_text(encoding="utf-8").strip() == content_hash
+    ):
+        return output_path
+
+    staging = output_path.with_name(output_path.name + ".tmp")
+    opener = gzip.open if compress else open
+    with opener(staging, "wt", encoding="utf-8") as output_file:
+        output_file.write('{"type":"FeatureCollection","features":[')
+        for idx, feature in enumerate(iter_facility_feature_json(df, properties)):
+            if idx:
+                output_file.write(",")
+            output_file.write(feature)
+        output_file.write("]}")
+    staging.replace(output_path)
+    hash_path.write_text(content_hash, encoding="utf-8")
     return output_path
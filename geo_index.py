@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+from perf import timed
+
+EARTH_RADIUS_KM = 6371.0
+# data_gen ile aynı sentinel: yakında etkinlik yoksa uzaklık 50 km kabul edilir
+NO_EVENT_DISTANCE_KM = 50.0
+# Talep üzerindeki etkinlik etkisi 30 km'de sıfırlanır (data_gen'deki ground truth)
+NEARBY_EVENT_RADIUS_KM = 30.0
+
+
+def _to_radians(lats, lons):
+    return np.radians(np.column_stack([np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)]))
+
+
+def _ball_tree(lats, lons):
+    from sklearn.neighbors import BallTree
+
+    return BallTree(_to_radians(lats, lons), metric="haversine")
+
+
+class FacilityIndex:
+    """
+    Tesis koordinatları üzerinde haversine metrikli BallTree.
+    Binlerce etkinlik için en yakın tesis / yarıçap içindeki tesis sorgularını tek çağrıda yanıtlar.
+    """
+
+    def __init__(self, facility_ids, lats, lons):
+        self.facility_ids = np.asarray(facility_ids)
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self._tree = _ball_tree(self.lats, self.lons)
+
+    @classmethod
+    def from_frame(cls, df):
+        """facility_id, lat, lon sütunlu (saatlik de olabilir) bir tablodan indeks kurar."""
+        facilities = df[["facility_id", "lat", "lon"]].drop_duplicates("facility_id")
+        return cls(facilities["facility_id"], facilities["lat"], facilities["lon"])
+
+    def __len__(self):
+        return len(self.facility_ids)
+
+    @timed("geo_index.FacilityIndex.nearest_facilities")
+    def nearest_facilities(self, event_lats, event_lons, k=1):
+        """Her etkinlik için en yakın k tesisin (mesafe_km, facility_id) dizilerini döndürür."""
+        k = min(k, len(self))
+        distances, positions = self._tree.query(_to_radians(event_lats, event_lons), k=k)
+        return distances * EARTH_RADIUS_KM, self.facility_ids[positions]
+
+    @timed("geo_index.FacilityIndex.facilities_within")
+    def facilities_within(self, event_lats, event_lons, radius_km):
+        """
+        Her etkinliğin radius_km yarıçapındaki tüm tesisleri uzun formatta döndürür:
+        event_idx, facility_id, distance_km.
+        """
+        positions, distances = self._tree.query_radius(
+            _to_radians(event_lats, event_lons),
+            r=radius_km / EARTH_RADIUS_KM,
+            return_distance=True,
+        )
+        counts = np.fromiter((len(item) for item in positions), dtype=np.int64, count=len(positions))
+        if counts.sum() == 0:
+            return pd.DataFrame(columns=["event_idx", "facility_id", "distance_km"])
+        return pd.DataFrame(
+            {
+                "event_idx": np.repeat(np.arange(len(positions)), counts),
+                "facility_id": self.facility_ids[np.concatenate(positions)],
+                "distance_km": np.concatenate(distances) * EARTH_RADIUS_KM,
+            }
+        )
+
+    @timed("geo_index.FacilityIndex.nearest_event")
+    def nearest_event(self, event_lats, event_lons, max_km=NO_EVENT_DISTANCE_KM):
+        """
+        Her tesis için en yakın etkinliğin indeksini ve mesafesini döndürür.
+        Etkinlik yoksa veya en yakın etkinlik max_km'den uzaksa mesafe max_km, indeks -1 olur.
+        """
+        event_lats = np.asarray(event_lats, dtype=float)
+        distances = np.full(len(self), float(max_km))
+        event_idx = np.full(len(self), -1, dtype=np.int64)
+        if len(event_lats) == 0:
+            return event_idx, distances
+
+        # Etkinlikler güne göre değiştiği için ağaç etkinlikler üzerine kurulur, tesisler sorgulanır
+        event_tree = _ball_tree(event_lats, event_lons)
+        nearest, positions = event_tree.query(_to_radians(self.lats, self.lons), k=1)
+        nearest = nearest[:, 0] * EARTH_RADIUS_KM
+        within = nearest <= max_km
+        distances[within] = nearest[within]
+        event_idx[within] = positions[within, 0]
+        return event_idx, distances
+
+
+@timed("geo_index.derive_distance_to_event")
+def derive_distance_to_event(
+    observations,
+    events,
+    facility_index=None,
+    nearby_radius_km=NEARBY_EVENT_RADIUS_KM,
+    max_km=NO_EVENT_DISTANCE_KM,
+):
+    """
+    Gerçek bir etkinlik takviminden distance_to_event ve nearby_event özelliklerini türetir.
+    observations: ds ve facility_id (ve indeks yoksa lat/lon) içeren saatlik tablo.
+    events: ds (veya gün), lat, lon sütunlu etkinlik listesi.
+    Her gün için o günün etkinlikleri arasından tesise en yakın olanın mesafesi kullanılır.
+    """
+    if facility_index is None:
+        facility_index = FacilityIndex.from_frame(observations)
+    event_days = pd.to_datetime(events["ds"]).dt.normalize()
+
+    daily = []
+    for day, day_events in events.groupby(event_days):
+        _, distances = facility_index.nearest_event(day_events["lat"], day_events["lon"], max_km)
+        daily.append(
+            pd.DataFrame(
+                {
+                    "_day": day,
+                    "facility_id": facility_index.facility_ids,
+                    "distance_to_event": distances,
+                }
+            )
+        )
+
+    obs_days = pd.to_datetime(observations["ds"]).dt.normalize()
+    keys = pd.DataFrame({"_day": obs_days.to_numpy(), "facility_id": observations["facility_id"].to_numpy()})
+    if daily:
+        keys = keys.merge(pd.concat(daily, ignore_index=True), on=["_day", "facility_id"], how="left")
+    distance = keys["distance_to_event"].fillna(max_km).to_numpy() if daily else np.full(len(keys), max_km)
+
+    return observations.assign(
+        distance_to_event=distance,
+        nearby_event=(distance <= nearby_radius_km).astype(np.int64),
+    )
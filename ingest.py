@@ -0,0 +1,223 @@
+"""
+sport_data için ekleme odaklı, yinelenenleri ayıklayan toplu ingest.
+
+Satırlar tek bir transaction içinde çok satırlı INSERT ifadeleriyle (executemany) yazılır;
+(facility_id, ds) anahtarı zaten varsa satır yerinde güncellenir, değerler aynıysa dokunulmaz.
+İndeksler canlı kalır, tablo yeniden yazılmaz. Kaynak DataFrame, DataFrame iteratörü, CSV veya JSONL (gzip dahil) olabilir.
+ds metin/datetime ya da sayısal epoch (s, ms, us, ns; birim verilmezse büyüklükten çıkarılır)
+olarak verilebilir. Geçerli tarih aralığı dışındaki ds değerleri yazılmadan reddedilir.
+
+Örnek:
+    python ingest.py yeni_rezervasyonlar.csv
+    python ingest.py gunluk.jsonl.gz --db sportpulse.db
+"""
+import argparse
+import json
+import sys
+from itertools import chain
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from db_connection import DB_PATH, get_manager
+from perf import timed
+from schema import (
+    SPORT_DATA_COLUMNS,
+    bump_generation,
+    create_sport_data_table,
+    ensure_schema,
+    invalidate_rollups,
+    read_watermark,
+    record_ingest,
+    to_epoch_seconds,
+)
+
+INGEST_BATCH_SIZE = 100_000
+# Tek INSERT ifadesindeki satır sayısı: satır başına VM kurulumu ve bağlama turu azalır
+# (200 x 12 parametre, SQLite'ın parametre sınırının çok altında)
+ROWS_PER_STATEMENT = 200
+INGEST_FORMATS = ("csv", "jsonl")
+# Sayısal ds birimleri ve epoch saniyeye bölenleri; pandas to_json ds'yi milisaniye yazar
+DS_UNITS = {"s": 1, "ms": 1_000, "us": 1_000_000, "ns": 1_000_000_000}
+# Birim verilmezse en büyük mutlak değer bu eşiklerin altında kalan ilk birim seçilir
+DS_UNIT_LIMITS = (("s", 1e11), ("ms", 1e14), ("us", 1e17))
+# load_sport_data'nın datetime64[ns]'e çevirebildiği aralık (epoch saniye)
+MIN_EPOCH_SECONDS = int(pd.Timestamp.min.ceil("s").timestamp())
+MAX_EPOCH_SECONDS = int(pd.Timestamp.max.floor("s").timestamp())
+KEY_COLUMNS = ("facility_id", "ds")
+VALUE_COLUMNS = [column for column in SPORT_DATA_COLUMNS if column not in KEY_COLUMNS]
+
+INSERT_PREFIX = f"INSERT INTO sport_data ({', '.join(SPORT_DATA_COLUMNS)}) VALUES "
+ROW_PLACEHOLDER = f"({', '.join('?' * len(SPORT_DATA_COLUMNS))})"
+# Değişmeyen satırda UPDATE çalışmaz: rowcount yalnızca gerçekten değişen satırları sayar
+UPSERT_CLAUSE = (
+    f" ON CONFLICT({', '.join(KEY_COLUMNS)}) DO UPDATE SET "
+    + ", ".join(f"{column} = excluded.{column}" for column in VALUE_COLUMNS)
+    + " WHERE "
+    + " OR ".join(f"sport_data.{column} IS NOT excluded.{column}" for column in VALUE_COLUMNS)
+)
+
+
+def _infer_format(source):
+    if not isinstance(source, (str, Path)):
+        raise ValueError(f"Dosya nesnesi için fmt gerekli: {INGEST_FORMATS}")
+    suffixes = [suffix.lower() for suffix in Path(source).suffixes]
+    if suffixes and suffixes[-1] in (".gz", ".bz2", ".xz", ".zip"):
+        suffixes = suffixes[:-1]
+    suffix = suffixes[-1] if suffixes else ""
+    if suffix == ".csv":
+        return "csv"
+    if suffix in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError(f"Unknown ingest format for {source}. Choose from {INGEST_FORMATS}")
+
+
+def iter_batches(source, fmt=None, batch_size=INGEST_BATCH_SIZE):
+    """Kaynağı en fazla batch_size satırlık DataFrame parçalarına böler."""
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), batch_size):
+            yield source.iloc[start:start + batch_size]
+        return
+    if isinstance(source, (str, Path)) or hasattr(source, "read"):
+        fmt = fmt or _infer_format(source)
+        # Tam hassas float okuma: aynı dosya tekrar yüklenince satırlar "değişmiş" görünmez
+        if fmt == "csv":
+            reader = pd.read_csv(source, chunksize=batch_size, float_precision="round_trip")
+        elif fmt == "jsonl":
+            reader = pd.read_json(source, lines=True, chunksize=batch_size, precise_float=True)
+        else:
+            raise ValueError(f"Unknown ingest format: {fmt}. Choose from {INGEST_FORMATS}")
+        with reader:
+            yield from reader
+        return
+    for frame in source:
+        yield from iter_batches(frame, batch_size=batch_size)
+
+
+def epoch_seconds(ds, unit=None):
+    """
+    ds değerlerini epoch saniyeye çevirir. Sayısal ds için unit ("s", "ms", "us", "ns")
+    verilmezse büyüklükten çıkarılır. Tabloya yazılınca geri okunamayacak değerler ValueError.
+    """
+    if pd.api.types.is_numeric_dtype(ds):
+        values = np.asarray(ds, dtype="int64")
+        if unit is None:
+            peak = int(np.abs(values).max()) if len(values) else 0
+            unit = next((name for name, limit in DS_UNIT_LIMITS if peak < limit), "ns")
+        if unit not in DS_UNITS:
+            raise ValueError(f"Unknown ds unit: {unit}. Choose from {list(DS_UNITS)}")
+        seconds = values // DS_UNITS[unit]
+    else:
+        seconds = to_epoch_seconds(ds)
+    if len(seconds) and (seconds.min() < MIN_EPOCH_SECONDS or seconds.max() > MAX_EPOCH_SECONDS):
+        raise ValueError(
+            f"ds out of range: {seconds.min()}..{seconds.max()} epoch seconds "
+            f"(unit={unit}); pass ds_unit explicitly"
+        )
+    return seconds
+
+
+def _sport_data_columns(batch, ds_unit=None):
+    missing = [column for column in SPORT_DATA_COLUMNS if column not in batch.columns]
+    if missing:
+        raise ValueError(f"Missing sport_data columns: {missing}")
+    columns = [epoch_seconds(batch['ds'], ds_unit).tolist()]
+    for column in SPORT_DATA_COLUMNS[1:]:
+        values = batch[column]
+        if pd.api.types.is_extension_array_dtype(values.dtype) and values.hasnans:
+            # Nullable Int64/boolean sütunlarındaki pd.NA sqlite3'e bağlanamaz; NULL olarak yazılır
+            values = values.astype(object).where(values.notna(), None)
+        columns.append(values.tolist())
+    return columns
+
+
+def write_sport_data_rows(conn, batch, upsert=True, ds_unit=None):
+    """
+    Parçayı ROWS_PER_STATEMENT satırlık çok satırlı INSERT (upsert=True ise ON CONFLICT ile)
+    ifadeleriyle yazar. Dönüş: eklenen veya gerçekten güncellenen satır sayısı.
+    """
+    clause = UPSERT_CLAUSE if upsert else ""
+    width = len(SPORT_DATA_COLUMNS)
+    values = list(chain.from_iterable(zip(*_sport_data_columns(batch, ds_unit))))
+    step = ROWS_PER_STATEMENT * width
+    full = len(values) // step * step
+    changed = 0
+    if full:
+        statement = INSERT_PREFIX + ", ".join([ROW_PLACEHOLDER] * ROWS_PER_STATEMENT) + clause
+        changed += conn.executemany(
+            statement, (values[start:start + step] for start in range(0, full, step))
+        ).rowcount
+    if full < len(values):
+        tail_rows = (len(values) - full) // width
+        statement = INSERT_PREFIX + ", ".join([ROW_PLACEHOLDER] * tail_rows) + clause
+        changed += conn.execute(statement, values[full:]).rowcount
+    return changed
+
+
+def upsert_sport_data(conn, source, fmt=None, batch_size=INGEST_BATCH_SIZE, ds_unit=None):
+    """
+    Açık bir yazma bağlantısında (tablo ve indeksler hazır) kaynağı upsert eder; şema DDL'i
+    çalıştırmaz. Mevcut satır değiştiyse rollup'lar sıfırlanır ve generation artar.
+    Dönüş: satır sayıları ve ingest sonrası (generation, max_rowid, max_ds) filigranı.
+    """
+    rows = changed = 0
+    max_rowid_before = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM sport_data").fetchone()[0]
+    for batch in iter_batches(source, fmt, batch_size):
+        changed += write_sport_data_rows(conn, batch, ds_unit=ds_unit)
+        rows += len(batch)
+
+    watermark = read_watermark(conn)
+    # Yeni satırlar MAX(rowid)'den itibaren ardışık rowid alır; kalan değişiklikler güncellemedir
+    inserted = watermark[1] - max_rowid_before
+    updated = changed - inserted
+    if updated:
+        invalidate_rollups(conn)
+        bump_generation(conn)
+        watermark = read_watermark(conn)
+    record_ingest(conn, rows)
+    return {
+        "rows": rows,
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": rows - changed,
+        "watermark": watermark,
+    }
+
+
+@timed("ingest.ingest_sport_data")
+def ingest_sport_data(source, db_path=DB_PATH, fmt=None, batch_size=INGEST_BATCH_SIZE, ds_unit=None):
+    """
+    Kaynaktaki satırları tek transaction içinde (facility_id, ds) anahtarıyla upsert eder.
+    Yalnızca yeni satır eklenirse rollup'lar artımlı kalır; mevcut satır değişirse rollup'lar
+    sıfırlanır ve generation artar. Hata olursa (ör. aralık dışı ds) hiçbir satır yazılmaz.
+    ds_unit: sayısal ds'nin birimi; verilmezse büyüklükten çıkarılır.
+    Dönüş: satır sayıları ve ingest sonrası (generation, max_rowid, max_ds) filigranı.
+    """
+    manager = get_manager(db_path)
+    if manager.db_path.exists():
+        ensure_schema(db_path)
+    with manager.writer() as conn, manager.timed("ingest_sport_data"):
+        create_sport_data_table(conn)
+        return upsert_sport_data(conn, source, fmt, batch_size, ds_unit)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="sport_data toplu ingest (CSV / JSONL)")
+    parser.add_argument("paths", nargs="+", type=Path)
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--format", choices=INGEST_FORMATS, default=None)
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--ds-unit", choices=list(DS_UNITS), default=None)
+    args = parser.parse_args(argv)
+
+    for path in args.paths:
+        report = ingest_sport_data(
+            path, db_path=args.db, fmt=args.format, batch_size=args.batch_size, ds_unit=args.ds_unit
+        )
+        print(f"{path}: {json.dumps(report)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import perf
+from db_connection import DB_PATH
+
+JOB_STATES = ("queued", "running", "succeeded", "failed")
+STATUS_COLUMNS = ["job", "state", "key", "runs", "duration_s", "error"]
+# Aynı key ile başarısız olan iş üstel bekleme ile (5 s, 10 s, 20 s, ... en çok 5 dk) ve
+# en fazla MAX_RETRIES kez yeniden denenir; yeni key sayacı sıfırlar
+RETRY_DELAY_S = 5.0
+MAX_RETRY_DELAY_S = 300.0
+MAX_RETRIES = 5
+
+
+class JobRunner:
+    """
+    Eğitim ve forecast gibi uzun işleri isimle thread havuzunda arka planda çalıştırır.
+    Aynı isimli iş zaten kuyruktaysa/çalışıyorsa veya aynı key ile daha önce başarıyla
+    çalıştıysa tekrar gönderilmez; aynı key ile başarısız olan iş bekleme süresi dolunca
+    (en fazla MAX_RETRIES kez) yeniden kuyruğa alınır. Her işin durumu ve son başarılı
+    sonucu saklanır; arayüz bu sonucu hazır olduğunda alır, o zamana kadar son iyi sonuçla
+    çalışmaya devam eder.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sportpulse-job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, name, fn, *args, key=None, **kwargs):
+        """İşi kuyruğa alır; gönderildiyse True, atlandıysa False döner."""
+        with self._lock:
+            job = self._jobs.setdefault(
+                name,
+                {
+                    "state": None,
+                    "key": None,
+                    "runs": 0,
+                    "result": None,
+                    "error": None,
+                    "failures": 0,
+                    "retry_at": 0.0,
+                },
+            )
+            if job["state"] in ("queued", "running"):
+                return False
+            same_key = job["key"] == key
+            if key is not None and same_key and job["state"] == "succeeded":
+                return False
+            if same_key and job["state"] == "failed":
+                if job["failures"] > MAX_RETRIES or time.time() < job["retry_at"]:
+                    return False
+            elif not same_key:
+                job["failures"] = 0
+            job.update(
+                state="queued",
+                key=key,
+                error=None,
+                submitted_at=time.time(),
+                started_at=None,
+                finished_at=None,
+            )
+        perf.increment(f"jobs.{name}.submitted")
+        self._executor.submit(self._run, name, fn, args, kwargs)
+        return True
+
+    def _run(self, name, fn, args, kwargs):
+        with self._lock:
+            self._jobs[name].update(state="running", started_at=time.time())
+        try:
+            with perf.timed(f"jobs.{name}"):
+                result = fn(*args, **kwargs)
+        except Exception as exc:  # noqa: BLE001 - hata duruma yazılır, son iyi sonuç korunur
+            with self._lock:
+                job = self._jobs[name]
+                finished_at = time.time()
+                job["failures"] += 1
+                delay = min(RETRY_DELAY_S * 2 ** (job["failures"] - 1), MAX_RETRY_DELAY_S)
+                job.update(
+                    state="failed",
+                    error=f"{type(exc).__name__}: {exc}",
+                    finished_at=finished_at,
+                    retry_at=finished_at + delay,
+                )
+            perf.increment(f"jobs.{name}.failed")
+            return
+        with self._lock:
+            job = self._jobs[name]
+            job.update(state="succeeded", result=result, finished_at=time.time(), failures=0)
+            job["runs"] += 1
+        perf.increment(f"jobs.{name}.succeeded")
+
+    def state(self, name):
+        with self._lock:
+            job = self._jobs.get(name)
+            return None if job is None else job["state"]
+
+    def result(self, name, default=None):
+        """Son başarılı çalıştırmanın sonucu (iş o an yeniden çalışıyor olsa bile)."""
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None or job["runs"] == 0:
+                return default
+            return job["result"]
+
+    def runs(self):
+        """İş adı -> başarılı tamamlanma sayısı; yeni sonuç geldi mi kontrolü için."""
+        with self._lock:
+            return {name: job["runs"] for name, job in self._jobs.items()}
+
+    def is_busy(self):
+        with self._lock:
+            return any(job["state"] in ("queued", "running") for job in self._jobs.values())
+
+    def status(self):
+        now = time.time()
+        with self._lock:
+            rows = []
+            for name, job in self._jobs.items():
+                started = job.get("started_at")
+                finished = job.get("finished_at")
+                duration = None if started is None else (finished or now) - started
+                rows.append(
+                    {
+                        "job": name,
+                        "state": job["state"],
+                        "key": None if job["key"] is None else str(job["key"]),
+                        "runs": job["runs"],
+                        "duration_s": duration,
+                        "error": job["error"],
+                    }
+                )
+        return pd.DataFrame(rows, columns=STATUS_COLUMNS)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def train_demand_engine(db_path=DB_PATH, force_retrain=False, out_of_core=False, backend="xgboost"):
+    """Arka plan eğitim işi: artifact varsa yükler, yoksa eğitip kaydeder; yeni motoru döndürür."""
+    from model_engine import DemandEngine
+
+    engine = DemandEngine(backend=backend)
+    engine.load_or_train(db_path=db_path, force_retrain=force_retrain, out_of_core=out_of_core)
+    return engine
+
+
+def refresh_weekly_forecast(df, watermark=None, periods=8):
+    """Arka plan forecast işi: SARIMAX durumunu artımlı günceller."""
+    from forecast_engine import update_weekly_forecast
+
+    history, forecast_df, _, info = update_weekly_forecast(df, periods=periods)
+    return {"watermark": watermark, "history": history, "forecast": forecast_df, "info": info}
+
+
+def refresh_facility_forecasts(df, watermark=None, periods=8):
+    """Arka plan işi: tesis bazlı SARIMAX forecast'ları (GeoJSON forecast özelliği için)."""
+    from forecast_engine import build_facility_forecasts
+
+    forecast_df, fit_report = build_facility_forecasts(df, periods=periods)
+    return {"watermark": watermark, "forecast": forecast_df, "report": fit_report}
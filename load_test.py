@@ -0,0 +1,147 @@
+"""
+scoring_service için yerel yük testi istemcisi (yalnızca asyncio).
+
+Sabit sayıda keep-alive bağlantı üzerinden rastgele senaryolarla istek gönderir; istemci
+tarafı p50/p99 gecikme ve ulaşılan istek/saniye değerini, ardından servisin /metrics
+çıktısını yazdırır.
+
+Örnek:
+    python scoring_service.py --port 8765 &
+    python load_test.py --port 8765 --endpoint /optimize_price --requests 5000 --concurrency 64
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+
+from scoring_service import DEFAULT_HOST, DEFAULT_PORT
+
+
+def random_scenario(rng):
+    nearby_event = int(rng.random() < 0.2)
+    return {
+        "hour": int(rng.integers(0, 24)),
+        "is_weekend": int(rng.random() < 2 / 7),
+        "temp": round(float(rng.uniform(-5, 40)), 1),
+        "is_rainy": int(rng.random() < 0.15),
+        "nearby_event": nearby_event,
+        "distance_to_event": round(float(rng.uniform(0, 30)), 1) if nearby_event else 50.0,
+        "price": float(rng.integers(80, 251)),
+    }
+
+
+class HttpClient:
+    """Tek keep-alive bağlantı üzerinde ardışık JSON istekleri."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def request(self, method, path, payload=None):
+        body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        head = (
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {self.host}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        )
+        self._writer.write(head.encode("latin-1") + body)
+        await self._writer.drain()
+
+        status = int((await self._reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self._reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self._reader.readexactly(length))
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+
+
+async def run_load_test(host, port, endpoint, requests, concurrency, seed=42):
+    rng = np.random.default_rng(seed)
+    scenarios = [random_scenario(rng) for _ in range(requests)]
+    latencies = []
+    errors = 0
+    next_idx = 0
+
+    async def worker():
+        nonlocal errors, next_idx
+        client = HttpClient(host, port)
+        await client.connect()
+        try:
+            while next_idx < len(scenarios):
+                scenario = scenarios[next_idx]
+                next_idx += 1
+                start = time.perf_counter()
+                status, _ = await client.request("POST", endpoint, scenario)
+                latencies.append(time.perf_counter() - start)
+                errors += int(status != 200)
+        finally:
+            await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall_s = time.perf_counter() - start
+
+    metrics_client = HttpClient(host, port)
+    await metrics_client.connect()
+    _, server_metrics = await metrics_client.request("GET", "/metrics")
+    await metrics_client.close()
+
+    latencies = np.array(latencies)
+    return {
+        "endpoint": endpoint,
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": concurrency,
+        "wall_s": wall_s,
+        "requests_per_s": len(latencies) / wall_s,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "server": server_metrics,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SportPulse skorlama servisi yük testi")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--endpoint",
+        default="/optimize_price",
+        choices=["/predict_demand", "/optimize_price", "/shock_reason"],
+    )
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(
+        run_load_test(args.host, args.port, args.endpoint, args.requests, args.concurrency)
+    )
+    print(
+        f"{report['endpoint']}: {report['requests']} istek, {report['errors']} hata, "
+        f"{report['requests_per_s']:.0f} istek/s, p50 {report['p50_ms']:.1f} ms, "
+        f"p99 {report['p99_ms']:.1f} ms"
+    )
+    print(json.dumps(report["server"], indent=2, ensure_ascii=False))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
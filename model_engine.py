@@ -1,38 +1,233 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error, mean_squared_error
 
+from db_connection import DB_PATH, get_manager
+from perf import timed
+
+FEATURE_COLUMNS = [
+    'hour',
+    'is_weekend',
+    'temp',
+    'is_rainy',
+    'nearby_event',
+    'distance_to_event',
+    'price',
+]
+PRICE_MIN = 50
+PRICE_MAX = 300
+PRICE_STEP = 10
+GOLDEN_RATIO = (np.sqrt(5) - 1) / 2
+
+# SHAP açıklama önbelleği: özellik vektörü bu ondalık hassasiyete yuvarlanarak anahtarlanır
+EXPLAIN_DECIMALS = 1
+EXPLAIN_CACHE_SIZE = 50_000
+# Senaryo bazlı response-surface memo kapasitesi
+SURFACE_CACHE_SIZE = 256
+
+ARTIFACT_DIR = Path("artifacts")
+ARTIFACT_VERSION = 2
+TRAIN_PARAMS = {
+    "objective": "reg:squarederror",
+    "n_estimators": 100,
+    "test_size": 0.2,
+    "random_state": 42,
+}
+
+# "compiled": ağaçlar düz NumPy dizilerinde değerlendirilir (tree_eval.CompiledForest)
+INFERENCE_BACKENDS = ("xgboost", "compiled")
+
+# SQLite'tan parça parça okunarak yapılan (out-of-core) eğitimin ayarları
+OUT_OF_CORE_PARAMS = {
+    "tree_method": "hist",
+    "max_bin": 256,
+    "learning_rate": 0.1,
+    "max_rounds": 1000,
+    "early_stopping_rounds": 25,
+    "holdout_fraction": 0.2,
+    "chunksize": 250_000,
+}
+
+
+def _artifact_key(source, params):
+    import xgboost as xgb
+
+    payload = json.dumps(
+        {
+            "version": ARTIFACT_VERSION,
+            "xgboost": xgb.__version__,
+            "params": params or TRAIN_PARAMS,
+            **source,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def sport_data_fingerprint(db_path=DB_PATH, params=None):
+    """
+    sport_data tablosunun içeriği ve eğitim parametrelerinden model artifact anahtarı üretir.
+    Tablo tek bir SQL agregasyonuyla (tüm özellikler ve y'nin toplamları) özetlenir; toplamları
+    değiştirmeyen yerinde güncellemeler de generation üzerinden anahtara yansır.
+    """
+    from schema import read_watermark
+
+    totals = ", ".join(f"TOTAL({column})" for column in FEATURE_COLUMNS + ["y"])
+    with get_manager(db_path).reader() as conn:
+        table_stats = conn.execute(
+            f"SELECT COUNT(*), MIN(ds), MAX(ds), {totals} FROM sport_data"
+        ).fetchone()
+        generation = read_watermark(conn)[0]
+    return _artifact_key(
+        {"table": [str(value) for value in table_stats], "generation": generation}, params
+    )
+
+
+def frame_fingerprint(df, params=None):
+    """Eğitime doğrudan verilen DataFrame'in (özellikler + y) içerik hash'inden artifact anahtarı."""
+    hashes = pd.util.hash_pandas_object(df[FEATURE_COLUMNS + ["y"]], index=False)
+    digest = hashlib.sha256(hashes.to_numpy().tobytes()).hexdigest()
+    return _artifact_key({"frame": digest}, params)
+
+
+def evict_stale_artifacts(artifact_dir=ARTIFACT_DIR, keep=3, protect=None):
+    """En son kullanılan `keep` artifact dışındakileri siler."""
+    artifact_dir = Path(artifact_dir)
+    if not artifact_dir.exists():
+        return []
+    candidates = sorted(
+        (path for path in artifact_dir.iterdir() if (path / "meta.json").exists()),
+        key=lambda path: (path / "meta.json").stat().st_mtime,
+        reverse=True,
+    )
+    evicted = []
+    for path in candidates[keep:]:
+        if path.name == protect:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        evicted.append(path.name)
+    return evicted
+
+
+def latest_artifact(artifact_dir=ARTIFACT_DIR):
+    """En son kullanılan artifact'in fingerprint'ini döndürür; yoksa None."""
+    artifact_dir = Path(artifact_dir)
+    if not artifact_dir.exists():
+        return None
+    candidates = [path for path in artifact_dir.iterdir() if (path / "meta.json").exists()]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda path: (path / "meta.json").stat().st_mtime).name
+
+
+def _holdout_cutoff(db_path, holdout_fraction):
+    """Zaman sıralı holdout için sınır ds'i (epoch saniye); son holdout_fraction kadar satır ayrılır."""
+    with get_manager(db_path).reader() as conn:
+        total = conn.execute("SELECT COUNT(*) FROM sport_data").fetchone()[0]
+        if total < 2:
+            raise ValueError("Out-of-core eğitim için en az iki satır gerekir.")
+        offset = min(total - 1, max(1, int(total * (1 - holdout_fraction))))
+        # ds indeksi üzerinden sıralı tarama; tablo belleğe alınmaz
+        return conn.execute(
+            "SELECT ds FROM sport_data ORDER BY ds LIMIT 1 OFFSET ?", (offset,)
+        ).fetchone()[0]
+
+
+def _sport_data_iter(db_path, start=None, end=None, chunksize=250_000, cache_prefix=None):
+    """sport_data'yı [start, end) aralığında parça parça XGBoost'a besleyen DataIter."""
+    import xgboost as xgb
+
+    from data_gen import load_sport_data
+
+    class SportDataIter(xgb.DataIter):
+        def __init__(self):
+            super().__init__(cache_prefix=cache_prefix)
+            self.rows = 0
+            self._chunks = None
+
+        def _open(self):
+            return load_sport_data(
+                db_path,
+                columns=FEATURE_COLUMNS + ['y'],
+                start=start,
+                end=end,
+                chunksize=chunksize,
+                compact=True,
+            )
+
+        def reset(self):
+            # Üretici kapatılınca okuma bağlantısı havuza geri döner
+            if self._chunks is not None:
+                self._chunks.close()
+            self._chunks = None
+
+        def next(self, input_data):
+            if self._chunks is None:
+                self._chunks = self._open()
+                self.rows = 0
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            self.rows += len(chunk)
+            input_data(data=chunk[FEATURE_COLUMNS], label=chunk['y'])
+            return True
+
+    return SportDataIter()
+
 
 class DemandEngine:
-    def __init__(self):
+    def __init__(self, params=None, backend="xgboost"):
         self.model = None
         self.explainer = None
         self.metrics = {}
+        self.params = {**TRAIN_PARAMS, **(params or {})}
+        self.artifact_path = None
+        # Kaydedilen/yüklenen artifact'in kimliği; aynı fingerprint ile yeniden eğitimde değişir
+        self.model_id = None
+        self._explanation_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # Her önbellek temizliğinde artar; eski modelle hesaplanan sonuç önbelleğe yazılmaz
+        self._cache_generation = 0
+        self._surface_cache = OrderedDict()
+        self._compiled_forest = None
+        self.lookup = None
+        self.backend = None
+        self.set_backend(backend)
 
+    @timed("model_engine.DemandEngine.train")
     def train(self, df):
         import shap
         import xgboost as xgb
 
         # Özellikler ve Hedef
-        X = df[
-            [
-                'hour',
-                'is_weekend',
-                'temp',
-                'is_rainy',
-                'nearby_event',
-                'distance_to_event',
-                'price',
-            ]
-        ]
+        X = df[FEATURE_COLUMNS]
         y = df['y']
 
         X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=0.2, random_state=42
+            X,
+            y,
+            test_size=self.params["test_size"],
+            random_state=self.params["random_state"],
         )
 
         # Modeli Eğit
-        self.model = xgb.XGBRegressor(objective='reg:squarederror', n_estimators=100)
+        self.model = xgb.XGBRegressor(
+            objective=self.params["objective"],
+            n_estimators=self.params["n_estimators"],
+        )
         self.model.fit(X_train, y_train)
 
         # Model metrikleri
@@ -40,26 +235,415 @@ class DemandEngine:
         rmse = mean_squared_error(y_test, predictions) ** 0.5
         mae = mean_absolute_error(y_test, predictions)
         self.metrics = {
-            "RMSE": rmse,
-            "MAE": mae,
+            "RMSE": float(rmse),
+            "MAE": float(mae),
             "Test Samples": len(y_test),
         }
 
-        # SHAP Explainer (Shock Detector için)
-        self.explainer = shap.Explainer(self.model)
+        # SHAP Explainer (Shock Detector için) - ağaç modellerine özel hızlı yol
+        self.explainer = shap.TreeExplainer(self.model)
+        self.reset_model_caches()
 
         return self.model
 
+    @timed("model_engine.DemandEngine.train_from_db")
+    def train_from_db(self, db_path=DB_PATH, nthread=None, external_memory=False, **overrides):
+        """
+        Out-of-core eğitim: özellik parçaları doğrudan SQLite'tan okunup QuantileDMatrix'e
+        (external_memory=True ise diskte önbelleklenen ExtMemQuantileDMatrix'e) aktarılır.
+        hist ağaç yöntemi, nthread iş parçacığı, zaman sıralı holdout ve early stopping kullanılır.
+        overrides ile OUT_OF_CORE_PARAMS anahtarları değiştirilebilir.
+        """
+        import shap
+        import xgboost as xgb
+
+        from schema import ensure_schema
+
+        ensure_schema(db_path)
+        settings = {**OUT_OF_CORE_PARAMS, **overrides}
+        unknown = sorted(set(settings) - set(OUT_OF_CORE_PARAMS))
+        if unknown:
+            raise ValueError(f"Unknown out-of-core params: {unknown}")
+        nthread = nthread or os.cpu_count() or 1
+
+        start_time = time.perf_counter()
+        cutoff = pd.Timestamp(_holdout_cutoff(db_path, settings["holdout_fraction"]), unit="s")
+        # External-memory önbelleği her eğitim için ayrı geçici klasöre yazılır ve sonunda silinir
+        cache_dir = tempfile.mkdtemp(prefix="sportpulse-xgb-") if external_memory else None
+        try:
+            train_iter = _sport_data_iter(
+                db_path,
+                end=cutoff,
+                chunksize=settings["chunksize"],
+                cache_prefix=str(Path(cache_dir) / "train") if external_memory else None,
+            )
+            valid_iter = _sport_data_iter(
+                db_path,
+                start=cutoff,
+                chunksize=settings["chunksize"],
+                cache_prefix=str(Path(cache_dir) / "valid") if external_memory else None,
+            )
+            matrix_cls = xgb.ExtMemQuantileDMatrix if external_memory else xgb.QuantileDMatrix
+            dtrain = matrix_cls(train_iter, max_bin=settings["max_bin"], nthread=nthread)
+            dvalid = matrix_cls(valid_iter, max_bin=settings["max_bin"], nthread=nthread, ref=dtrain)
+            train_rows, valid_rows = dtrain.num_row(), dvalid.num_row()
+
+            evals_result = {}
+            booster = xgb.train(
+                {
+                    "objective": self.params["objective"],
+                    "tree_method": settings["tree_method"],
+                    "max_bin": settings["max_bin"],
+                    "learning_rate": settings["learning_rate"],
+                    # Early stopping listedeki son metriğe (rmse) bakar
+                    "eval_metric": ["mae", "rmse"],
+                    "nthread": nthread,
+                    "seed": self.params["random_state"],
+                },
+                dtrain,
+                num_boost_round=settings["max_rounds"],
+                evals=[(dvalid, "valid")],
+                early_stopping_rounds=settings["early_stopping_rounds"],
+                evals_result=evals_result,
+                verbose_eval=False,
+            )
+        finally:
+            if cache_dir is not None:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+        train_seconds = time.perf_counter() - start_time
+        best_iteration = booster.best_iteration
+
+        # Yalnızca en iyi iterasyona kadarki ağaçlar tutulur; diğer metotlar XGBRegressor bekler
+        model = xgb.XGBRegressor()
+        model.load_model(bytearray(booster[: best_iteration + 1].save_raw("json")))
+        self.model = model
+
+        valid_scores = evals_result["valid"]
+        self.metrics = {
+            "RMSE": float(valid_scores["rmse"][best_iteration]),
+            "MAE": float(valid_scores["mae"][best_iteration]),
+            "Test Samples": int(valid_rows),
+            "Train Rows": int(train_rows),
+            "Best Iteration": int(best_iteration),
+            "Train Seconds": float(train_seconds),
+            "Rows/s": float(train_rows / train_seconds) if train_seconds > 0 else float("inf"),
+            "Threads": int(nthread),
+        }
+
+        self.explainer = shap.TreeExplainer(self.model)
+        self.reset_model_caches()
+        return self.model
+
+    def save_artifact(self, fingerprint, artifact_dir=ARTIFACT_DIR):
+        """Booster, explainer ve metrikleri sürümlü bir artifact klasörüne yazar."""
+        if self.model is None:
+            raise ValueError("Model eğitilmeden artifact kaydedilemez.")
+        target = Path(artifact_dir) / fingerprint
+        staging = target.with_name(f"{fingerprint}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+
+        self.model.save_model(staging / "model.json")
+        with open(staging / "explainer.pkl", "wb") as explainer_file:
+            pickle.dump(self.explainer, explainer_file)
+        model_id = uuid.uuid4().hex
+        meta = {
+            "version": ARTIFACT_VERSION,
+            "fingerprint": fingerprint,
+            "model_id": model_id,
+            "params": self.params,
+            "metrics": self.metrics,
+            "created_at": time.time(),
+        }
+        (staging / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+        # Yarım yazılmış artifact okunmasın diye klasör en son yerine taşınır
+        shutil.rmtree(target, ignore_errors=True)
+        staging.rename(target)
+        self.artifact_path = target
+        self.model_id = model_id
+        return target
+
+    def load_artifact(self, fingerprint, artifact_dir=ARTIFACT_DIR):
+        """Artifact varsa ve sürümü uyuşuyorsa yükler; aksi halde False döner."""
+        import shap
+        import xgboost as xgb
+
+        target = Path(artifact_dir) / fingerprint
+        meta_path = target / "meta.json"
+        if not meta_path.exists():
+            return False
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if meta.get("version") != ARTIFACT_VERSION:
+            return False
+
+        model = xgb.XGBRegressor()
+        model.load_model(target / "model.json")
+        try:
+            with open(target / "explainer.pkl", "rb") as explainer_file:
+                explainer = pickle.load(explainer_file)
+        except (OSError, pickle.UnpicklingError, AttributeError, EOFError):
+            # Explainer durumu okunamazsa booster üzerinden yeniden kurulur
+            explainer = shap.TreeExplainer(model)
+
+        self.model = model
+        self.explainer = explainer
+        self.reset_model_caches()
+        self.metrics = meta.get("metrics", {})
+        self.params = meta.get("params", self.params)
+        self.artifact_path = target
+        self.model_id = meta.get("model_id") or f"{fingerprint}-{meta.get('created_at')}"
+        self.lookup = self._load_lookup()
+        # LRU eviction için son kullanım zamanını güncelle
+        meta_path.touch()
+        return True
+
+    def load_latest_artifact(self, artifact_dir=ARTIFACT_DIR):
+        """
+        Veriyle eşleşip eşleşmediğine bakmadan son iyi modeli yükler. Arka planda yeniden
+        eğitim sürerken dashboard'un hemen açılabilmesi içindir.
+        """
+        fingerprint = latest_artifact(artifact_dir)
+        return fingerprint is not None and self.load_artifact(fingerprint, artifact_dir)
+
+    def _load_lookup(self):
+        from demand_lookup import DemandLookup
+
+        return DemandLookup.load(self.artifact_path / "lookup")
+
+    @timed("model_engine.DemandEngine.build_lookup")
+    def build_lookup(self):
+        """
+        Dashboard ızgarası için talep tensörünü ve optimum fiyat tablosunu hesaplayıp
+        artifact klasörüne yazar; sonraki predict_demand/optimize_price çağrıları tablodan yanıtlanır.
+        Tablo ayrı bir motorla kurulur; bu motor kullanımdayken backend'i değişmez, hazır olan
+        tablo tek atamayla devreye girer.
+        """
+        from demand_lookup import DemandLookup
+
+        model, explainer, artifact_path = self.model, self.explainer, self.artifact_path
+        if model is None or artifact_path is None:
+            raise ValueError("Lookup tablosu için önce model eğitilip artifact kaydedilmeli.")
+        # Büyük ızgarada booster'ın toplu skorlaması derlenmiş yoldan hızlıdır
+        builder = DemandEngine(self.params, backend="xgboost")
+        builder.model = model
+        builder.explainer = explainer
+        lookup = DemandLookup.build(builder, artifact_path / "lookup")
+        # Izgara noktalarında tablo yanıtı optimize_prices ile aynı olmalı
+        lookup.check(builder)
+        if self.model is model:
+            self.lookup = lookup
+        return lookup
+
+    @timed("model_engine.DemandEngine.load_or_train")
+    def load_or_train(
+        self,
+        df=None,
+        db_path=DB_PATH,
+        artifact_dir=ARTIFACT_DIR,
+        force_retrain=False,
+        keep_artifacts=3,
+        out_of_core=False,
+        build_lookup=False,
+    ):
+        """
+        Eğitim verisi ve parametreler değişmediyse kayıtlı modeli yükler, aksi halde yeniden
+        eğitir. df verilirse anahtar bu çerçevenin içeriğinden, verilmezse tablodan üretilir ve
+        eğitim verisi veritabanından okunur. out_of_core=True ise df kullanılmaz,
+        train_from_db ile parça parça eğitilir. build_lookup=True ise artifact'te lookup tablosu
+        yoksa hesaplanır. Dönüş: artifact yüklendiyse True.
+        """
+        params = {**self.params, "out_of_core": OUT_OF_CORE_PARAMS} if out_of_core else self.params
+        if df is not None and not out_of_core:
+            # Filtrelenmiş/değiştirilmiş çerçeve tablodan farklı olabilir: anahtar eğitilen veriden
+            fingerprint = frame_fingerprint(df, params)
+        else:
+            fingerprint = sport_data_fingerprint(db_path, params)
+        if not force_retrain and self.load_artifact(fingerprint, artifact_dir):
+            if build_lookup and self.lookup is None:
+                self.build_lookup()
+            return True
+
+        if out_of_core:
+            self.train_from_db(db_path)
+        else:
+            if df is None:
+                from data_gen import load_sport_data
+
+                df = load_sport_data(db_path)
+            self.train(df)
+        self.save_artifact(fingerprint, artifact_dir)
+        evict_stale_artifacts(artifact_dir, keep=keep_artifacts, protect=fingerprint)
+        if build_lookup:
+            self.build_lookup()
+        return False
+
+    def set_backend(self, backend):
+        """Skorlama yolunu seçer: "xgboost" (booster.predict) veya "compiled" (düz NumPy ağaçları)."""
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Unknown inference backend: {backend}. Choose from {INFERENCE_BACKENDS}")
+        self.backend = backend
+        return self
+
+    def _forest(self):
+        # Derlenmiş ağaçlar model başına bir kez kurulur; desteklenmeyen modelde booster kullanılır
+        if self.backend != "compiled" or self.model is None:
+            return None
+        if self._compiled_forest is None:
+            from tree_eval import CompiledForest
+
+            try:
+                self._compiled_forest = CompiledForest.from_booster(self.model.get_booster())
+            except ValueError:
+                self._compiled_forest = False
+        return self._compiled_forest or None
+
+    @timed("model_engine.DemandEngine.predict_demand")
     def predict_demand(self, features):
         # features: DataFrame tek satır
         if self.model is None:
             return 0
-        pred = self.model.predict(features)[0]
+        if self.lookup is not None:
+            demand = self.lookup.demand(features)
+            if demand is not None:
+                return demand
+        forest = self._forest()
+        if forest is not None:
+            # Sütunlar zaten model sırasındaysa pandas seçimi (yüzlerce µs) atlanır
+            if features.columns.tolist() != FEATURE_COLUMNS:
+                features = features[FEATURE_COLUMNS]
+            pred = forest.predict(features.to_numpy(dtype=float)[:1])[0]
+        else:
+            pred = self.model.predict(features)[0]
         return max(0, pred)
 
+    @timed("model_engine.DemandEngine.predict_demand_batch")
+    def predict_demand_batch(self, features, with_reason=False, chunk_size=100_000):
+        """
+        Toplu skorlama: DataFrame, NumPy dizisi veya parça (chunk) iteratörü alır ve
+        her satır için 0'a kırpılmış talep tahminlerini tek vektör olarak döndürür.
+        NumPy girdilerinde sütun sırası FEATURE_COLUMNS ile aynı olmalıdır.
+        with_reason=True ise (tahminler, satır bazlı shock açıklamaları) döner.
+        """
+        predictions = []
+        reasons = []
+        for chunk in self._iter_feature_chunks(features, chunk_size):
+            predictions.append(self._score_matrix(chunk))
+            if with_reason:
+                reasons.extend(self._shock_reasons_for_chunk(chunk))
+
+        result = np.concatenate(predictions) if predictions else np.zeros(0)
+        if with_reason:
+            return result, reasons
+        return result
+
+    @staticmethod
+    def _iter_feature_chunks(features, chunk_size):
+        if isinstance(features, pd.DataFrame):
+            matrix = features[FEATURE_COLUMNS].to_numpy(dtype=float)
+            for start in range(0, len(matrix), chunk_size):
+                yield matrix[start:start + chunk_size]
+        elif isinstance(features, np.ndarray):
+            matrix = np.atleast_2d(features).astype(float, copy=False)
+            for start in range(0, len(matrix), chunk_size):
+                yield matrix[start:start + chunk_size]
+        else:
+            # Akış halinde gelen her parça da chunk_size ile bölünerek skorlanır
+            for chunk in features:
+                yield from DemandEngine._iter_feature_chunks(chunk, chunk_size)
+
+    def _shock_reasons_for_chunk(self, matrix):
+        if self.explainer is None:
+            return ["Model eğitilmediği için shock analizi hesaplanamıyor."] * len(matrix)
+        top = self.explain_batch(matrix, top_k=1)
+        return [
+            self._format_shock_reason(feature, impact)
+            for feature, impact in zip(top['feature_1'], top['impact_1'])
+        ]
+
+    def clear_explanation_cache(self):
+        with self._cache_lock:
+            self._cache_generation += 1
+            self._explanation_cache.clear()
+
+    def clear_surface_cache(self):
+        with self._cache_lock:
+            self._cache_generation += 1
+            self._surface_cache.clear()
+
+    def reset_model_caches(self):
+        # Model değiştiğinde senaryo bazlı tüm memo'lar, derlenmiş ağaçlar ve lookup geçersizdir
+        self.clear_explanation_cache()
+        self.clear_surface_cache()
+        with self._cache_lock:
+            self._compiled_forest = None
+            self.lookup = None
+
+    @timed("model_engine.DemandEngine.shap_values_batch")
+    def shap_values_batch(self, features):
+        """
+        N satır için SHAP değer matrisini (N x özellik) döndürür. Önbellek anahtarı satırın
+        EXPLAIN_DECIMALS hassasiyetine yuvarlanmış halidir; önbellekte olmayan satırlar
+        yuvarlanmadan, tek TreeExplainer çağrısında hesaplanır ve LRU önbelleğe eklenir.
+        """
+        if isinstance(features, pd.DataFrame):
+            matrix = features[FEATURE_COLUMNS].to_numpy(dtype=float)
+        else:
+            matrix = np.atleast_2d(np.asarray(features, dtype=float))
+        keys = [row.tobytes() for row in np.round(matrix, EXPLAIN_DECIMALS)]
+
+        values = np.empty_like(matrix)
+        missing = {}
+        with self._cache_lock:
+            generation = self._cache_generation
+            for idx, key in enumerate(keys):
+                cached = self._explanation_cache.get(key)
+                if cached is None:
+                    missing.setdefault(key, []).append(idx)
+                else:
+                    self._explanation_cache.move_to_end(key)
+                    values[idx] = cached
+
+        if missing:
+            first_rows = [positions[0] for positions in missing.values()]
+            computed = np.asarray(
+                self.explainer.shap_values(
+                    pd.DataFrame(matrix[first_rows], columns=FEATURE_COLUMNS)
+                )
+            )
+            with self._cache_lock:
+                for (key, positions), row_values in zip(missing.items(), computed):
+                    values[positions] = row_values
+                    if self._cache_generation == generation:
+                        self._explanation_cache[key] = row_values
+                while len(self._explanation_cache) > EXPLAIN_CACHE_SIZE:
+                    self._explanation_cache.popitem(last=False)
+        return values
+
+    def explain_batch(self, features, top_k=3):
+        """
+        Toplu açıklama: her satır için mutlak etkisi en büyük top_k özelliği ve işaretli
+        SHAP etkilerini döndürür (feature_1, impact_1, ..., feature_k, impact_k).
+        """
+        if self.explainer is None:
+            raise ValueError("Model eğitilmediği için açıklama hesaplanamıyor.")
+        values = self.shap_values_batch(features)
+        top_k = min(top_k, len(FEATURE_COLUMNS))
+        order = np.argsort(-np.abs(values), axis=1, kind="stable")[:, :top_k]
+        impacts = np.take_along_axis(values, order, axis=1)
+        names = np.asarray(FEATURE_COLUMNS)[order]
+
+        result = {}
+        for rank in range(top_k):
+            result[f'feature_{rank + 1}'] = names[:, rank]
+            result[f'impact_{rank + 1}'] = impacts[:, rank]
+        index = features.index if isinstance(features, pd.DataFrame) else None
+        return pd.DataFrame(result, index=index)
+
     def get_metrics(self):
         return self.metrics
 
+    @timed("model_engine.DemandEngine.get_shock_reason")
     def get_shock_reason(self, features):
         """
         Demand Shock Detector:
@@ -67,16 +651,13 @@ class DemandEngine:
         """
         if self.explainer is None:
             return "Model eğitilmediği için shock analizi hesaplanamıyor."
-        shap_values = self.explainer(features)
 
         # En büyük etkiyi yaratan faktörü bul
-        values = shap_values.values[0]
-        feature_names = features.columns
-
-        max_impact_idx = abs(values).argmax()
-        impact_feature = feature_names[max_impact_idx]
-        impact_value = values[max_impact_idx]
+        top = self.explain_batch(features.iloc[:1], top_k=1).iloc[0]
+        return self._format_shock_reason(top['feature_1'], top['impact_1'])
 
+    @staticmethod
+    def _format_shock_reason(impact_feature, impact_value):
         direction = "ARTIRAN" if impact_value > 0 else "DÜŞÜREN"
 
         explanation = (
@@ -91,24 +672,161 @@ class DemandEngine:
 
         return explanation
 
-    def optimize_price(self, features_base):
+    def _score_matrix(self, matrix):
+        # Tüm satırları tek model çağrısında skorla
+        if self.model is None:
+            return np.zeros(len(matrix))
+        forest = self._forest()
+        if forest is not None:
+            return np.maximum(0, forest.predict(matrix))
+        frame = pd.DataFrame(matrix, columns=FEATURE_COLUMNS)
+        return np.maximum(0, self.model.predict(frame))
+
+    def price_response(self, features_base, prices=None):
         """
-        Dinamik Fiyatlama: Geliri (Fiyat x Talep) maksimize eden fiyatı bul.
+        Her senaryo için fiyat ızgarasındaki talebi tek bir model çağrısıyla hesaplar.
+        Dönüş: (senaryo sayısı, fiyat sayısı) boyutunda talep matrisi.
+        """
+        if prices is None:
+            prices = np.arange(PRICE_MIN, PRICE_MAX + 1, PRICE_STEP)
+        prices = np.asarray(prices, dtype=float)
+        base = features_base[FEATURE_COLUMNS].to_numpy(dtype=float)
+        price_idx = FEATURE_COLUMNS.index('price')
+
+        grid = np.repeat(base, len(prices), axis=0)
+        grid[:, price_idx] = np.tile(prices, len(base))
+        return self._score_matrix(grid).reshape(len(base), len(prices))
+
+    @timed("model_engine.DemandEngine.response_surface")
+    def response_surface(self, features_base, grid):
+        """
+        Tek bir senaryo etrafında bir veya daha fazla özelliğin ızgarası üzerinde talep yüzeyi.
+        grid: {'price': [...], 'temp': [...]} gibi özellik -> değerler sözlüğü.
+        Tüm hücreler tek model çağrısında skorlanır; sonuç senaryo + ızgara anahtarıyla memoize edilir.
+        Dönüş: {'axes': {özellik: dizi}, 'demand': ızgara sırasıyla boyutlanmış talep dizisi}.
+        """
+        unknown = [feature for feature in grid if feature not in FEATURE_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown model features: {unknown}")
+
+        base = features_base[FEATURE_COLUMNS].iloc[0].to_numpy(dtype=float)
+        # Eksenler memo'da paylaşılır: çağıranın dizisi kopyalanır ve salt okunur yapılır
+        axes = {feature: np.array(values, dtype=float) for feature, values in grid.items()}
+        for values in axes.values():
+            values.setflags(write=False)
+        key = (base.tobytes(),) + tuple(
+            (feature, values.tobytes()) for feature, values in axes.items()
+        )
+        with self._cache_lock:
+            generation = self._cache_generation
+            cached = self._surface_cache.get(key)
+            if cached is not None:
+                self._surface_cache.move_to_end(key)
+                return cached
+
+        mesh = np.meshgrid(*axes.values(), indexing="ij")
+        matrix = np.tile(base, (mesh[0].size, 1))
+        for feature, values in zip(axes, mesh):
+            matrix[:, FEATURE_COLUMNS.index(feature)] = values.ravel()
+        demand = self._score_matrix(matrix).reshape(mesh[0].shape)
+        demand.setflags(write=False)
+
+        surface = {"axes": axes, "demand": demand}
+        with self._cache_lock:
+            if self._cache_generation == generation:
+                self._surface_cache[key] = surface
+            while len(self._surface_cache) > SURFACE_CACHE_SIZE:
+                self._surface_cache.popitem(last=False)
+        return surface
+
+    @timed("model_engine.DemandEngine.optimize_prices")
+    def optimize_prices(
+        self,
+        features_base,
+        price_min=PRICE_MIN,
+        price_max=PRICE_MAX,
+        step=PRICE_STEP,
+        refine=True,
+        tol=0.5,
+    ):
         """
-        best_price = features_base['price'].iloc[0]
-        max_revenue = 0
-        best_demand = 0
+        Toplu Dinamik Fiyatlama: Her senaryo (satır) için geliri maksimize eden fiyatı bulur.
+        Önce tüm senaryolar x fiyat ızgarası tek matriste skorlanır, ardından en iyi ızgara
+        noktasının komşuluğunda vektörel altın oran araması ile fiyat sürekli olarak inceltilir.
+        """
+        prices = np.arange(price_min, price_max + 1, step, dtype=float)
+        demand = self.price_response(features_base, prices)
+        revenue = demand * prices
+
+        rows = np.arange(len(demand))
+        best_idx = revenue.argmax(axis=1)
+        best_price = prices[best_idx]
+        best_demand = demand[rows, best_idx]
+        max_revenue = revenue[rows, best_idx]
 
-        # 50 TL ile 300 TL arasında simülasyon yap
-        for p in range(50, 301, 10):
-            temp_df = features_base.copy()
-            temp_df['price'] = p
-            demand = self.predict_demand(temp_df)
-            revenue = p * demand
+        if refine and self.model is not None and len(demand) > 0:
+            base = features_base[FEATURE_COLUMNS].to_numpy(dtype=float)
+            price_idx = FEATURE_COLUMNS.index('price')
 
-            if revenue > max_revenue:
-                max_revenue = revenue
-                best_price = p
-                best_demand = demand
+            def revenue_at(left, right):
+                # Sol ve sağ aday fiyatlar tek model çağrısında skorlanır
+                candidates = np.concatenate([left, right])
+                matrix = np.tile(base, (2, 1))
+                matrix[:, price_idx] = candidates
+                scored = self._score_matrix(matrix)
+                return np.split(scored * candidates, 2), np.split(scored, 2)
 
-        return best_price, best_demand, max_revenue
+            low = np.clip(best_price - step, price_min, price_max)
+            high = np.clip(best_price + step, price_min, price_max)
+            while np.max(high - low) > tol:
+                left = high - GOLDEN_RATIO * (high - low)
+                right = low + GOLDEN_RATIO * (high - low)
+                (left_rev, right_rev), (left_dem, right_dem) = revenue_at(left, right)
+
+                # Izgarada bulunandan daha iyi noktaları kaydet
+                for cand_price, cand_rev, cand_dem in (
+                    (left, left_rev, left_dem),
+                    (right, right_rev, right_dem),
+                ):
+                    better = cand_rev > max_revenue
+                    best_price = np.where(better, cand_price, best_price)
+                    best_demand = np.where(better, cand_dem, best_demand)
+                    max_revenue = np.where(better, cand_rev, max_revenue)
+
+                move_right = right_rev >= left_rev
+                low = np.where(move_right, left, low)
+                high = np.where(move_right, high, right)
+
+        # Gelir üretilemiyorsa mevcut fiyat korunur
+        best_price = np.where(
+            max_revenue > 0, best_price, features_base['price'].to_numpy(dtype=float)
+        )
+
+        return pd.DataFrame(
+            {
+                'optimal_price': best_price,
+                'optimal_demand': best_demand,
+                'max_revenue': max_revenue,
+            },
+            index=features_base.index,
+        )
+
+    def optimize_price(self, features_base, refine=True):
+        """
+        Dinamik Fiyatlama: Geliri (Fiyat x Talep) maksimize eden fiyatı bul.
+        Izgara içindeki senaryolar lookup tablosundan, diğerleri model ile yanıtlanır.
+        """
+        if refine and self.lookup is not None:
+            # Izgara noktaları arasında aday fiyatlar modelle tek çağrıda skorlanır
+            optimum = self.lookup.optimal_price(
+                features_base,
+                score=lambda prices: self.price_response(features_base.iloc[:1], prices)[0],
+            )
+            if optimum is not None:
+                return optimum
+        result = self.optimize_prices(features_base.iloc[:1], refine=refine).iloc[0]
+        return (
+            float(result['optimal_price']),
+            float(result['optimal_demand']),
+            float(result['max_revenue']),
+        )
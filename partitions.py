@@ -0,0 +1,323 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from db_connection import get_manager
+from perf import timed
+from schema import SPORT_DATA_COLUMNS, create_sport_data_table, ensure_schema, to_epoch_seconds
+
+PARTITION_ROOT = Path("sportpulse_partitions")
+CATALOG_NAME = "catalog.db"
+ARCHIVE_DIR = "archive"
+
+# Her shard için bir satır; min_ds/max_ds epoch saniye, aralık budaması bunlarla yapılır
+CATALOG_DDL = """
+    CREATE TABLE IF NOT EXISTS partitions (
+        name TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        min_ds INTEGER,
+        max_ds INTEGER,
+        row_count INTEGER NOT NULL DEFAULT 0,
+        status TEXT NOT NULL DEFAULT 'active'
+    )
+"""
+CATALOG_COLUMNS = ["name", "path", "min_ds", "max_ds", "row_count", "status"]
+# Shard'lara aktarılan kaynak dosyanın filigranı; sync() yeni satırları rowid ile ekler,
+# kaynağın generation'ı değiştiyse (yeniden yazım, upsert güncellemesi) baştan aktarır
+SOURCE_DDL = """
+    CREATE TABLE IF NOT EXISTS source (
+        db_path TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL,
+        max_rowid INTEGER NOT NULL
+    )
+"""
+
+
+def partition_name(ds):
+    """ds değerlerinin ait olduğu aylık shard adları ("2024-01")."""
+    return pd.to_datetime(pd.Series(ds)).dt.strftime("%Y-%m")
+
+
+def _default_workers(count):
+    return max(1, min(count, os.cpu_count() or 1, 8))
+
+
+class PartitionedStore:
+    """
+    sport_data'yı aylık SQLite shard'larına bölen depolama. Her shard aynı tipli şemayı
+    kullanan ayrı bir .db dosyasıdır; catalog.db hangi ayın hangi dosyada olduğunu ve
+    her shard'ın ds aralığını tutar. Yazmalar satırın ayına göre yönlendirilir, okumalar
+    yalnızca istenen tarih aralığıyla kesişen aktif shard'lara thread havuzunda dağıtılır.
+    """
+
+    def __init__(self, root=PARTITION_ROOT):
+        self.root = Path(root)
+        self.catalog_path = self.root / CATALOG_NAME
+        self._catalog_ready = False
+
+    def _catalog(self):
+        manager = get_manager(self.catalog_path)
+        if not self._catalog_ready or not self.catalog_path.exists():
+            with manager.writer() as conn:
+                conn.execute(CATALOG_DDL)
+                conn.execute(SOURCE_DDL)
+            self._catalog_ready = True
+        return manager
+
+    def shard_path(self, name):
+        return self.root / f"sport_data_{name.replace('-', '_')}.db"
+
+    @timed("partitions.write")
+    def write(self, df, if_exists="append"):
+        """
+        Satırları aylarına göre shard'lara yazar. if_exists="replace" tüm shard'ları silip
+        baştan kurar. Dönüş: yazılan shard adları.
+        """
+        if if_exists == "replace":
+            self.drop()
+        return self._write(df, set())
+
+    def _write(self, df, prepared):
+        # prepared: bu yazma/import içinde şeması açılmış shard yolları; DDL shard başına bir kez
+        from data_gen import save_sport_data
+        from ingest import upsert_sport_data
+
+        if df.empty:
+            return []
+        names = partition_name(df["ds"]).to_numpy()
+        written = []
+        for name, rows in df.groupby(names, sort=True):
+            path = self.shard_path(name)
+            ds = to_epoch_seconds(rows["ds"])
+            if not path.exists():
+                # Yeni shard: indekssiz toplu yükleme, ardından indeksler tek geçişte
+                save_sport_data(rows, path, if_exists="replace")
+                with get_manager(path).reader() as conn:
+                    row_count = conn.execute("SELECT COUNT(*) FROM sport_data").fetchone()[0]
+                self._register(name, path, ds.min(), ds.max(), row_count, reset=True)
+            else:
+                manager = get_manager(path)
+                if path not in prepared:
+                    ensure_schema(path)
+                    with manager.writer() as conn:
+                        create_sport_data_table(conn)
+                with manager.writer() as conn, manager.timed("partitions.write"):
+                    report = upsert_sport_data(conn, rows)
+                self._register(name, path, ds.min(), ds.max(), report["inserted"])
+            prepared.add(path)
+            written.append(name)
+        return written
+
+    def _register(self, name, path, min_ds, max_ds, rows, reset=False):
+        """
+        Katalog satırını parçanın kendi ds aralığı ve yeni satır sayısıyla günceller; shard
+        yeniden taranmaz. reset=True ise (yeni shard) değerler doğrudan yazılır.
+        """
+        if reset:
+            update = "min_ds = excluded.min_ds, max_ds = excluded.max_ds, row_count = excluded.row_count"
+        else:
+            update = (
+                "min_ds = MIN(COALESCE(min_ds, excluded.min_ds), excluded.min_ds), "
+                "max_ds = MAX(COALESCE(max_ds, excluded.max_ds), excluded.max_ds), "
+                "row_count = row_count + excluded.row_count"
+            )
+        with self._catalog().writer() as conn:
+            conn.execute(
+                f"""
+                INSERT INTO partitions (name, path, min_ds, max_ds, row_count, status)
+                VALUES (?, ?, ?, ?, ?, 'active')
+                ON CONFLICT(name) DO UPDATE SET
+                    path = excluded.path,
+                    {update},
+                    status = 'active'
+                """,
+                (name, str(path), int(min_ds), int(max_ds), int(rows)),
+            )
+
+    @timed("partitions.import_database")
+    def import_database(self, db_path, chunksize=100_000):
+        """Tek dosyalık sport_data tablosunu parça parça okuyup shard'lara dağıtır."""
+        self.drop()
+        return self._import(db_path, None, chunksize)
+
+    @timed("partitions.sync")
+    def sync(self, db_path, chunksize=100_000):
+        """
+        Shard'ları kaynak dosyayla eşitler: son aktarımdan sonra eklenen satırlar (rowid ile)
+        shard'lara yazılır; kaynak yeniden yazıldıysa veya satırları güncellendiyse shard'lar
+        baştan kurulur. Dönüş: aktarılan satır sayısı.
+        """
+        from schema import read_watermark
+
+        ensure_schema(db_path)
+        with get_manager(db_path).reader() as conn:
+            generation = read_watermark(conn)[0]
+        source = self.source(db_path)
+        if source is None or source[0] != generation:
+            return self.import_database(db_path, chunksize)
+        return self._import(db_path, source[1], chunksize)
+
+    def source(self, db_path):
+        """Kaynak dosya için son aktarılan (generation, max_rowid); hiç aktarılmadıysa None."""
+        if not self.catalog_path.exists():
+            return None
+        with self._catalog().reader() as conn:
+            return conn.execute(
+                "SELECT generation, max_rowid FROM source WHERE db_path = ?",
+                (str(Path(db_path).resolve()),),
+            ).fetchone()
+
+    def _import(self, db_path, after_rowid, chunksize):
+        from data_gen import load_sport_data
+        from schema import read_watermark
+
+        ensure_schema(db_path)
+        with get_manager(db_path).reader() as conn:
+            generation, max_rowid, _ = read_watermark(conn)
+        prepared = set()
+        total_rows = 0
+        for chunk in load_sport_data(
+            db_path, chunksize=chunksize, after_rowid=after_rowid, until_rowid=max_rowid
+        ):
+            self._write(chunk, prepared)
+            total_rows += len(chunk)
+        with self._catalog().writer() as conn:
+            conn.execute(
+                """
+                INSERT INTO source (db_path, generation, max_rowid) VALUES (?, ?, ?)
+                ON CONFLICT(db_path) DO UPDATE SET
+                    generation = excluded.generation,
+                    max_rowid = excluded.max_rowid
+                """,
+                (str(Path(db_path).resolve()), generation, max_rowid),
+            )
+        return total_rows
+
+    def catalog(self, include_archived=True):
+        if not self.catalog_path.exists():
+            return pd.DataFrame(columns=CATALOG_COLUMNS)
+        query = f"SELECT {', '.join(CATALOG_COLUMNS)} FROM partitions"
+        if not include_archived:
+            query += " WHERE status = 'active'"
+        return self._catalog().read_sql(query + " ORDER BY name", name="partitions.catalog")
+
+    def partitions(self, start=None, end=None):
+        """[start, end) aralığıyla kesişen aktif shard'ların katalog satırları."""
+        catalog = self.catalog(include_archived=False)
+        if start is not None:
+            catalog = catalog[catalog["max_ds"] >= int(to_epoch_seconds([start])[0])]
+        if end is not None:
+            catalog = catalog[catalog["min_ds"] < int(to_epoch_seconds([end])[0])]
+        return catalog.reset_index(drop=True)
+
+    def map(self, fn, start=None, end=None, max_workers=None):
+        """
+        fn(shard_path) çağrısını aralıktaki her shard için thread havuzunda çalıştırır.
+        SQLite sorgu sırasında GIL'i bıraktığı için shard sorguları paralel ilerler.
+        Dönüş: shard sırasıyla sonuç listesi.
+        """
+        paths = [Path(path) for path in self.partitions(start, end)["path"]]
+        if len(paths) <= 1:
+            return [fn(path) for path in paths]
+        with ThreadPoolExecutor(
+            max_workers=max_workers or _default_workers(len(paths)),
+            thread_name_prefix="sportpulse-shard",
+        ) as executor:
+            return list(executor.map(fn, paths))
+
+    @timed("partitions.load")
+    def load(self, start=None, end=None, columns=None, facility_ids=None, compact=False, max_workers=None):
+        """load_sport_data'nın shard'lar üzerindeki karşılığı; yalnızca aralıktaki shard'lar okunur."""
+        from data_gen import load_sport_data
+
+        frames = self.map(
+            lambda path: load_sport_data(
+                path,
+                columns=columns,
+                start=start,
+                end=end,
+                facility_ids=facility_ids,
+                compact=compact,
+            ),
+            start,
+            end,
+            max_workers,
+        )
+        if not frames:
+            return pd.DataFrame(columns=columns or SPORT_DATA_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+    def _detach(self, names):
+        rows = self.catalog().set_index("name").loc[list(names)]
+        for path in rows["path"]:
+            get_manager(path).close()
+        return rows
+
+    def _older_than(self, before, status):
+        catalog = self.catalog()
+        cutoff = int(to_epoch_seconds([before])[0])
+        # Shard ancak tüm satırları cutoff'tan önceyse taşınır/silinir
+        selected = catalog[(catalog["status"] == status) & (catalog["max_ds"] < cutoff)]
+        return selected["name"].tolist()
+
+    @timed("partitions.archive")
+    def archive(self, before):
+        """
+        Tüm satırları before'dan eski aktif shard'ları archive/ klasörüne taşır; sorgular
+        artık bu shard'lara dağıtılmaz. Dönüş: arşivlenen shard adları.
+        """
+        names = self._older_than(before, "active")
+        archive_dir = self.root / ARCHIVE_DIR
+        archive_dir.mkdir(parents=True, exist_ok=True)
+        for name, row in self._detach(names).iterrows():
+            source = Path(row["path"])
+            target = archive_dir / source.name
+            shutil.move(source, target)
+            with self._catalog().writer() as conn:
+                conn.execute(
+                    "UPDATE partitions SET path = ?, status = 'archived' WHERE name = ?",
+                    (str(target), name),
+                )
+        return names
+
+    def restore(self, names):
+        """Arşivlenmiş shard'ları tekrar aktif hale getirir."""
+        for name, row in self._detach(names).iterrows():
+            source = Path(row["path"])
+            target = self.shard_path(name)
+            if source != target:
+                shutil.move(source, target)
+            with self._catalog().writer() as conn:
+                conn.execute(
+                    "UPDATE partitions SET path = ?, status = 'active' WHERE name = ?",
+                    (str(target), name),
+                )
+        return list(names)
+
+    @timed("partitions.prune")
+    def prune(self, before, include_archived=True):
+        """Tüm satırları before'dan eski shard'ları diskten ve katalogdan siler."""
+        names = self._older_than(before, "active")
+        if include_archived:
+            names += self._older_than(before, "archived")
+        self._remove(names)
+        return names
+
+    def drop(self):
+        """Tüm shard'ları ve katalog kayıtlarını siler."""
+        self._remove(self.catalog()["name"].tolist())
+        if self.catalog_path.exists():
+            with self._catalog().writer() as conn:
+                conn.execute("DELETE FROM source")
+
+    def _remove(self, names):
+        if not names:
+            return
+        for path in self._detach(names)["path"]:
+            for suffix in ("", "-wal", "-shm"):
+                Path(str(path) + suffix).unlink(missing_ok=True)
+        with self._catalog().writer() as conn:
+            conn.executemany("DELETE FROM partitions WHERE name = ?", [(name,) for name in names])
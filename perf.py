@@ -0,0 +1,163 @@
+import cProfile
+import functools
+import io
+import pstats
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+PROMETHEUS_PATH = Path("sportpulse_metrics.prom")
+METRIC_PREFIX = "sportpulse"
+
+_stats = {}
+_counters = {}
+_lock = threading.Lock()
+# Streamlit her oturumun rerun'ını ayrı bir thread'de çalıştırır; rerun kayıtları thread'e özeldir
+_local = threading.local()
+
+
+class timed:
+    """
+    Hem decorator hem context manager olarak kullanılabilen hafif zamanlayıcı.
+    Süreler süreç geneli istatistiklere ve (aktifse) mevcut rerun'ın kayıtlarına eklenir.
+
+        @timed("model_engine.train")
+        def train(...): ...
+
+        with timed("app.sql_loaders"):
+            ...
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._starts = threading.local()
+
+    def __enter__(self):
+        stack = getattr(self._starts, "stack", None)
+        if stack is None:
+            stack = self._starts.stack = []
+        stack.append(time.perf_counter())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._starts.stack.pop()
+        record(self.name, elapsed, failed=exc_type is not None)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def record(name, elapsed, failed=False):
+    with _lock:
+        stats = _stats.setdefault(
+            name, {"calls": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0}
+        )
+        stats["calls"] += 1
+        stats["errors"] += int(failed)
+        stats["total_s"] += elapsed
+        stats["max_s"] = max(stats["max_s"], elapsed)
+    events = getattr(_local, "events", None)
+    if events is not None:
+        events.append((name, elapsed))
+
+
+def increment(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def begin_rerun():
+    """Bu thread'de yeni bir rerun kaydı başlatır."""
+    _local.events = []
+
+
+def rerun_breakdown():
+    """Mevcut rerun'da ölçülen aşamaları (iç içe aşamalar ayrıca listelenir) döndürür."""
+    events = getattr(_local, "events", None) or []
+    frame = pd.DataFrame(events, columns=["stage", "seconds"])
+    if frame.empty:
+        return pd.DataFrame(columns=["stage", "calls", "total_ms"])
+    return (
+        frame.groupby("stage", as_index=False)
+        .agg(calls=("seconds", "size"), total_ms=("seconds", "sum"))
+        .assign(total_ms=lambda df: df["total_ms"] * 1000)
+        .sort_values("total_ms", ascending=False)
+        .reset_index(drop=True)
+    )
+
+
+def get_stats():
+    with _lock:
+        rows = [
+            {
+                "stage": name,
+                "calls": stats["calls"],
+                "errors": stats["errors"],
+                "total_ms": stats["total_s"] * 1000,
+                "avg_ms": stats["total_s"] * 1000 / stats["calls"],
+                "max_ms": stats["max_s"] * 1000,
+            }
+            for name, stats in _stats.items()
+        ]
+    return pd.DataFrame(rows, columns=["stage", "calls", "errors", "total_ms", "avg_ms", "max_ms"])
+
+
+def _label(value):
+    # Exposition formatı: etiket değerlerinde ters bölü, çift tırnak ve satır sonu kaçışlanır
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text():
+    """İstatistikleri Prometheus text exposition formatında döndürür."""
+    with _lock:
+        stats = {name: dict(values) for name, values in _stats.items()}
+        counters = dict(_counters)
+
+    metrics = (
+        ("stage_calls_total", "counter", "Aşama çağrı sayısı", "calls"),
+        ("stage_errors_total", "counter", "Hata ile biten aşama çağrıları", "errors"),
+        ("stage_seconds_total", "counter", "Aşamalarda geçen toplam süre", "total_s"),
+        ("stage_seconds_max", "gauge", "Tek çağrıda görülen en uzun süre", "max_s"),
+    )
+    lines = []
+    for metric, metric_type, help_text, key in metrics:
+        lines.append(f"# HELP {METRIC_PREFIX}_{metric} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{metric} {metric_type}")
+        for name in sorted(stats):
+            lines.append(f'{METRIC_PREFIX}_{metric}{{stage="{_label(name)}"}} {stats[name][key]}')
+    lines.append(f"# HELP {METRIC_PREFIX}_events_total Uygulama sayaçları")
+    lines.append(f"# TYPE {METRIC_PREFIX}_events_total counter")
+    for name in sorted(counters):
+        lines.append(f'{METRIC_PREFIX}_events_total{{name="{_label(name)}"}} {counters[name]}')
+    return "\n".join(lines) + "\n"
+
+
+def export_prometheus(output_path=PROMETHEUS_PATH):
+    output_path = Path(output_path)
+    staging = output_path.with_name(output_path.name + ".tmp")
+    staging.write_text(prometheus_text(), encoding="utf-8")
+    # node_exporter textfile collector yarım dosya okumasın diye atomik yer değiştirme
+    staging.replace(output_path)
+    return output_path
+
+
+def start_profile():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profile(profiler, limit=40, sort_by="cumulative"):
+    """Profili durdurur ve en pahalı `limit` fonksiyonun pstats çıktısını döndürür."""
+    profiler.disable()
+    buffer = io.StringIO()
+    pstats.Stats(profiler, stream=buffer).sort_stats(sort_by).print_stats(limit)
+    return buffer.getvalue()
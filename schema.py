@@ -0,0 +1,235 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from db_connection import DB_PATH, get_manager
+
+# PRAGMA user_version ile tutulan sport_data şema sürümü
+# 0: ds TEXT (to_sql varsayılanı), 1: ds INTEGER epoch saniye + saklı takvim anahtarları,
+# 2: (facility_id, ds) UNIQUE anahtar (upsert hedefi)
+SCHEMA_VERSION = 2
+
+SPORT_DATA_DDL = """
+    CREATE TABLE IF NOT EXISTS sport_data (
+        ds INTEGER NOT NULL,
+        facility_id INTEGER NOT NULL,
+        lat REAL,
+        lon REAL,
+        hour INTEGER NOT NULL,
+        is_weekend INTEGER,
+        temp REAL,
+        is_rainy INTEGER,
+        nearby_event INTEGER,
+        distance_to_event REAL,
+        price REAL,
+        y REAL,
+        day INTEGER GENERATED ALWAYS AS (ds / 86400) STORED,
+        week_of_year INTEGER GENERATED ALWAYS AS (
+            CAST(STRFTIME('%W', ds, 'unixepoch') AS INTEGER)
+        ) STORED
+    )
+"""
+
+SPORT_DATA_INDEXES = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_sport_data_facility_ds_key ON sport_data(facility_id, ds)",
+    "CREATE INDEX IF NOT EXISTS idx_sport_data_week_facility ON sport_data(week_of_year, facility_id)",
+    "CREATE INDEX IF NOT EXISTS idx_sport_data_date ON sport_data(ds)",
+)
+
+# Sürüm 1'deki benzersiz olmayan (facility_id, ds) indeksi; yerini UNIQUE anahtar aldı
+LEGACY_INDEXES = ("idx_sport_data_facility_ds",)
+# Sürüm 0 -> 1 taşımasında eski tablonun geçici adı
+LEGACY_TABLE = "sport_data_legacy"
+
+# Tablo seviyesinde sayaçlar: generation mevcut satırlar değiştiğinde (tam yeniden yazım,
+# upsert güncellemesi) artar; yeni eklenen satırlar max_rowid ile izlenir.
+# ingest_seq / ingest_rows her ingest işleminde güncellenir
+SPORT_DATA_META_DDL = """
+    CREATE TABLE IF NOT EXISTS sport_data_meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    )
+"""
+
+# sport_data'dan türetilen ve tablo yeniden yazıldığında geçersiz kalan tablolar
+ROLLUP_TABLES = ("rollup_facility", "rollup_week", "rollup_facility_week")
+
+SPORT_DATA_COLUMNS = [
+    'ds',
+    'facility_id',
+    'lat',
+    'lon',
+    'hour',
+    'is_weekend',
+    'temp',
+    'is_rainy',
+    'nearby_event',
+    'distance_to_event',
+    'price',
+    'y',
+]
+
+_CHECKED_PATHS = set()
+_CHECKED_LOCK = threading.Lock()
+
+
+def invalidate_rollups(conn):
+    """sport_data yeniden yazıldığında rollup tablolarını sıfırlar; sonraki refresh baştan kurar."""
+    for table in ROLLUP_TABLES + ("rollup_state",):
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def create_sport_data_table(conn):
+    conn.execute(SPORT_DATA_DDL)
+    conn.execute(SPORT_DATA_META_DDL)
+    for statement in SPORT_DATA_INDEXES:
+        conn.execute(statement)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def bump_generation(conn):
+    conn.execute(SPORT_DATA_META_DDL)
+    conn.execute(
+        """
+        INSERT INTO sport_data_meta (key, value) VALUES ('generation', 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1
+        """
+    )
+
+
+def record_ingest(conn, rows):
+    conn.execute(SPORT_DATA_META_DDL)
+    conn.executemany(
+        """
+        INSERT INTO sport_data_meta (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = value + excluded.value
+        """,
+        [("ingest_seq", 1), ("ingest_rows", rows)],
+    )
+
+
+def deduplicate_sport_data(conn):
+    """Aynı (facility_id, ds) için yalnızca son yazılan satırı (en büyük rowid) bırakır."""
+    return conn.execute(
+        """
+        DELETE FROM sport_data
+        WHERE rowid NOT IN (SELECT MAX(rowid) FROM sport_data GROUP BY facility_id, ds)
+        """
+    ).rowcount
+
+
+def read_watermark(conn):
+    """
+    (generation, max_rowid, max_ds) üçlüsünü döndürür. Üçü de indeks/rowid üzerinden
+    okunduğu için tablo boyutundan bağımsız olarak ucuzdur.
+    """
+    has_meta = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sport_data_meta'"
+    ).fetchone()
+    generation = 0
+    if has_meta:
+        row = conn.execute(
+            "SELECT value FROM sport_data_meta WHERE key = 'generation'"
+        ).fetchone()
+        generation = row[0] if row else 0
+    max_rowid, max_ds = conn.execute(
+        "SELECT COALESCE(MAX(rowid), 0), COALESCE(MAX(ds), 0) FROM sport_data"
+    ).fetchone()
+    return generation, max_rowid, max_ds
+
+
+def to_epoch_seconds(values):
+    """Datetime benzeri değerleri (string, Timestamp, datetime64) epoch saniyeye çevirir."""
+    stamps = pd.to_datetime(pd.Series(values)).to_numpy(dtype="datetime64[s]")
+    return stamps.astype(np.int64)
+
+
+def from_epoch_seconds(values):
+    return pd.to_datetime(values, unit="s")
+
+
+def _table_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def _recover_legacy_table(conn, version):
+    """Transaction'sız eski sürümlerde yarıda kesilmiş bir taşımadan kalan tabloyu toparlar."""
+    if not _table_exists(conn, LEGACY_TABLE):
+        return
+    if version < 1:
+        # Kopyalama tamamlanmamış olabilir; asıl satırlar legacy tabloda, taşıma baştan yapılır
+        conn.execute("DROP TABLE IF EXISTS sport_data")
+        conn.execute(f"ALTER TABLE {LEGACY_TABLE} RENAME TO sport_data")
+    else:
+        conn.execute(f"DROP TABLE {LEGACY_TABLE}")
+
+
+def migrate_sport_data(db_path=DB_PATH):
+    """
+    Eski şemalardaki sport_data tablosunu güncel şemaya taşır: ds TEXT ise epoch saniyeye
+    çevrilir, yinelenen (facility_id, ds) satırlarında sonuncusu bırakılır ve UNIQUE anahtar
+    kurulur. Tüm adımlar tek transaction'dadır; hata olursa dosya eski haliyle kalır.
+    Zaten güncel olan dosyalarda yalnızca PRAGMA user_version okunur.
+    Dönüş: taşıma yapıldıysa True.
+    """
+    manager = get_manager(db_path)
+    manager.require_db()
+    with manager.writer() as conn, manager.timed("migrate_sport_data"):
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION and not _table_exists(conn, LEGACY_TABLE):
+            return False
+
+        # sqlite3 modülü DDL'i örtük transaction dışında çalıştırır; açık transaction ile
+        # RENAME/CREATE/DROP da geri alınabilir. writer() çıkışta commit, hatada rollback yapar.
+        conn.execute("BEGIN IMMEDIATE")
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        _recover_legacy_table(conn, version)
+        if version >= SCHEMA_VERSION:
+            return True
+        if not _table_exists(conn, "sport_data"):
+            create_sport_data_table(conn)
+            return True
+
+        rewritten = version < 1
+        if rewritten:
+            columns = ", ".join(SPORT_DATA_COLUMNS)
+            source_columns = ", ".join(
+                ["CAST(STRFTIME('%s', ds) AS INTEGER)"] + SPORT_DATA_COLUMNS[1:]
+            )
+            conn.execute(f"ALTER TABLE sport_data RENAME TO {LEGACY_TABLE}")
+            # Eski indeksler isimleriyle birlikte legacy tabloya taşındı; yenileri için yer aç
+            for (index_name,) in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?"
+                " AND sql IS NOT NULL",
+                (LEGACY_TABLE,),
+            ).fetchall():
+                conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+            conn.execute(SPORT_DATA_DDL)
+            conn.execute(
+                f"INSERT INTO sport_data ({columns}) "
+                f"SELECT {source_columns} FROM {LEGACY_TABLE} ORDER BY ds"
+            )
+            conn.execute(f"DROP TABLE {LEGACY_TABLE}")
+
+        for index_name in LEGACY_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+        removed = deduplicate_sport_data(conn)
+        create_sport_data_table(conn)
+        if rewritten or removed:
+            bump_generation(conn)
+            invalidate_rollups(conn)
+        return True
+
+
+def ensure_schema(db_path=DB_PATH):
+    """Süreç başına dosya başına bir kez migrate_sport_data çalıştırır."""
+    key = str(get_manager(db_path).db_path.resolve())
+    with _CHECKED_LOCK:
+        if key in _CHECKED_PATHS:
+            return
+    migrate_sport_data(db_path)
+    with _CHECKED_LOCK:
+        _CHECKED_PATHS.add(key)
@@ -0,0 +1,410 @@
+"""
+SportPulse headless skorlama servisi (yalnızca asyncio + stdlib HTTP).
+
+Uç noktalar (POST, JSON gövde: tek senaryo sözlüğü veya sözlük listesi):
+    /predict_demand   -> {"demand": ...}
+    /optimize_price   -> {"optimal_price": ..., "optimal_demand": ..., "max_revenue": ...}
+    /shock_reason     -> {"reason": ...}
+GET /metrics uç nokta bazlı p50/p99 gecikme ve batch boyutlarını, GET /health durumu döndürür.
+
+Aynı anda gelen istekler kısa bir pencere içinde toplanıp tek model çağrısında skorlanır.
+
+Örnek:
+    python scoring_service.py --port 8765 --window-ms 5
+"""
+import argparse
+import asyncio
+import json
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import perf
+from db_connection import DB_PATH
+from model_engine import FEATURE_COLUMNS, DemandEngine
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# İlk istekten sonra batch'in dolması için beklenen süre ve batch üst sınırı
+BATCH_WINDOW_MS = 5.0
+MAX_BATCH_SIZE = 512
+# Yüzdelikler son bu kadar istek üzerinden hesaplanır
+LATENCY_WINDOW = 10_000
+MAX_BODY_BYTES = 1024 * 1024
+FEATURE_DEFAULTS = {
+    "hour": 19,
+    "is_weekend": 0,
+    "temp": 25.0,
+    "is_rainy": 0,
+    "nearby_event": 0,
+    "distance_to_event": 50.0,
+    "price": 150.0,
+}
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class LatencyTracker:
+    """Uç nokta bazlı son LATENCY_WINDOW gecikme ve batch boyutu kaydı."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._latencies = {}
+        self._batches = {}
+        self._requests = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record_request(self, endpoint, elapsed):
+        with self._lock:
+            self._latencies.setdefault(endpoint, deque(maxlen=self._window)).append(elapsed)
+            self._requests[endpoint] = self._requests.get(endpoint, 0) + 1
+
+    def record_batch(self, endpoint, size):
+        with self._lock:
+            self._batches.setdefault(endpoint, deque(maxlen=self._window)).append(size)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = {name: np.array(values) for name, values in self._latencies.items()}
+            batches = {name: np.array(values) for name, values in self._batches.items()}
+            requests = dict(self._requests)
+        report = {}
+        for name, values in latencies.items():
+            sizes = batches.get(name, np.zeros(0))
+            report[name] = {
+                "requests": requests[name],
+                "p50_ms": float(np.percentile(values, 50) * 1000),
+                "p99_ms": float(np.percentile(values, 99) * 1000),
+                "max_ms": float(values.max() * 1000),
+                "batches": int(len(sizes)),
+                "avg_batch_size": float(sizes.mean()) if len(sizes) else 0.0,
+            }
+        return report
+
+
+class MicroBatcher:
+    """
+    Bir uç noktaya gelen senaryoları kuyrukta toplar; ilk senaryodan sonra window_ms kadar
+    (veya max_batch dolana kadar) bekleyip hepsini tek batch_fn çağrısında skorlar.
+    batch_fn bir DataFrame alır ve satır sırasıyla sonuç listesi döndürür.
+    """
+
+    def __init__(
+        self,
+        name,
+        batch_fn,
+        executor,
+        tracker,
+        window_ms=BATCH_WINDOW_MS,
+        max_batch=MAX_BATCH_SIZE,
+    ):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.executor = executor
+        self.tracker = tracker
+        self.window_s = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, rows):
+        """rows: senaryo sözlükleri listesi; her biri için sonuç döner."""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for row in rows:
+            future = loop.create_future()
+            self._queue.put_nowait((row, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def _collect(self):
+        items = [await self._queue.get()]
+        deadline = time.perf_counter() + self.window_s
+        while len(items) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Pencere dolduğunda kuyrukta bekleyenler de aynı batch'e alınır
+        while len(items) < self.max_batch and not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        return items
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._collect()
+            frame = pd.DataFrame([row for row, _ in items], columns=FEATURE_COLUMNS)
+            self.tracker.record_batch(self.name, len(items))
+            try:
+                # Model çağrısı event loop'u bloklamasın diye thread'de çalışır
+                results = await loop.run_in_executor(self.executor, self.batch_fn, frame)
+            except Exception:  # noqa: BLE001 - hatalı satır tek tek skorlanarak ayrıştırılır
+                await self._run_isolated(items, frame)
+                continue
+            for (_, future), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def _run_isolated(self, items, frame):
+        # Batch başarısız olursa satırlar ayrı ayrı skorlanır; hata yalnızca kendi isteğine gider
+        loop = asyncio.get_running_loop()
+        for position, (_, future) in enumerate(items):
+            try:
+                result = await loop.run_in_executor(
+                    self.executor, self.batch_fn, frame.iloc[position:position + 1]
+                )
+            except Exception as exc:  # noqa: BLE001 - hata ilgili isteğe iletilir
+                if not future.done():
+                    future.set_exception(exc)
+                continue
+            if not future.done():
+                future.set_result(result[0])
+
+
+def _predict_batch(engine):
+    def run(frame):
+        with perf.timed("scoring_service.predict_demand"):
+            return [{"demand": float(value)} for value in engine.predict_demand_batch(frame)]
+
+    return run
+
+
+def _optimize_batch(engine):
+    def run(frame):
+        with perf.timed("scoring_service.optimize_price"):
+            result = engine.optimize_prices(frame)
+        return [
+            {
+                "optimal_price": float(row.optimal_price),
+                "optimal_demand": float(row.optimal_demand),
+                "max_revenue": float(row.max_revenue),
+            }
+            for row in result.itertuples(index=False)
+        ]
+
+    return run
+
+
+def _shock_batch(engine):
+    def run(frame):
+        with perf.timed("scoring_service.shock_reason"):
+            _, reasons = engine.predict_demand_batch(frame, with_reason=True)
+        return [{"reason": reason} for reason in reasons]
+
+    return run
+
+
+def parse_scenarios(payload):
+    """JSON gövdesini doğrulanmış senaryo sözlükleri listesine çevirir."""
+    rows = payload if isinstance(payload, list) else [payload]
+    if not rows:
+        raise ValueError("En az bir senaryo gönderilmeli.")
+    scenarios = []
+    for row in rows:
+        if not isinstance(row, dict):
+            raise ValueError("Her senaryo bir JSON nesnesi olmalı.")
+        unknown = [key for key in row if key not in FEATURE_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unknown model features: {unknown}")
+        scenario = {**FEATURE_DEFAULTS, **row}
+        try:
+            values = {column: float(scenario[column]) for column in FEATURE_COLUMNS}
+        except (TypeError, ValueError) as exc:
+            raise ValueError(f"Sayısal olmayan özellik değeri: {exc}") from exc
+        # NaN/sonsuz değerler batch'e girip aynı penceredeki diğer istekleri bozmasın
+        invalid = [column for column, value in values.items() if not math.isfinite(value)]
+        if invalid:
+            raise ValueError(f"Sonlu olmayan özellik değeri: {invalid}")
+        scenarios.append(values)
+    return scenarios
+
+
+class ScoringService:
+    def __init__(self, engine, window_ms=BATCH_WINDOW_MS, max_batch=MAX_BATCH_SIZE, workers=2):
+        self.engine = engine
+        self.tracker = LatencyTracker()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sportpulse-score")
+        self.window_ms = window_ms
+        self.batchers = {
+            f"/{name}": MicroBatcher(
+                name, factory(engine), self.executor, self.tracker, window_ms, max_batch
+            )
+            for name, factory in (
+                ("predict_demand", _predict_batch),
+                ("optimize_price", _optimize_batch),
+                ("shock_reason", _shock_batch),
+            )
+        }
+        self.started_at = time.time()
+        self._server = None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        for batcher in self.batchers.values():
+            batcher.start()
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        return self._server
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for batcher in self.batchers.values():
+            await batcher.stop()
+        self.executor.shutdown(wait=False)
+
+    async def handle(self, method, path, body):
+        """(status, yanıt sözlüğü) döndürür."""
+        if path == "/health":
+            return 200, {
+                "status": "ok",
+                "model_loaded": self.engine.model is not None,
+                "uptime_s": time.time() - self.started_at,
+            }
+        if path == "/metrics":
+            return 200, {"latency": self.tracker.snapshot(), "batch_window_ms": self.window_ms}
+        batcher = self.batchers.get(path)
+        if batcher is None:
+            return 404, {"error": f"Bilinmeyen uç nokta: {path}"}
+        if method != "POST":
+            return 405, {"error": "POST bekleniyor."}
+
+        start = time.perf_counter()
+        try:
+            payload = json.loads(body or b"{}")
+            scenarios = parse_scenarios(payload)
+        except (json.JSONDecodeError, UnicodeDecodeError, ValueError) as exc:
+            return 400, {"error": str(exc)}
+        try:
+            results = await batcher.submit(scenarios)
+        except Exception as exc:  # noqa: BLE001 - model hatası 500 olarak döner
+            return 500, {"error": f"{type(exc).__name__}: {exc}"}
+        self.tracker.record_request(batcher.name, time.perf_counter() - start)
+        return 200, results if isinstance(payload, list) else results[0]
+
+    async def _handle_connection(self, reader, writer):
+        # HTTP/1.1 keep-alive: aynı bağlantı üzerinden ardışık istekler
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    await self._write_response(
+                        writer, 400, {"error": "Geçersiz istek satırı."}, keep_alive=False
+                    )
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length", 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._write_response(
+                        writer, 400, {"error": "Geçersiz Content-Length."}, keep_alive=False
+                    )
+                    break
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if length > MAX_BODY_BYTES:
+                    await self._write_response(
+                        writer, 413, {"error": "İstek gövdesi çok büyük."}, keep_alive=False
+                    )
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload = await self.handle(method.upper(), target.split("?", 1)[0], body)
+                await self._write_response(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _write_response(writer, status, payload, keep_alive=True):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+def load_engine(db_path=DB_PATH):
+    """Kayıtlı artifact'i (yoksa son iyi modeli, o da yoksa eğitimi) kullanarak motoru hazırlar."""
+    engine = DemandEngine()
+    try:
+        engine.load_or_train(db_path=db_path)
+    except FileNotFoundError:
+        if not engine.load_latest_artifact():
+            raise
+    return engine
+
+
+async def serve(host, port, window_ms, max_batch, db_path):
+    service = ScoringService(load_engine(db_path), window_ms=window_ms, max_batch=max_batch)
+    server = await service.start(host, port)
+    print(f"SportPulse skorlama servisi: http://{host}:{port} (batch penceresi {window_ms} ms)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SportPulse headless skorlama servisi")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--window-ms", type=float, default=BATCH_WINDOW_MS)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_SIZE)
+    parser.add_argument("--db-path", default=str(DB_PATH))
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.window_ms, args.max_batch, args.db_path))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,5 +1,8 @@
+import numpy as np
 import pandas as pd
 
+from perf import timed
+
 
 DEFAULT_CAPACITY_BY_FACILITY = {
     1: 90,
@@ -11,6 +14,11 @@ DEFAULT_CAPACITY_BY_FACILITY = {
     7: 85,
     8: 115,
 }
+HOURS_PER_WEEK = 168
+ROLLING_WINDOWS = (7, 28)
+# Günlük kovalarda tutulan toplamlar
+DAILY_METRICS = ("demand", "capacity", "utilization", "capacity_gap")
+SECONDS_PER_DAY = 86400
 
 
 def add_capacity(df, capacity_by_facility=None, default_capacity=100):
@@ -21,29 +29,236 @@ def add_capacity(df, capacity_by_facility=None, default_capacity=100):
     return enriched
 
 
-def build_supply_demand_summary(df):
-    enriched = add_capacity(df)
-    enriched["utilization"] = (enriched["y"] / enriched["capacity"]).clip(0, 1)
-    enriched["capacity_gap"] = (enriched["capacity"] - enriched["y"]).clip(lower=0)
-
-    facility_summary = (
-        enriched.groupby("facility_id", as_index=False)
-        .agg(
-            avg_capacity=("capacity", "mean"),
-            avg_demand=("y", "mean"),
-            avg_utilization=("utilization", "mean"),
-            avg_capacity_gap=("capacity_gap", "mean"),
-        )
-        .sort_values("avg_utilization", ascending=False)
+def capacity_array(df, capacity_by_facility=None, default_capacity=100):
+    """Kaynak tabloyu kopyalamadan satır bazlı kapasite dizisini döndürür."""
+    if "capacity" in df.columns:
+        return df["capacity"].to_numpy(dtype=float)
+    capacity_by_facility = capacity_by_facility or DEFAULT_CAPACITY_BY_FACILITY
+    codes, uniques = pd.factorize(df["facility_id"])
+    per_facility = (
+        pd.Series(uniques).map(capacity_by_facility).fillna(default_capacity).to_numpy(dtype=float)
     )
+    return per_facility[codes]
+
+
+@timed("supply_demand.build_supply_demand_summary")
+def build_supply_demand_summary(df, capacity_by_facility=None, default_capacity=100):
+    # Tam boyutlu kopya ve ek sütunlar yerine NumPy dizileri + bincount
+    capacity = capacity_array(df, capacity_by_facility, default_capacity)
+    demand = df["y"].to_numpy(dtype=float)
+    utilization = np.clip(demand / capacity, 0, 1)
+    capacity_gap = np.clip(capacity - demand, 0, None)
+
+    codes, facility_ids = pd.factorize(df["facility_id"], sort=True)
+    counts = np.bincount(codes, minlength=len(facility_ids))
+
+    def facility_mean(values):
+        return np.bincount(codes, weights=values, minlength=len(facility_ids)) / counts
+
+    facility_summary = pd.DataFrame(
+        {
+            "facility_id": facility_ids,
+            "avg_capacity": facility_mean(capacity),
+            "avg_demand": facility_mean(demand),
+            "avg_utilization": facility_mean(utilization),
+            "avg_capacity_gap": facility_mean(capacity_gap),
+        }
+    ).sort_values("avg_utilization", ascending=False)
 
     overall_summary = pd.DataFrame(
         {
-            "avg_capacity": [enriched["capacity"].mean()],
-            "avg_demand": [enriched["y"].mean()],
-            "avg_utilization": [enriched["utilization"].mean()],
-            "avg_capacity_gap": [enriched["capacity_gap"].mean()],
+            "avg_capacity": [capacity.mean()],
+            "avg_demand": [demand.mean()],
+            "avg_utilization": [utilization.mean()],
+            "avg_capacity_gap": [capacity_gap.mean()],
         }
     )
 
     return facility_summary, overall_summary
+
+
+class UtilizationEngine:
+    """
+    Tesis x hafta-saati (168) ve tesis x gün kullanım / kapasite açığı matrislerini
+    artımlı olarak tutar. Gözlemler update() ile parça parça eklenir; yalnızca
+    kompakt toplam/sayaç dizileri saklanır, kaynak tablo kopyalanmaz.
+    Rolling 7/28 günlük pencereler günlük kovalardan kümülatif toplamla türetilir.
+    """
+
+    def __init__(self, capacity_by_facility=None, default_capacity=100):
+        self.capacity_by_facility = capacity_by_facility or DEFAULT_CAPACITY_BY_FACILITY
+        self.default_capacity = default_capacity
+        self.facility_ids = np.zeros(0, dtype=np.int64)
+        self.first_day = None
+        self.last_ds = None
+        # update_from_db'nin kaldığı yer: (generation, max_rowid)
+        self.watermark = None
+        self._how = {metric: np.zeros((0, HOURS_PER_WEEK)) for metric in DAILY_METRICS}
+        self._how_count = np.zeros((0, HOURS_PER_WEEK))
+        self._daily = {metric: np.zeros((0, 0)) for metric in DAILY_METRICS}
+        self._daily_count = np.zeros((0, 0))
+
+    @property
+    def n_days(self):
+        return self._daily_count.shape[1]
+
+    def _facility_positions(self, facility_ids):
+        # Yeni tesisler matrislerin sonuna satır olarak eklenir
+        new_ids = np.setdiff1d(np.unique(facility_ids), self.facility_ids)
+        if len(new_ids):
+            self.facility_ids = np.concatenate([self.facility_ids, new_ids])
+            extra = len(new_ids)
+            for metric in DAILY_METRICS:
+                self._how[metric] = np.pad(self._how[metric], ((0, extra), (0, 0)))
+                self._daily[metric] = np.pad(self._daily[metric], ((0, extra), (0, 0)))
+            self._how_count = np.pad(self._how_count, ((0, extra), (0, 0)))
+            self._daily_count = np.pad(self._daily_count, ((0, extra), (0, 0)))
+        order = np.argsort(self.facility_ids)
+        return order[np.searchsorted(self.facility_ids, facility_ids, sorter=order)]
+
+    def _extend_days(self, min_day, max_day):
+        if self.first_day is None:
+            self.first_day = min_day
+        before = max(0, self.first_day - min_day)
+        after = max(0, max_day - (self.first_day + self.n_days - 1))
+        if before or after:
+            for metric in DAILY_METRICS:
+                self._daily[metric] = np.pad(self._daily[metric], ((0, 0), (before, after)))
+            self._daily_count = np.pad(self._daily_count, ((0, 0), (before, after)))
+            self.first_day -= before
+
+    @timed("supply_demand.UtilizationEngine.update")
+    def update(self, df):
+        """Yeni gözlemleri (ds, facility_id, y ve opsiyonel capacity) toplamlara ekler."""
+        if len(df) == 0:
+            return self
+        seconds = pd.to_datetime(df["ds"]).to_numpy(dtype="datetime64[s]").astype(np.int64)
+        days = seconds // SECONDS_PER_DAY
+        # 1970-01-01 Perşembe; +3 ile Pazartesi=0
+        hour_of_week = ((days + 3) % 7) * 24 + (seconds % SECONDS_PER_DAY) // 3600
+
+        demand = df["y"].to_numpy(dtype=float)
+        capacity = capacity_array(df, self.capacity_by_facility, self.default_capacity)
+        values = {
+            "demand": demand,
+            "capacity": capacity,
+            "utilization": np.clip(demand / capacity, 0, 1),
+            "capacity_gap": np.clip(capacity - demand, 0, None),
+        }
+
+        positions = self._facility_positions(df["facility_id"].to_numpy())
+        self._extend_days(int(days.min()), int(days.max()))
+        n_facilities = len(self.facility_ids)
+
+        how_index = positions * HOURS_PER_WEEK + hour_of_week
+        how_size = n_facilities * HOURS_PER_WEEK
+        day_index = positions * self.n_days + (days - self.first_day)
+        day_size = n_facilities * self.n_days
+
+        self._how_count += np.bincount(how_index, minlength=how_size).reshape(self._how_count.shape)
+        self._daily_count += np.bincount(day_index, minlength=day_size).reshape(self._daily_count.shape)
+        for metric, metric_values in values.items():
+            self._how[metric] += np.bincount(
+                how_index, weights=metric_values, minlength=how_size
+            ).reshape(self._how_count.shape)
+            self._daily[metric] += np.bincount(
+                day_index, weights=metric_values, minlength=day_size
+            ).reshape(self._daily_count.shape)
+
+        latest = int(seconds.max())
+        self.last_ds = latest if self.last_ds is None else max(self.last_ds, latest)
+        return self
+
+    def reset(self):
+        """Tüm toplamları siler; sonraki update_from_db tabloyu baştan okur."""
+        self.__init__(self.capacity_by_facility, self.default_capacity)
+        return self
+
+    def update_from_db(self, db_path=None, chunksize=500_000):
+        """
+        SQLite'tan yalnızca son okunan rowid'den sonra eklenen satırları parça parça okuyup ekler.
+        Geç gelen/geriye dönük satırlar da rowid ile yakalanır. Tablo yeniden yazıldıysa veya
+        satırlar yerinde güncellendiyse (generation değişti) toplamlar sıfırlanıp baştan kurulur.
+        """
+        from data_gen import DB_PATH, load_sport_data
+        from db_connection import get_manager
+        from schema import ensure_schema, read_watermark
+
+        db_path = db_path or DB_PATH
+        ensure_schema(db_path)
+        with get_manager(db_path).reader() as conn:
+            generation, max_rowid, _ = read_watermark(conn)
+        if self.watermark is not None and self.watermark[0] != generation:
+            self.reset()
+        last_rowid = 0 if self.watermark is None else self.watermark[1]
+        if max_rowid > last_rowid:
+            for chunk in load_sport_data(
+                db_path,
+                columns=["ds", "facility_id", "y"],
+                chunksize=chunksize,
+                compact=True,
+                after_rowid=last_rowid,
+                until_rowid=max_rowid,
+            ):
+                self.update(chunk)
+        self.watermark = (generation, max_rowid)
+        return self
+
+    def _check_metric(self, metric):
+        if metric not in DAILY_METRICS:
+            raise ValueError(f"Unknown metric: {metric}. Choose from {DAILY_METRICS}")
+
+    def _frame(self, sums, counts, columns):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / counts, np.nan)
+        order = np.argsort(self.facility_ids)
+        return pd.DataFrame(
+            means[order],
+            index=pd.Index(self.facility_ids[order], name="facility_id"),
+            columns=columns,
+        )
+
+    def _day_columns(self):
+        if self.first_day is None:
+            return pd.DatetimeIndex([], name="day")
+        return pd.DatetimeIndex(
+            pd.to_datetime(np.arange(self.first_day, self.first_day + self.n_days), unit="D"),
+            name="day",
+        )
+
+    def hour_of_week_matrix(self, metric="utilization"):
+        """Tesis x hafta-saati (0 = Pazartesi 00:00) ortalama matrisi."""
+        self._check_metric(metric)
+        return self._frame(
+            self._how[metric], self._how_count, pd.RangeIndex(HOURS_PER_WEEK, name="hour_of_week")
+        )
+
+    def daily_matrix(self, metric="utilization"):
+        """Tesis x gün ortalama matrisi."""
+        self._check_metric(metric)
+        return self._frame(self._daily[metric], self._daily_count, self._day_columns())
+
+    def rolling_matrix(self, window_days=7, metric="utilization"):
+        """Tesis x gün, her gün için son window_days günün (gözlem ağırlıklı) ortalaması."""
+        self._check_metric(metric)
+
+        def window_sum(values):
+            cumulative = np.cumsum(values, axis=1)
+            shifted = np.zeros_like(cumulative)
+            shifted[:, window_days:] = cumulative[:, :-window_days]
+            return cumulative - shifted
+
+        return self._frame(
+            window_sum(self._daily[metric]), window_sum(self._daily_count), self._day_columns()
+        )
+
+    def current_windows(self, windows=ROLLING_WINDOWS, metric="utilization"):
+        """Son gözlenen güne göre her pencere için tesis bazlı ortalamalar."""
+        self._check_metric(metric)
+        result = {}
+        for window_days in windows:
+            start = max(0, self.n_days - window_days)
+            sums = self._daily[metric][:, start:].sum(axis=1, keepdims=True)
+            counts = self._daily_count[:, start:].sum(axis=1, keepdims=True)
+            result[f"{metric}_{window_days}d"] = self._frame(sums, counts, ["value"])["value"]
+        return pd.DataFrame(result)
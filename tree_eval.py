@@ -0,0 +1,109 @@
+import json
+
+import numpy as np
+
+# Kimlik bağlantılı (margin = tahmin) hedefler; diğerlerinde derlenmiş yol kullanılmaz
+SUPPORTED_OBJECTIVES = ("reg:squarederror", "reg:absoluteerror", "reg:pseudohubererror")
+
+
+class CompiledForest:
+    """
+    XGBoost booster'ının ağaçlarını düz NumPy dizilerine (özellik, eşik, sol/sağ çocuk,
+    eksik değer yönü, yaprak değeri) derler ve satırlar üzerinde vektörel değerlendirir.
+    Tek satırlık çağrılarda DMatrix kurulumu ve thread dağıtımı maliyeti ortadan kalkar.
+    Yapraklar kendilerine işaret eder; böylece tüm ağaçlar en derin ağaç kadar adımda biter.
+    """
+
+    def __init__(
+        self, roots, feature, threshold, left, right, default_left, value, base_score, depth
+    ):
+        self.roots = roots
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.value = value
+        self.base_score = base_score
+        self.depth = depth
+        # Düğüm i'nin çocukları children[2i] (sol) ve children[2i + 1] (sağ): tek gather ile geçiş
+        self.children = np.column_stack([left, right]).ravel()
+
+    @classmethod
+    def from_booster(cls, booster):
+        """Booster'ın JSON dökümünden derler; desteklenmeyen modelde ValueError fırlatır."""
+        learner = json.loads(booster.save_raw("json"))["learner"]
+        objective = learner["objective"]["name"]
+        if objective not in SUPPORTED_OBJECTIVES:
+            raise ValueError(f"Unsupported objective for compiled backend: {objective}")
+        model = learner["gradient_booster"]["model"]
+        if learner["gradient_booster"].get("name", "gbtree") != "gbtree":
+            raise ValueError("Compiled backend only supports gbtree boosters.")
+        # XGBoost 3 base_score'u "[1.49E0]" biçiminde vektör olarak yazar
+        base_score = float(learner["learner_model_param"]["base_score"].strip("[]").split(",")[0])
+
+        roots, features, thresholds, lefts, rights, defaults, values = [], [], [], [], [], [], []
+        offset = 0
+        depth = 0
+        for tree in model["trees"]:
+            if any(tree.get("split_type", [])):
+                raise ValueError("Compiled backend does not support categorical splits.")
+            left = np.asarray(tree["left_children"], dtype=np.int64)
+            right = np.asarray(tree["right_children"], dtype=np.int64)
+            node_ids = np.arange(len(left))
+            is_leaf = left == -1
+
+            roots.append(offset)
+            features.append(np.where(is_leaf, 0, tree["split_indices"]))
+            thresholds.append(np.asarray(tree["split_conditions"], dtype=np.float32))
+            lefts.append(np.where(is_leaf, node_ids, left) + offset)
+            rights.append(np.where(is_leaf, node_ids, right) + offset)
+            defaults.append(np.asarray(tree["default_left"], dtype=bool))
+            values.append(np.where(is_leaf, np.asarray(tree["split_conditions"], dtype=np.float32), 0))
+            depth = max(depth, _tree_depth(left, right))
+            offset += len(left)
+
+        if not roots:
+            raise ValueError("Booster has no trees.")
+        return cls(
+            roots=np.asarray(roots, dtype=np.int64),
+            feature=np.concatenate(features).astype(np.int64),
+            threshold=np.concatenate(thresholds).astype(np.float32),
+            left=np.concatenate(lefts),
+            right=np.concatenate(rights),
+            default_left=np.concatenate(defaults),
+            value=np.concatenate(values).astype(np.float32),
+            base_score=np.float32(base_score),
+            depth=depth,
+        )
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def predict(self, matrix):
+        """matrix: (satır, özellik) dizisi; booster'ın predict çıktısıyla aynı margin'i döndürür."""
+        # XGBoost girdileri float32'ye çevirip eşiklerle `x < eşik` ile karşılaştırır
+        matrix = np.ascontiguousarray(np.atleast_2d(matrix), dtype=np.float32)
+        flat = matrix.ravel()
+        row_offsets = (np.arange(len(matrix)) * matrix.shape[1])[:, None]
+        has_missing = np.isnan(flat).any()
+        nodes = np.broadcast_to(self.roots, (len(matrix), self.n_trees))
+        for _ in range(self.depth):
+            values = flat[row_offsets + self.feature[nodes]]
+            go_right = values >= self.threshold[nodes]
+            if has_missing:
+                go_right = np.where(np.isnan(values), ~self.default_left[nodes], go_right)
+            nodes = self.children[2 * nodes + go_right]
+        return self.value[nodes].sum(axis=1, dtype=np.float32) + self.base_score
+
+
+def _tree_depth(left, right):
+    depth = 0
+    frontier = [0]
+    while True:
+        children = [child for node in frontier for child in (left[node], right[node]) if child != -1]
+        if not children:
+            return depth
+        depth += 1
+        frontier = children